@@ -1,15 +1,120 @@
-from fastapi import FastAPI
-from app.routers import child_preferences_agent, adult_preferences_agent, shared_preferences_agent, format_output_agent, save_meal_plan
+from app.utils.startup_timing import timed_phase, format_phases, phase_seconds
+from contextlib import asynccontextmanager
+import asyncio
+import importlib
 
-app = FastAPI()
+# The heavy third-party imports the routers pull in
+LIBRARY_MODULES = ["confluent_kafka", "fastapi", "langchain_anthropic", "langgraph.prebuilt", "motor.motor_asyncio"]
+
+ROUTER_MODULES = [
+    "child_preferences_agent", "adult_preferences_agent", "preference_join", "shared_preferences_agent",
+    "format_output_agent", "save_meal_plan", "meal_plan_pipeline", "preferences", "jobs", "llm_cache", "token_usage",
+]
+
+# Third-party libraries first, then each router on its own, so the startup
+# breakdown shows what is ours. None of the routers build a model at import.
+# Imported by name, like the routers, since nothing here uses them directly.
+with timed_phase("import.libraries"):
+    for name in LIBRARY_MODULES:
+        importlib.import_module(name)
+
+for name in ROUTER_MODULES:
+    with timed_phase(f"import.{name}"):
+        importlib.import_module(f"app.routers.{name}")
+
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from app.routers import child_preferences_agent, adult_preferences_agent, shared_preferences_agent, format_output_agent, save_meal_plan, preferences, jobs, meal_plan_pipeline, llm_cache, token_usage, preference_join
+from app.utils import database
+from app.utils.publish_to_topic import start_producer, stop_producer
+from app.utils.preferences_cache import start_preference_watcher, ensure_preference_indexes
+from app.utils.job_scheduler import scheduler
+from app.utils.checkpointer import close_checkpointer, prune_checkpoints_periodically
+from app.utils.dedup import ensure_dedup_indexes
+from app.utils.recent_meals import ensure_recent_meals_indexes
+from app.utils.plan_candidates import ensure_candidate_indexes
+from app.pregeneration import start_pregeneration
+from app.utils.preference_join import preference_join as join_state
+from app.utils.model_provider import close_models, build_seconds
+from app.utils.telemetry import get_logger
+
+logger = get_logger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared MongoDB connection pool before serving requests
+    with timed_phase("startup.database"):
+        await database.connect()
+    with timed_phase("startup.indexes"):
+        await ensure_dedup_indexes()
+        await ensure_recent_meals_indexes()
+        await ensure_preference_indexes()
+        await ensure_candidate_indexes()
+    with timed_phase("startup.producer"):
+        start_producer()
+    preference_watcher = start_preference_watcher()
+    scheduler.start()
+    join_expiry = asyncio.create_task(join_state.expire_periodically())
+    checkpoint_pruning = asyncio.create_task(prune_checkpoints_periodically())
+    # Off-peak pre-generation of next week's plans, when PREGENERATE is on
+    pregeneration = start_pregeneration()
+
+    logger.info("imports: %s", format_phases("import."))
+    logger.info("startup: %s", format_phases("startup."))
+
+    yield
+
+    join_expiry.cancel()
+    checkpoint_pruning.cancel()
+
+    # A plan generated halfway is picked up again once its lease runs out
+    if pregeneration is not None:
+        pregeneration.cancel()
+
+    # Stop accepting new agent runs and let queued ones finish
+    await scheduler.shutdown()
+
+    # The HTTP connectors were already told these plans were handled, so don't lose them with the process
+    join_state.drop_all("shutdown")
+    try:
+        await join_state.dead_letter_dropped()
+    except Exception:
+        logger.exception("join: dead-lettering half-joined plans at shutdown failed")
+
+    if preference_watcher is not None:
+        preference_watcher.cancel()
+
+    # Drain buffered messages off the event loop before closing connections
+    await asyncio.to_thread(stop_producer)
+    await close_checkpointer()
+    await close_models()
+    database.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Include the routers
 app.include_router(child_preferences_agent.router, prefix="/api", tags=["Child Preferences"])
 app.include_router(adult_preferences_agent.router, prefix="/api", tags=["Adult Preferences"])
+app.include_router(preference_join.router, prefix="/api", tags=["Preference Join"])
 app.include_router(shared_preferences_agent.router, prefix="/api", tags=["Shared Meal Plan"])
 app.include_router(format_output_agent.router, prefix="/api", tags=["Format Meal Plan"])
 app.include_router(save_meal_plan.router, prefix="/api", tags=["Save Meal Plan"])
+app.include_router(meal_plan_pipeline.router, prefix="/api", tags=["Meal Plan Pipeline"])
+app.include_router(preferences.router, prefix="/api", tags=["Preferences"])
+app.include_router(jobs.router, prefix="/api", tags=["Jobs"])
+app.include_router(llm_cache.router, prefix="/api", tags=["LLM Cache"])
+app.include_router(token_usage.router, prefix="/api", tags=["Token Usage"])
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the API!"}
\ No newline at end of file
+    return {"message": "Welcome to the API!"}
+
+@app.get("/api/startup-stats")
+def startup_stats():
+    # Import and startup phases, plus the models, graphs and chains built so far and how long each took
+    return {"phases": phase_seconds, "components": build_seconds}
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape endpoint for stage latency, in-flight requests, model turns and failures
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,100 @@
+"""Runs the whole meal plan flow in-process, without hopping through Kafka
+topics and HTTP sink connectors between stages.
+
+    python -m app.pipeline <request_id> [--publish]
+"""
+from dotenv import load_dotenv
+import asyncio
+import os
+import sys
+import time
+from app.routers import child_preferences_agent, adult_preferences_agent, shared_preferences_agent, format_output_agent, save_meal_plan
+from app.utils import database
+from app.utils.publish_to_topic import produce, stop_producer
+from app.utils.telemetry import get_logger, stage_span
+from app.utils.constants import CHILD_PREFERENCES_OUTPUT_TOPIC, ADULT_PREFERENCES_OUTPUT_TOPIC, COMPLETE_MEAL_PLAN_OUTPUT_TOPIC, FORMATTED_MEAL_PLAN_OUTPUT_TOPIC
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Publish each stage's output to its usual topic so observers still see the events.
+# Don't point the HTTP sink connectors at these topics while this is on, or every stage runs twice.
+PUBLISH_EVENTS = os.getenv("PIPELINE_PUBLISH_EVENTS", "false").lower() == "true"
+
+async def generate_meal_plan(request_id, publish=PUBLISH_EVENTS, timings=None):
+    """Runs every agent stage for a request and returns the formatted meal
+    plan without saving it. Each stage's seconds are added to timings."""
+    timings = {} if timings is None else timings
+
+    async def timed(stage, coro):
+        with stage_span(stage, request_id):
+            start_time = time.perf_counter()
+            result = await coro
+            timings[stage] = time.perf_counter() - start_time
+            return result
+
+    # The child and adult plans don't depend on each other
+    child_plan, adult_plan = await asyncio.gather(
+        timed("child-preferences", child_preferences_agent.run_agent(request_id)),
+        timed("adult-preferences", adult_preferences_agent.run_agent(request_id)),
+    )
+    if publish:
+        await asyncio.gather(
+            produce(CHILD_PREFERENCES_OUTPUT_TOPIC, { "content": child_plan, "request_id": request_id }),
+            produce(ADULT_PREFERENCES_OUTPUT_TOPIC, { "content": adult_plan, "request_id": request_id }),
+        )
+
+    meal_plan, formatted_meal_plan = await timed("shared-preferences", shared_preferences_agent.run_agent(request_id, child_plan, adult_plan))
+
+    # The shared agent may already have produced a valid structured plan
+    if formatted_meal_plan is None:
+        if publish:
+            await produce(COMPLETE_MEAL_PLAN_OUTPUT_TOPIC, { "meal_plan": meal_plan, "request_id": request_id })
+
+        formatted_meal_plan = await timed("format-output", format_output_agent.run_agent(
+            request_id, meal_plan, format_output_agent.meal_publisher(request_id) if publish else None,
+        ))
+
+    if publish:
+        await produce(FORMATTED_MEAL_PLAN_OUTPUT_TOPIC, { "meal_plan": formatted_meal_plan, "request_id": request_id })
+
+    return formatted_meal_plan
+
+async def run_pipeline(request_id, publish=PUBLISH_EVENTS):
+    timings = {}
+
+    # A plan pre-generated off-peak skips every agent stage
+    start_time = time.perf_counter()
+    if await save_meal_plan.save_candidate(request_id):
+        timings["save-candidate"] = time.perf_counter() - start_time
+        logger.info("pipeline: served a pre-generated plan in %.2fs", timings["save-candidate"])
+        return timings
+
+    formatted_meal_plan = await generate_meal_plan(request_id, publish, timings)
+
+    # save_meal_plans records its own stage span
+    start_time = time.perf_counter()
+    await save_meal_plan.save_meal_plans([{ "request_id": request_id, "meal_plan": formatted_meal_plan }])
+    timings["save-meal-plan"] = time.perf_counter() - start_time
+
+    logger.info("pipeline: %s", ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
+
+    return timings
+
+async def main(request_id, publish):
+    await database.connect()
+
+    try:
+        await run_pipeline(request_id, publish)
+    finally:
+        await asyncio.to_thread(stop_producer)
+        database.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    asyncio.run(main(sys.argv[1], "--publish" in sys.argv[2:] or PUBLISH_EVENTS))
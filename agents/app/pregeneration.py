@@ -0,0 +1,201 @@
+"""Pre-generates next week's meal plan for every household during off-peak
+hours. The plan is stored as a candidate, and a request for that week is
+saved straight from it while it still matches the household's preferences
+and recent meals, instead of waiting on the agents.
+
+    python -m app.pregeneration [--limit 100]
+
+The command runs one pass right away; the API runs passes on a schedule
+when PREGENERATE is true.
+"""
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import os
+import time
+from app.pipeline import generate_meal_plan
+from app.utils import database
+from app.utils.database import get_collection
+from app.utils.common_utils import start_of_week
+from app.utils.households import household_of, remember_request_household
+from app.utils.preferences_cache import load_preference_snapshot, SNAPSHOT_PROJECTION
+from app.utils.plan_candidates import (
+    lease_candidate, store_candidate, release_candidate, preferences_fingerprint, candidate_counts, ensure_candidate_indexes,
+    stats as claim_stats, CANDIDATE_LEASE_SECONDS,
+)
+from app.utils.rate_limiter import background_work
+from app.utils.telemetry import get_logger
+from app.utils.constants import MEAL_PREFERENCES_COLLECTION, MEAL_PLAN_CANDIDATES_COLLECTION
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+PREGENERATE = os.getenv("PREGENERATE", "false").lower() == "true"
+# Local hours passes run in, e.g. "1-5" is 01:00 to 05:00 and "22-4" wraps past midnight
+PREGENERATE_HOURS = os.getenv("PREGENERATE_HOURS", "1-5")
+PREGENERATE_CONCURRENCY = int(os.getenv("PREGENERATE_CONCURRENCY", "2"))
+PREGENERATE_INTERVAL_SECONDS = float(os.getenv("PREGENERATE_INTERVAL_SECONDS", "900"))
+# Households generated per pass at most, 0 for no limit
+PREGENERATE_BATCH = int(os.getenv("PREGENERATE_BATCH", "0"))
+
+# Households read per page; paging by _id keeps no cursor open while plans are generated
+PAGE_SIZE = 100
+
+stats = {"passes": 0, "generated": 0, "failed": 0, "skipped": 0, "last_pass_seconds": None}
+
+def in_off_peak_hours(now=None, hours=PREGENERATE_HOURS):
+    start, _, end = hours.partition("-")
+    start, end = int(start), int(end)
+    hour = (now or datetime.now()).hour
+
+    if start <= end:
+        return start <= hour < end
+
+    return hour >= start or hour < end
+
+def next_week_start():
+    return (start_of_week() + timedelta(weeks=1)).isoformat()
+
+def is_due(candidate, fingerprint):
+    # Whether a household's candidate for the week needs generating (again)
+    if candidate is None:
+        return True
+    if candidate["status"] == "ready":
+        return candidate.get("preferences_fingerprint") != fingerprint
+    if candidate["status"] == "generating":
+        # A replica that died mid-generation leaves its lease behind
+        lease_until = candidate.get("lease_until")
+        return lease_until is None or lease_until.replace(tzinfo=timezone.utc) < datetime.now(timezone.utc)
+
+    # used and stale weeks were already requested
+    return candidate["status"] == "failed"
+
+async def pregenerate_household(household_id, start_date):
+    # The preferences the agents are about to use: they read past the cache too, and live requests keep their cached copy
+    fingerprint = preferences_fingerprint(await load_preference_snapshot(household_id))
+
+    # Its own request id keeps the agents' checkpoints and logs apart from real requests
+    generation_id = str(ObjectId())
+    if not await lease_candidate(household_id, start_date, fingerprint, generation_id):
+        stats["skipped"] += 1
+        return
+
+    remember_request_household(generation_id, household_id)
+    token = background_work.set(True)
+    try:
+        meal_plan = await generate_meal_plan(generation_id, publish=False)
+    except Exception:
+        stats["failed"] += 1
+        logger.exception("pregenerate: %s week of %s failed", household_id, start_date)
+        await release_candidate(household_id, start_date, generation_id)
+        return
+    finally:
+        background_work.reset(token)
+
+    if await store_candidate(household_id, start_date, generation_id, meal_plan, fingerprint):
+        stats["generated"] += 1
+    else:
+        # The lease ran out and another replica took the household over
+        stats["skipped"] += 1
+
+async def pregenerate_pass(limit=PREGENERATE_BATCH, off_peak_only=True):
+    """Generates next week's candidate for every household that doesn't have
+    a valid one, stopping when off-peak hours end or after limit households."""
+    start_date = next_week_start()
+    preferences = get_collection(MEAL_PREFERENCES_COLLECTION)
+    candidates = get_collection(MEAL_PLAN_CANDIDATES_COLLECTION)
+    semaphore = asyncio.Semaphore(PREGENERATE_CONCURRENCY)
+    started = 0
+    start_time = time.perf_counter()
+
+    def stopping():
+        return (limit and started >= limit) or (off_peak_only and not in_off_peak_hours())
+
+    async def generate(household_id):
+        nonlocal started
+        async with semaphore:
+            if stopping():
+                return
+
+            started += 1
+            await pregenerate_household(household_id, start_date)
+
+    last_id = None
+    while not stopping():
+        page = await preferences.find({"_id": {"$gt": last_id}} if last_id else {}, {**SNAPSHOT_PROJECTION, "_id": 1, "householdId": 1}) \
+            .sort("_id", 1).limit(PAGE_SIZE).to_list(length=PAGE_SIZE)
+        if not page:
+            break
+        last_id = page[-1]["_id"]
+
+        households = {}
+        for document in page:
+            # Fingerprinted the same way as the snapshot the agents read
+            snapshot = {key: value for key, value in document.items() if key not in ("_id", "householdId")}
+            households[household_of(document)] = preferences_fingerprint(snapshot)
+
+        existing = {
+            doc["householdId"]: doc async for doc in candidates.find(
+                {"householdId": {"$in": list(households)}, "startDate": start_date},
+                {"householdId": 1, "status": 1, "preferences_fingerprint": 1, "lease_until": 1},
+            )
+        }
+
+        due = [household_id for household_id, fingerprint in households.items() if is_due(existing.get(household_id), fingerprint)]
+        stats["skipped"] += len(households) - len(due)
+
+        await asyncio.gather(*(generate(household_id) for household_id in due))
+
+    stats["passes"] += 1
+    stats["last_pass_seconds"] = time.perf_counter() - start_time
+    logger.info("pregenerate: week of %s, %d household(s) started in %.1fs (%s)", start_date, started, stats["last_pass_seconds"], stats)
+
+async def pregenerate_periodically():
+    while True:
+        if in_off_peak_hours():
+            try:
+                await pregenerate_pass()
+            except Exception:
+                logger.exception("pregenerate: pass failed")
+
+        await asyncio.sleep(PREGENERATE_INTERVAL_SECONDS)
+
+def start_pregeneration():
+    if not PREGENERATE:
+        return None
+
+    return asyncio.create_task(pregenerate_periodically())
+
+async def pregeneration_stats():
+    start_date = next_week_start()
+
+    return {
+        "enabled": PREGENERATE,
+        "hours": PREGENERATE_HOURS,
+        "off_peak": in_off_peak_hours(),
+        "lease_seconds": CANDIDATE_LEASE_SECONDS,
+        "week": start_date,
+        **stats,
+        "candidates": await candidate_counts(start_date),
+        "claims": claim_stats,
+    }
+
+async def main(limit):
+    await database.connect()
+
+    try:
+        await ensure_candidate_indexes()
+        await pregenerate_pass(limit, off_peak_only=False)
+    finally:
+        database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=PREGENERATE_BATCH, help="households to generate at most, 0 for all")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.limit))
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, Response, Request
-from langchain_anthropic import ChatAnthropic
 from langgraph.prebuilt import create_react_agent
 from dotenv import load_dotenv
-import json
-import asyncio
-from ..utils.common_utils import get_kid_preferences, get_hard_requirements, get_recent_meals, get_meal_count
+import time
+from ..utils.common_utils import get_kid_preferences, get_hard_requirements, get_recent_meals, get_meal_count, prefetch_tool_context, count_model_turns, project_change_event, PREFETCH_CONTEXT
 from ..utils.publish_to_topic import produce
+from ..utils.serialization import read_json
+from ..utils.model_provider import get_model, get_component, cached_system_prompt
+from ..utils.job_scheduler import scheduler, SchedulerUnavailable
+from ..utils.dedup import get_deduplicator
+from ..utils.households import household_scoped
+from .save_meal_plan import save_candidate
+from ..utils.telemetry import get_logger, log_payload
 from ..utils.constants import CHILD_PREFERENCES_OUTPUT_TOPIC
 
 # Load environment variables from .env file
@@ -13,7 +18,10 @@ load_dotenv()
 
 router = APIRouter()
 
-model = ChatAnthropic(model='claude-3-5-haiku-20241022', temperature=0.7)
+logger = get_logger(__name__)
+
+STAGE = "child-preferences"
+scheduler.register_stage(STAGE)
 
 tools = [get_kid_preferences, get_hard_requirements, get_recent_meals]
 
@@ -26,35 +34,80 @@ SYSTEM_PROMPT = """You are an expert at designing nutritious meals that toddlers
     There is no human in the loop, so don't prompt for additional input.
     """
 
-graph = create_react_agent(model, tools=tools, state_modifier=SYSTEM_PROMPT)
+def get_graph():
+    return get_component(STAGE, lambda: create_react_agent(get_model(STAGE), tools=tools, state_modifier=cached_system_prompt(SYSTEM_PROMPT)))
 
-async def start_agent_flow(request_id):
-    meal_count = get_meal_count()
+@household_scoped
+async def run_agent(request_id):
+    meal_count = await get_meal_count()
+    user_input = f"Plan {meal_count} dinners for my children."
+
+    start_time = time.perf_counter()
+
+    if PREFETCH_CONTEXT:
+        # Fetch everything the tools would return and plan in a single model call
+        context = await prefetch_tool_context(tools)
+        user_input = f"""{user_input}
+                    Here is everything you have access to:
+                    {context}
+                    """
 
-    inputs = {"messages": [("user", f"Plan {meal_count} dinners for my children.")]}
-    response = await graph.ainvoke(inputs)
+        messages = [await get_model(STAGE).ainvoke([cached_system_prompt(SYSTEM_PROMPT), ("user", user_input)])]
+    else:
+        response = await get_graph().ainvoke({"messages": [("user", user_input)]})
+        messages = response["messages"]
 
-    last_message_content = response["messages"][-1]
+    mode = "prefetched" if PREFETCH_CONTEXT else "tool-calling"
+    logger.info("child plan: %d model turn(s) in %.2fs (%s)", count_model_turns(messages), time.perf_counter() - start_time, mode)
+
+    last_message_content = messages[-1]
     content = last_message_content.pretty_repr()
 
-    print(content)
-    produce(CHILD_PREFERENCES_OUTPUT_TOPIC, { "content": content, "request_id": request_id })
+    log_payload(logger, "meal plan", content)
+
+    return content
+
+async def run_and_publish(request_id):
+    # A plan pre-generated off-peak is saved straight away and nothing is published
+    if await save_candidate(request_id):
+        return { "request_id": request_id, "candidate": True }
+
+    content = await run_agent(request_id)
+    output = { "content": content, "request_id": request_id }
+
+    await produce(CHILD_PREFERENCES_OUTPUT_TOPIC, output)
+
+    return output
+
+def parse_request(item):
+    # start_agent_flow arguments for a change stream record, or None to skip it
+    request_id = project_change_event(item)["request_id"]
+    return (request_id,) if request_id is not None else None
+
+async def start_agent_flow(request_id):
+    # Redelivered change events join or replay the first run instead of publishing twice
+    return await get_deduplicator(STAGE).run(request_id, run_and_publish, request_id)
 
 @router.api_route("/child-preferences-agent", methods=["GET", "POST"])
 async def get_child_meal_plan(request: Request):
-    print("get_child_meal_plan")
     if request.method == "POST":
-        data = await request.json()
+        # Only the request id is kept from each change event
+        data = [project_change_event(item) for item in await read_json(request)]
 
-        print(data)
+        logger.info("get_child_meal_plan: %d record(s)", len(data))
+        log_payload(logger, "request", data)
 
+        jobs = []
         for item in data:
-            oid_raw = item.get('fullDocument', {}).get('_id', '{}')
-            request_id = json.loads(oid_raw).get('$oid') if oid_raw else None
-
-            print(request_id)
+            request_id = item["request_id"]
 
             if request_id is not None:
-                asyncio.create_task(start_agent_flow(request_id))
+                jobs.append((request_id, start_agent_flow, (request_id,)))
+
+        try:
+            scheduler.submit_all(STAGE, jobs)
+        except SchedulerUnavailable as e:
+            # Tell the connector to back off and retry the batch
+            return Response(content=str(e), media_type="text/plain", status_code=e.status_code, headers={"Retry-After": "5"})
 
         return Response(content="Child Meal Planning Agent Started", media_type="text/plain", status_code=200)
@@ -1,29 +1,41 @@
 from fastapi import APIRouter, Response, Request
-from langchain_anthropic import ChatAnthropic
 from langgraph.prebuilt import create_react_agent
-import asyncio
+from langchain_core.messages import AIMessageChunk
 import json
-import re
+import os
+import time
 from dotenv import load_dotenv
 from ..utils.common_utils import get_first_day_of_week
+from ..utils.json_stream import MealStreamParser, message_text, repair_json
+from ..utils.grocery_list import with_grocery_list
 from ..utils.publish_to_topic import produce
-from ..utils.constants import FORMATTED_MEAL_PLAN_OUTPUT_TOPIC
+from ..utils.serialization import read_json
+from ..utils.model_provider import get_model, get_component, cached_system_prompt
+from ..utils.job_scheduler import scheduler, SchedulerUnavailable
+from ..utils.dedup import get_deduplicator
+from ..utils.telemetry import get_logger, log_payload, FIRST_MEAL_LATENCY
+from ..utils.constants import FORMATTED_MEAL_PLAN_OUTPUT_TOPIC, FORMATTED_MEAL_OUTPUT_TOPIC
 
 # Load environment variables from .env file
 load_dotenv()
 
 router = APIRouter()
 
-model = ChatAnthropic(model='claude-3-5-haiku-20241022', temperature=0.7)
+logger = get_logger(__name__)
+
+STAGE = "format-output"
+scheduler.register_stage(STAGE)
 
 tools = [get_first_day_of_week]
 
+# Parse meals out of the model's output as it streams and publish each one as soon as it's complete
+STREAMING = os.getenv("FORMAT_OUTPUT_STREAMING", "false").lower() == "true"
+
 SYSTEM_PROMPT = """You are a system that processes meal plans and reformats them into a structured JSON format.
     The input you receive contains an unstructured meal plan for a specific week in the year.
     Your task is to extract key details and output a JSON payload with the following structure:
     {
         "summary": <string>,
-        "groceryList": <string>,
         "meals": [
             {
                 "title": <string>,
@@ -38,14 +50,13 @@ SYSTEM_PROMPT = """You are a system that processes meal plans and reformats them
     Instructions:
 
     1. For the summary, create a short summary for the meals of the week including the meal names.
-    2. For the groceryList, analyze the existing meals and create a list of grocery items required. Format the grocery list as HTML as shown in the example.
-    3. For each meal in the input:
+    2. For each meal in the input:
         - Extract the meal title and assign it to title.
-        - Identify the core ingredients and list them in coreIngredients.
+        - Identify the core ingredients and list them in coreIngredients. When the meal plan gives a quantity, add it in parentheses, e.g. "chicken (1 lb)".
         - Extract the description for the kids' version and assign it to kidsVersion.
         - Extract the description for the adult version and assign it to adultVersion.
         - Extract the basic recipe and assign it to recipe.
-    4. Ensure all extracted data is clean, properly formatted, and follows the given JSON structure.
+    3. Ensure all extracted data is clean, properly formatted, and follows the given JSON structure.
     
     Example Input:
 
@@ -127,38 +138,6 @@ SYSTEM_PROMPT = """You are a system that processes meal plans and reformats them
     Example Output:
     {
         "summary": "Family pasta bake and teriyaki protein plate",
-        "grocyerList": "<p><strong>Proteins:</strong></p>
-            <ul>
-                <li>Ground chicken (1 lb for pasta bake, 1 lb for teriyaki plate)</li>
-            </ul>
-            <p><strong>Pasta and Noodles:</strong></p>
-            <ul>
-                <li>Pasta (e.g., penne or fusilli, 12 oz)</li>
-                <li>Udon noodles (10 oz)</li>
-            </ul>
-            <p><strong>Vegetables:</strong></p>
-            <ul>
-                <li>Broccoli (2 cups)</li>
-                <li>Mixed vegetables (e.g., bell peppers, broccoli, carrots, zucchini, snap peas, 3 cups total)</li>
-            </ul>
-            <p><strong>Cheese:</strong></p>
-            <ul>
-                <li>Shredded cheese (cheddar or mozzarella, 2 cups + 1/2 cup extra for kids)</li>
-                <li>Parmesan cheese (1/4 cup)</li>
-            </ul>
-            <p><strong>Sauces and Seasonings:</strong></p>
-            <ul>
-                <li>Teriyaki sauce (1/2 cup mild for kids, regular or spicy for adults)</li>
-                <li>Chili oil (1 tsp or to taste)</li>
-                <li>Mixed dried herbs (e.g., oregano, basil, thyme, 1 tsp)</li>
-                <li>Red pepper flakes (optional, 1/2 tsp)</li>
-                <li>Salt and pepper</li>
-            </ul>
-            <p><strong>Other Pantry Items:</strong></p>
-            <ul>
-                <li>Olive oil (2 tbsp)</li>
-                <li>Vegetable oil (2 tbsp)</li>
-            </ul>",
         "meals": [
             {
                 "title": "Family Pasta Bake",
@@ -235,7 +214,8 @@ SYSTEM_PROMPT = """You are a system that processes meal plans and reformats them
     Respond with the JSON only. Absolutely nothing else.
     """
 
-graph = create_react_agent(model, tools=tools, state_modifier=SYSTEM_PROMPT)
+def get_graph():
+    return get_component(STAGE, lambda: create_react_agent(get_model(STAGE), tools=tools, state_modifier=cached_system_prompt(SYSTEM_PROMPT)))
 
 def extract_json_from_string(input_string):
     try:
@@ -249,41 +229,126 @@ def extract_json_from_string(input_string):
             json_object = json.loads(potential_json)  # Validate JSON
             return json_object
     except json.JSONDecodeError:
-        pass  # Handle invalid JSON gracefully
-    
-    return None  # Return None if no valid JSON is found
+        pass  # Fall through to repair
 
-async def start_agent_flow(request_id, meal_plan):
+    # Try to salvage truncated or slightly malformed output instead of dropping it
+    return repair_json(input_string)
+
+async def stream_agent(request_id, inputs, on_meal=None):
+    """Consumes the model's tokens as they arrive and hands each meal to
+    on_meal as soon as its JSON object closes."""
+    parser = MealStreamParser()
+    chunks = []
+    current_step = None
+    start_time = time.perf_counter()
+    first_meal_time = None
+
+    async for message, metadata in get_graph().astream(inputs, stream_mode="messages"):
+        if not isinstance(message, AIMessageChunk):
+            continue
+
+        # A new model turn (e.g. after a tool call) starts a new document
+        if metadata.get("langgraph_step") != current_step:
+            current_step = metadata.get("langgraph_step")
+            parser = MealStreamParser()
+            chunks = []
+
+        text = message_text(message.content)
+        chunks.append(text)
+
+        for meal in parser.feed(text):
+            if first_meal_time is None:
+                first_meal_time = time.perf_counter() - start_time
+                FIRST_MEAL_LATENCY.observe(first_meal_time)
+                logger.info("format output: first meal after %.2fs", first_meal_time)
+
+            if on_meal is not None:
+                await on_meal(meal)
+
+    content = "".join(chunks)
+    log_payload(logger, "model output", content)
+
+    content = extract_json_from_string(content)
+
+    # Keep whatever meals streamed in if the full document couldn't be recovered
+    if content is None and parser.meals:
+        content = {"summary": None, "meals": parser.meals}
+
+    return content
+
+def meal_publisher(request_id):
+    # on_meal for stream_agent: each meal goes out with its position in the plan,
+    # so a consumer can show the plan filling in and drop repeats from a retried run
+    index = 0
+
+    async def publish_meal(meal):
+        nonlocal index
+        await produce(FORMATTED_MEAL_OUTPUT_TOPIC, { "meal": meal, "index": index, "request_id": request_id })
+        index += 1
+
+    return publish_meal
+
+async def run_agent(request_id, meal_plan, on_meal=None):
     user_input = f"""Format the meal plan.
                     Meal plan: {meal_plan}
                 """
 
     inputs = {"messages": [("user", user_input)]}
-    response = await graph.ainvoke(inputs, stream_mode="values")
 
-    last_message_content = response["messages"][-1]
-    content = last_message_content.pretty_repr()
+    if STREAMING:
+        content = await stream_agent(request_id, inputs, on_meal)
+    else:
+        response = await get_graph().ainvoke(inputs, stream_mode="values")
 
-    print(content)
+        content = message_text(response["messages"][-1].content)
 
-    # clean up output just in case there's non JSON syntax
-    content = extract_json_from_string(content)
+        log_payload(logger, "model output", content)
+
+        # clean up output just in case there's non JSON syntax
+        content = extract_json_from_string(content)
+
+    # The grocery list is built from the meals here rather than written by the model
+    content = with_grocery_list(content)
+
+    log_payload(logger, "formatted meal plan", content)
 
-    print(content)
-    produce(FORMATTED_MEAL_PLAN_OUTPUT_TOPIC, { "meal_plan": content, "request_id": request_id })
+    return content
+
+async def run_and_publish(request_id, meal_plan):
+    content = await run_agent(request_id, meal_plan, meal_publisher(request_id))
+    output = { "meal_plan": content, "request_id": request_id }
+
+    await produce(FORMATTED_MEAL_PLAN_OUTPUT_TOPIC, output)
+
+    return output
+
+def parse_request(item):
+    # start_agent_flow arguments for a raw meal plan record, or None to skip it
+    request_id = item.get('request_id')
+    return (request_id, item.get('meal_plan')) if request_id is not None else None
+
+async def start_agent_flow(request_id, meal_plan):
+    return await get_deduplicator(STAGE).run(request_id, run_and_publish, request_id, meal_plan)
 
 @router.api_route("/format-output-agent", methods=["GET", "POST"])
 async def format_output_agent(request: Request):
-    print("format_output_agent")
     if request.method == "POST":
-        data = await request.json()
+        data = await read_json(request)
 
-        print(data)
+        logger.info("format_output_agent: %d record(s)", len(data))
+        log_payload(logger, "request", data)
 
+        jobs = []
         for item in data:
-            request_id = item.get('request_id')
-            meal_plan = item.get('meal_plan')
+            args = parse_request(item)
+
+            if args is not None:
+                jobs.append((args[0], start_agent_flow, args))
 
-            asyncio.create_task(start_agent_flow(request_id, meal_plan))
+        try:
+            scheduler.submit_all(STAGE, jobs)
+        except SchedulerUnavailable as e:
+            # Tell the connector to back off and retry the batch
+            return Response(content=str(e), media_type="text/plain", status_code=e.status_code, headers={"Retry-After": "5"})
 
         return Response(content="Formatting Output Agent Started", media_type="text/plain", status_code=200)
\ No newline at end of file
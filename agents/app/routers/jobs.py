@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from ..utils.job_scheduler import scheduler
+from ..utils.dedup import dedup_stats
+from ..pregeneration import pregeneration_stats
+
+router = APIRouter()
+
+@router.get("/job-stats")
+async def job_stats():
+    return scheduler.stats()
+
+@router.get("/dedup-stats")
+async def get_dedup_stats():
+    return dedup_stats()
+
+@router.get("/pregeneration-stats")
+async def get_pregeneration_stats():
+    return await pregeneration_stats()
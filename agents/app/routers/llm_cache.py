@@ -0,0 +1,8 @@
+from fastapi import APIRouter
+from ..utils.llm_cache import llm_cache_stats
+
+router = APIRouter()
+
+@router.get("/llm-cache-stats")
+async def get_llm_cache_stats():
+    return llm_cache_stats()
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Response, Request
+from ..pipeline import run_pipeline
+from ..utils.common_utils import project_change_event
+from ..utils.serialization import read_json
+from ..utils.job_scheduler import scheduler, SchedulerUnavailable
+from ..utils.telemetry import get_logger, log_payload
+
+router = APIRouter()
+
+logger = get_logger(__name__)
+
+STAGE = "pipeline"
+scheduler.register_stage(STAGE)
+
+@router.api_route("/meal-plan-pipeline", methods=["GET", "POST"])
+async def run_meal_plan_pipeline(request: Request):
+    if request.method == "POST":
+        # Only the request id is kept from each change event
+        data = [project_change_event(item) for item in await read_json(request)]
+
+        logger.info("run_meal_plan_pipeline: %d record(s)", len(data))
+        log_payload(logger, "request", data)
+
+        jobs = []
+        for item in data:
+            # Accepts the same change stream records as the child and adult agents
+            request_id = item["request_id"]
+
+            if request_id is not None:
+                jobs.append((request_id, run_pipeline, (request_id,)))
+
+        try:
+            scheduler.submit_all(STAGE, jobs)
+        except SchedulerUnavailable as e:
+            # Tell the connector to back off and retry the batch
+            return Response(content=str(e), media_type="text/plain", status_code=e.status_code, headers={"Retry-After": "5"})
+
+        return Response(content="Meal Plan Pipeline Started", media_type="text/plain", status_code=200)
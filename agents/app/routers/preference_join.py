@@ -0,0 +1,79 @@
+from fastapi import APIRouter, Response, Request
+from . import shared_preferences_agent
+from ..utils.preference_join import preference_join, SIDES
+from ..utils.serialization import read_json
+from ..utils.job_scheduler import scheduler, SchedulerUnavailable
+from ..utils.telemetry import get_logger, log_payload, stage_span
+
+router = APIRouter()
+
+logger = get_logger(__name__)
+
+STAGE = "preference-join"
+
+def parse_request(item):
+    # join_output arguments for a child or adult output record, or None to skip it
+    request_id = item.get('request_id')
+    return (request_id, item.get('content')) if request_id is not None else None
+
+async def join_output(side, request_id, content):
+    """Adds one plan to the join and runs the shared agent when it completes
+    a pair. For the first plan of a pair it returns a future that resolves once
+    the pair has been handled, so the worker holds back that record's offset."""
+    entry = preference_join.add(side, request_id, content)
+    if not entry.ready():
+        return entry.released()
+
+    try:
+        with stage_span(shared_preferences_agent.STAGE, request_id):
+            await shared_preferences_agent.start_agent_flow(request_id, entry.sides["child"], entry.sides["adult"])
+    except Exception:
+        preference_join.restore(entry)
+        raise
+
+    entry.release()
+
+@router.get("/preference-join-stats")
+async def get_preference_join_stats():
+    return preference_join.stats()
+
+@router.api_route("/preference-join/{side}", methods=["GET", "POST"])
+async def join_preferences(side: str, request: Request):
+    # The pending plans live in this process, so this only works with a single agents replica
+    if side not in SIDES:
+        return Response(content=f"Unknown side {side}", media_type="text/plain", status_code=404)
+
+    if request.method == "POST":
+        data = await read_json(request)
+
+        logger.info("join_preferences: %d %s record(s)", len(data), side)
+        log_payload(logger, "request", data)
+
+        joined = []
+        for item in data:
+            args = parse_request(item)
+            if args is None:
+                continue
+
+            entry = preference_join.add(side, *args)
+            if entry.ready():
+                joined.append(entry)
+
+        jobs = [
+            (entry.request_id, shared_preferences_agent.start_agent_flow, (entry.request_id, entry.sides["child"], entry.sides["adult"]))
+            for entry in joined
+        ]
+
+        try:
+            scheduler.submit_all(shared_preferences_agent.STAGE, jobs)
+        except SchedulerUnavailable as e:
+            # The connector retries the whole batch, so keep these pairs around for it
+            for entry in joined:
+                preference_join.restore(entry)
+
+            return Response(content=str(e), media_type="text/plain", status_code=e.status_code, headers={"Retry-After": "5"})
+
+        for entry in joined:
+            entry.release()
+
+        return Response(content=f"Joined {len(joined)} meal plan(s)", media_type="text/plain", status_code=200)
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from typing import Optional
+from ..utils.preferences_cache import preference_cache
+from ..utils.telemetry import get_logger
+
+router = APIRouter()
+
+logger = get_logger(__name__)
+
+@router.post("/invalidate-preferences")
+async def invalidate_preferences(household_id: Optional[str] = None):
+    # Without a household_id every household's preferences are reloaded
+    logger.info("invalidate_preferences: %s", household_id or "all households")
+    preference_cache.invalidate(household_id)
+
+    return {"ok": True}
+
+@router.get("/preferences-cache-stats")
+async def preferences_cache_stats():
+    return preference_cache.stats()
@@ -1,46 +1,147 @@
 from fastapi import APIRouter, Response, Request
-import asyncio
-import json
-import re
-from pymongo import MongoClient
 from bson import ObjectId
-from dotenv import load_dotenv
-import os
-
-# Load environment variables from .env file
-load_dotenv()
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from ..utils.database import get_collection
+from ..utils.recent_meals import update_recent_meals_digest
+from ..utils.plan_candidates import claim_candidate
+from ..utils.serialization import read_json, dumps
+from ..utils.constants import WEEKLY_MEAL_PLANS_COLLECTION
+from ..utils.telemetry import get_logger, log_payload, span, stage_span
 
 router = APIRouter()
 
-@router.api_route("/save-meal-plan", methods=["GET", "POST"])
-async def save_meal_plan(request: Request):
-    print("save_meal_plan")
-    if request.method == "POST":
-        data = await request.json()
+logger = get_logger(__name__)
+
+STAGE = "save-meal-plan"
+
+async def save_meal_plans(data):
+    """Saves a batch of formatted plans with one unordered bulk write and
+    reports what happened to each request_id."""
+    results = {}
+    plans = {}
+    # Positions in the batch, since invalid items may share or lack a request_id
+    invalid = []
 
-        print(data)
+    for index, item in enumerate(data):
+        request_id = item.get('request_id')
+        meal_plan = item.get('meal_plan')
 
-        # Connect to the MongoDB instance
-        client = MongoClient(os.getenv("MONGODB_URI"))  # Replace with your MongoDB URI
+        # Reject ids that could never match before touching the database
+        if not isinstance(request_id, str) or not ObjectId.is_valid(request_id) or meal_plan is None:
+            invalid.append(index)
+        else:
+            # A later copy of the same request in the batch wins
+            plans[request_id] = meal_plan
 
-        # Access the database and collection
-        db = client['meal_planner']  # Database name
-        collection = db['weekly_meal_plans']  # Collection name
+    modified = 0
+    if plans:
+        # Uses the shared connection pool
+        collection = get_collection(WEEKLY_MEAL_PLANS_COLLECTION)
+        ids = [ObjectId(request_id) for request_id in plans]
+        # Upserts, so the write itself reports which requests had no document
+        requests = [
+            UpdateOne({"_id": ObjectId(request_id)}, {"$set": {"status": "Available", "meal_plan": meal_plan}}, upsert=True)
+            for request_id, meal_plan in plans.items()
+        ]
 
-        for item in data:
-            request_id = item.get('request_id')
-            meal_plan = item.get('meal_plan')
+        with stage_span(STAGE, next(iter(plans)) if len(plans) == 1 else None):
+            with span("mongo.bulk_write", collection=WEEKLY_MEAL_PLANS_COLLECTION, items=len(requests)):
+                try:
+                    result = await collection.bulk_write(requests, ordered=False)
+                    details = result.bulk_api_result
+                except BulkWriteError as e:
+                    details = e.details
+                except PyMongoError as e:
+                    logger.error("save_meal_plans: bulk write failed: %s", e)
+                    details = {"writeErrors": [{"index": index} for index in range(len(requests))]}
 
-            # Update the record
-            result = collection.update_one(
-                {"_id": ObjectId(request_id)},  # Match document by _id
-                {"$set": {"status": "Available", "meal_plan": meal_plan}}  # Update fields
-            )
+        failed = {str(ids[error["index"]]) for error in details.get("writeErrors", [])}
+        upserted = {str(ids[upsert["index"]]) for upsert in details.get("upserted", [])}
+        modified = details.get("nModified", 0)
 
-            # Check if the update was successful
-            if result.matched_count > 0:
-                print(f"Successfully updated the record with _id: {request_id}")
+        if upserted:
+            # The request was deleted while its plan was being generated, so don't bring it back
+            try:
+                with span("mongo.delete_many", collection=WEEKLY_MEAL_PLANS_COLLECTION):
+                    await collection.delete_many({"_id": {"$in": [ObjectId(request_id) for request_id in upserted]}})
+            except PyMongoError as e:
+                logger.error("save_meal_plans: removing plans without a request failed: %s", e)
+
+        for request_id in plans:
+            if request_id in failed:
+                results[request_id] = "failed"
+            elif request_id in upserted:
+                results[request_id] = "not_found"
             else:
-                print(f"No record found with _id: {request_id}")            
-            
-        return Response(content="Saving Meal Plan to Database", media_type="text/plain", status_code=200)
\ No newline at end of file
+                results[request_id] = "saved"
+
+        saved = {request_id: meal_plan for request_id, meal_plan in plans.items() if results[request_id] == "saved"}
+        if saved:
+            # Keep the agents' recent meals lookup to a single small read. The plans are
+            # saved either way, so a failure here doesn't fail them.
+            try:
+                with span("mongo.find", collection=WEEKLY_MEAL_PLANS_COLLECTION):
+                    documents = {
+                        str(doc["_id"]): doc async for doc in collection.find(
+                            {"_id": {"$in": [ObjectId(request_id) for request_id in saved]}}, {"_id": 1, "startDate": 1, "householdId": 1},
+                        )
+                    }
+                await update_recent_meals_digest(saved, documents)
+            except PyMongoError as e:
+                logger.error("save_meal_plans: updating the recent meals digest failed: %s", e)
+
+    counts = {status: 0 for status in ("saved", "not_found", "invalid", "failed")}
+    for status in results.values():
+        counts[status] += 1
+    counts["invalid"] = len(invalid)
+
+    # Saved plans that were identical to what was already stored are not modified
+    counts["modified"] = modified
+
+    logger.info("save_meal_plans: %s", counts)
+
+    return {
+        **counts,
+        # Only these are worth sending again
+        "retry": [request_id for request_id, status in results.items() if status == "failed"],
+        "results": results,
+        "invalid_items": invalid,
+    }
+
+def summary_status_code(summary):
+    # 207 when only some plans were saved, and an error when none were
+    if summary["failed"] + summary["not_found"] + summary["invalid"] == 0:
+        return 200
+    if summary["saved"]:
+        return 207
+    # Failed writes are worth retrying, missing and invalid requests aren't
+    if summary["failed"]:
+        return 503
+
+    return 422
+
+async def save_candidate(request_id):
+    """Saves the plan pre-generated for the request's household and week if
+    it is still valid. Returns whether it was, in which case the agents don't
+    need to run."""
+    meal_plan = await claim_candidate(request_id)
+    if meal_plan is None:
+        return False
+
+    summary = await save_meal_plans([{ "request_id": request_id, "meal_plan": meal_plan }])
+    logger.info("save_candidate: served the pre-generated plan (%s)", summary["results"].get(request_id))
+
+    return summary["results"].get(request_id) == "saved"
+
+@router.api_route("/save-meal-plan", methods=["GET", "POST"])
+async def save_meal_plan(request: Request):
+    if request.method == "POST":
+        data = await read_json(request)
+
+        logger.info("save_meal_plan: %d record(s)", len(data))
+        log_payload(logger, "request", data)
+
+        summary = await save_meal_plans(data)
+
+        return Response(content=dumps(summary), media_type="application/json", status_code=summary_status_code(summary))
@@ -1,36 +1,65 @@
 from fastapi import APIRouter, Response, Request
-from langchain_anthropic import ChatAnthropic
 from dotenv import load_dotenv
-import asyncio
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from typing import Annotated, List, Sequence
+from typing import Annotated, List, Optional, Sequence
 from langgraph.graph import END, StateGraph, START
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.memory import MemorySaver
 from typing_extensions import TypedDict
+import json
+import os
+import time
 from ..utils.publish_to_topic import produce
-from ..utils.constants import COMPLETE_MEAL_PLAN_OUTPUT_TOPIC
+from ..utils.serialization import read_json
+from ..utils.model_provider import get_model, get_component, cached_system_prompt
+from ..utils.meal_plan_schema import MealPlan
+from ..utils.json_stream import message_text
+from ..utils.grocery_list import with_grocery_list
+from ..utils.plan_scoring import score_meal_plan
+from ..utils.common_utils import get_meal_count
+from ..utils.checkpointer import get_checkpointer, delete_thread, checkpoint_stats, running_thread
+from ..utils.job_scheduler import scheduler, SchedulerUnavailable
+from ..utils.dedup import get_deduplicator
+from ..utils.households import household_scoped
+from ..utils.telemetry import get_logger, log_payload
+from ..utils.constants import COMPLETE_MEAL_PLAN_OUTPUT_TOPIC, FORMATTED_MEAL_PLAN_OUTPUT_TOPIC
 
 # Load environment variables from .env file
 load_dotenv()
 
 router = APIRouter()
 
-model = ChatAnthropic(model='claude-3-5-haiku-20241022', temperature=0.7)
+logger = get_logger(__name__)
+
+STAGE = "shared-preferences"
+scheduler.register_stage(STAGE)
 
 MAX_ITERATIONS = 3
 
+# Generate the final MealPlan JSON directly through tool-based structured output.
+# Valid plans skip the format agent; the format agent only sees plans that fail validation.
+STRUCTURED_OUTPUT = os.getenv("SHARED_STRUCTURED_OUTPUT", "false").lower() == "true"
+
+# Stop reflecting once a draft scores this well against the input plans,
+# or once the loop has run for longer than the time budget
+SCORE_THRESHOLD = float(os.getenv("SHARED_SCORE_THRESHOLD", "0.8"))
+TIME_BUDGET_SECONDS = float(os.getenv("SHARED_TIME_BUDGET_SECONDS", "120"))
+
+# Generations the loop runs when it never exits early
+MAX_GENERATIONS = MAX_ITERATIONS // 2 + 1
+
+# Iterations used and time saved across requests
+convergence_stats = {"requests": 0, "generations": 0, "early_exits": 0, "estimated_seconds_saved": 0.0}
+
 generate_content_prompt = ChatPromptTemplate.from_messages(
     [
-        (
-            "system",
+        cached_system_prompt(
             "You are a meal planning assistant for families."
             "Your job is to combine the recommended meal plan for the children and the adults into a singular meal plan that works for the family."
             "Aim to minimize creating multiple dishes. Each meal should be able to work for both the adults and kids."
             "Make sure you include the same number of meals in the combined plan as in the original plans."
             "Output should contain the name of the meal, any modification or version for the children, any modification or version for the adults, core ingredients, prep time, and basic recipe."
-            "If the user provides critique, respond with a revised version of your previous attempts.",
+            "If the user provides critique, respond with a revised version of your previous attempts."
         ),
         MessagesPlaceholder(variable_name="messages"),
     ]
@@ -38,25 +67,64 @@ generate_content_prompt = ChatPromptTemplate.from_messages(
 
 reflection_prompt = ChatPromptTemplate.from_messages(
     [
-        (
-            "system",
+        cached_system_prompt(
             "You are a family meal planning expert grading the quality of the recommended meals on taste, variety, and nutritional value."
             "Generate critique and recommendations for the user's submission."
-            "Provide detailed recommendations, including requests for greater variety, tastier meals, or higher nutrional value.",
+            "Provide detailed recommendations, including requests for greater variety, tastier meals, or higher nutrional value."
         ),
         MessagesPlaceholder(variable_name="messages"),
     ]
 )
 
-generate_chain = generate_content_prompt | model
-reflection_chain = reflection_prompt | model
+def generate_chain():
+    return get_component(f"{STAGE}:generate", lambda: generate_content_prompt | get_model(STAGE))
+
+def structured_generate_chain():
+    return get_component(f"{STAGE}:structured-generate", lambda: generate_content_prompt | get_model(STAGE).with_structured_output(MealPlan, include_raw=True))
+
+def reflection_chain():
+    return get_component(f"{STAGE}:reflect", lambda: reflection_prompt | get_model(STAGE))
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
+    meal_plan: Optional[dict]
+    expected_meal_count: Optional[int]
+    started_at: float
+    score: float
+    generations: int
+
+
+async def generate_draft(state: State) -> State:
+    if not STRUCTURED_OUTPUT:
+        return {"messages": [await generate_chain().ainvoke(state["messages"])]}
+
+    result = await structured_generate_chain().ainvoke(state["messages"])
+    parsed = result["parsed"]
+
+    if parsed is not None:
+        return {"messages": [AIMessage(content=parsed.model_dump_json(indent=2))], "meal_plan": with_grocery_list(parsed.model_dump())}
+
+    # Didn't validate, keep whatever the model produced so the format agent can work from it
+    raw = result["raw"]
+    content = json.dumps(raw.tool_calls[0]["args"]) if raw.tool_calls else message_text(raw.content)
+
+    logger.warning("Structured meal plan failed validation: %s", result["parsing_error"])
+    return {"messages": [AIMessage(content=content)], "meal_plan": None}
 
 
 async def generation_node(state: State) -> State:
-    return {"messages": [await generate_chain.ainvoke(state["messages"])]}
+    update = await generate_draft(state)
+
+    draft = message_text(update["messages"][0].content)
+    update["score"] = score_meal_plan(
+        draft,
+        state.get("expected_meal_count"),
+        message_text(state["messages"][0].content),
+        update.get("meal_plan"),
+    )
+    update["generations"] = state.get("generations", 0) + 1
+
+    return update
 
 
 async def reflection_node(state: State) -> State:
@@ -66,7 +134,7 @@ async def reflection_node(state: State) -> State:
     translated = [state["messages"][0]] + [
         cls_map[msg.type](content=msg.content) for msg in state["messages"][1:]
     ]
-    res = await reflection_chain.ainvoke(translated)
+    res = await reflection_chain().ainvoke(translated)
     # We treat the output of this as human feedback for the generator
     return {"messages": [HumanMessage(content=res.content)]}
 
@@ -79,50 +147,137 @@ builder.add_edge(START, "generate")
 def should_continue(state: State):
     if len(state["messages"]) > MAX_ITERATIONS:
         return END
+    if state.get("score", 0.0) >= SCORE_THRESHOLD:
+        return END
+    if time.time() - state.get("started_at", time.time()) > TIME_BUDGET_SECONDS:
+        return END
     return "reflect"
 
 builder.add_conditional_edges("generate", should_continue)
 builder.add_edge("reflect", "generate")
-memory = MemorySaver()
-graph = builder.compile(checkpointer=memory)
+_graph = None
+
+async def get_graph():
+    # Compiled on first use since the on-disk checkpointer has to be opened inside the event loop
+    global _graph
+
+    if _graph is None:
+        _graph = builder.compile(checkpointer=await get_checkpointer())
+
+    return _graph
+
+def record_convergence(request_id, generations, started_at, score):
+    elapsed = time.time() - started_at
+    saved = elapsed / generations * (MAX_GENERATIONS - generations) if generations < MAX_GENERATIONS else 0.0
+
+    convergence_stats["requests"] += 1
+    convergence_stats["generations"] += generations
+    convergence_stats["early_exits"] += 1 if saved > 0 else 0
+    convergence_stats["estimated_seconds_saved"] += saved
+
+    logger.info("shared plan: %d/%d generation(s), score %s, %.2fs, ~%.2fs saved", generations, MAX_GENERATIONS, score, elapsed, saved)
+
+@household_scoped
+async def run_agent(request_id, child_meal_plan, adult_meal_plan):
+    # Each request gets its own thread so runs never see each other's messages
+    config = {"configurable": {"thread_id": request_id}}
+    graph = await get_graph()
+
+    # Keeps the thread's checkpoints from being evicted while it runs
+    with running_thread(request_id):
+        state = await graph.aget_state(config)
+        if state.next:
+            # A previous attempt was interrupted mid-reflection, pick up where it left off.
+            # The time budget starts again, since the time spent down doesn't count against it.
+            logger.info("shared plan: resuming from checkpoint")
+            await graph.aupdate_state(config, {"started_at": time.time()})
+            response = await graph.ainvoke(None, config)
+        else:
+            if state.values:
+                await delete_thread(request_id)
+
+            started_at = time.time()
+            response = await graph.ainvoke({
+                    "messages": [
+                        HumanMessage(
+                            content=f"""Generate a single meal plan based on the proposed meal plan for the kids and adults.
+                                    Kids meals: {child_meal_plan}
+                                    Adult meals: {adult_meal_plan}
+                                    """
+                        )
+                    ],
+                    "expected_meal_count": await get_meal_count(),
+                    "started_at": started_at,
+                    "score": 0.0,
+                    "generations": 0,
+                },
+                config)
+
+        record_convergence(request_id, response["generations"], response["started_at"], response["score"])
+
+        # The run is finished, so its checkpoints are no longer needed
+        await delete_thread(request_id)
 
-async def start_agent_flow(request_id, child_meal_plan, adult_meal_plan):
-    config = {"configurable": {"thread_id": "1"}}
-
-    response = await graph.ainvoke({
-            "messages": [
-                HumanMessage(
-                    content=f"""Generate a single meal plan based on the proposed meal plan for the kids and adults.
-                            Kids meals: {child_meal_plan}
-                            Adult meals: {adult_meal_plan}
-                            """
-                )
-            ],
-        },
-        config)
-    
     last_message_content = response["messages"][-1]
     content = last_message_content.pretty_repr()
 
-    print(content)
-    produce(COMPLETE_MEAL_PLAN_OUTPUT_TOPIC, { "meal_plan": content, "request_id": request_id })
+    log_payload(logger, "meal plan", content)
+
+    # Only the latest generation counts, an earlier valid draft may have been revised since
+    formatted_meal_plan = response.get("meal_plan") if STRUCTURED_OUTPUT else None
+
+    return content, formatted_meal_plan
+
+async def run_and_publish(request_id, child_meal_plan, adult_meal_plan):
+    content, formatted_meal_plan = await run_agent(request_id, child_meal_plan, adult_meal_plan)
+
+    if formatted_meal_plan is not None:
+        # Already in the final shape, go straight to the save step
+        output = { "meal_plan": formatted_meal_plan, "request_id": request_id }
+        await produce(FORMATTED_MEAL_PLAN_OUTPUT_TOPIC, output)
+    else:
+        output = { "meal_plan": content, "request_id": request_id }
+        await produce(COMPLETE_MEAL_PLAN_OUTPUT_TOPIC, output)
+
+    return output
+
+def parse_request(item):
+    # start_agent_flow arguments for a joined preferences record, or None to skip it
+    request_id = item.get('request_id')
+    if request_id is None:
+        return None
+
+    return (request_id, item.get('child_preference'), item.get('adult_preference'))
+
+async def start_agent_flow(request_id, child_meal_plan, adult_meal_plan):
+    return await get_deduplicator(STAGE).run(request_id, run_and_publish, request_id, child_meal_plan, adult_meal_plan)
+
+@router.get("/shared-preferences-stats")
+async def get_shared_preferences_stats():
+    return {**convergence_stats, "checkpoints": await checkpoint_stats()}
 
 @router.api_route("/shared-preferences-agent", methods=["GET", "POST"])
 async def get_shared_meal_plan(request: Request):
-    print("get_shared_meal_plan")
     if request.method == "POST":
-        data = await request.json()
+        data = await read_json(request)
 
-        print(data)
+        logger.info("get_shared_meal_plan: %d record(s)", len(data))
+        log_payload(logger, "request", data)
 
+        jobs = []
         for item in data:
-            request_id = item.get('request_id')
-            child_preference = item.get('child_preference')
-            adult_preference = item.get('adult_preference')            
+            args = parse_request(item)
+
+            if args is not None:
+                jobs.append((args[0], start_agent_flow, args))
 
-            asyncio.create_task(start_agent_flow(request_id, child_preference, adult_preference))
+        try:
+            scheduler.submit_all(STAGE, jobs)
+        except SchedulerUnavailable as e:
+            # Tell the connector to back off and retry the batch
+            return Response(content=str(e), media_type="text/plain", status_code=e.status_code, headers={"Retry-After": "5"})
 
-        return Response(content="Adult Meal Planning Agent Started", media_type="text/plain", status_code=200)
+        return Response(content="Shared Meal Planning Agent Started", media_type="text/plain", status_code=200)
 
 
 
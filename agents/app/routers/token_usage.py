@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from ..utils.rate_limiter import rate_limiter
+from ..utils.token_usage import token_usage_stats
+
+router = APIRouter()
+
+@router.get("/token-usage")
+async def get_token_usage():
+    return token_usage_stats()
+
+@router.get("/rate-limit-stats")
+async def get_rate_limit_stats():
+    return rate_limiter.stats()
@@ -0,0 +1,133 @@
+"""Seeds meal preferences, saved weekly plans and recent meals digests for
+many households, for load tests and benchmarks. Households are named
+household-000000, household-000001 and so on, and existing ones are left
+alone, so the count can be raised between runs.
+
+    python -m app.seed_households --households 100000 [--weeks 2] [--start 0]
+
+Set MONGODB_DATABASE to seed a scratch database instead of meal_planner.
+"""
+from datetime import date, timedelta
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+import argparse
+import asyncio
+import random
+import time
+from app.utils import database
+from app.utils.database import get_collection
+from app.utils.preferences_cache import ensure_preference_indexes
+from app.utils.recent_meals import ensure_recent_meals_indexes, summarize_plan, RECENT_MEALS_WEEKS
+from app.utils.telemetry import get_logger
+from app.utils.constants import MEAL_PREFERENCES_COLLECTION, WEEKLY_MEAL_PLANS_COLLECTION, RECENT_MEALS_DIGEST_COLLECTION
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+LIKES = ["pasta", "chicken", "broccoli", "tacos", "salmon", "rice bowls", "meatballs", "sweet potatoes", "pizza", "soup"]
+DISLIKES = ["mushrooms", "olives", "spicy food", "eggplant", "blue cheese", "cilantro"]
+REQUIREMENTS = ["no nuts", "vegetarian on Mondays", "dairy free", "no shellfish", "", ""]
+INGREDIENTS = ["chicken", "beef", "tofu", "rice", "pasta", "broccoli", "carrots", "beans", "cheese", "potatoes", "salmon", "peas"]
+
+def household_id(i):
+    return f"household-{i:06d}"
+
+def household_documents(i, weeks, rng):
+    """Preferences and saved weekly plans for one household."""
+    preferences = {
+        "householdId": household_id(i),
+        "likes": ", ".join(rng.sample(LIKES, 3)),
+        "dislikes": ", ".join(rng.sample(DISLIKES, 2)),
+        "hardRequirements": rng.choice(REQUIREMENTS),
+        "mealCount": rng.randint(3, 7),
+    }
+
+    monday = date.today() - timedelta(days=date.today().weekday())
+    plans = [
+        {
+            "householdId": household_id(i),
+            "week": (monday - timedelta(weeks=week)).isocalendar()[1],
+            "startDate": (monday - timedelta(weeks=week)).isoformat(),
+            "status": "Available",
+            "meal_plan": {
+                "summary": "A week of simple family dinners.",
+                "meals": [
+                    {"title": f"{rng.choice(LIKES).title()} night {meal}", "coreIngredients": rng.sample(INGREDIENTS, 3)}
+                    for meal in range(preferences["mealCount"])
+                ],
+            },
+        }
+        for week in range(weeks, 0, -1)
+    ]
+
+    return preferences, plans
+
+async def seed_households(count, weeks=2, start=0, batch_size=1000, seed=0):
+    """Upserts households start..count-1 in batches. Returns how many were written."""
+    rng = random.Random(seed + start)
+    preferences_collection = get_collection(MEAL_PREFERENCES_COLLECTION)
+    plans_collection = get_collection(WEEKLY_MEAL_PLANS_COLLECTION)
+    digest_collection = get_collection(RECENT_MEALS_DIGEST_COLLECTION)
+
+    for batch_start in range(start, count, batch_size):
+        preferences_batch, plans_batch = [], []
+        for i in range(batch_start, min(batch_start + batch_size, count)):
+            preferences, plans = household_documents(i, weeks, rng)
+            preferences_batch.append(preferences)
+            plans_batch.extend(plans)
+
+        # Households that already exist keep their preferences
+        await preferences_collection.bulk_write([
+            UpdateOne({"householdId": preferences["householdId"]}, {"$setOnInsert": preferences}, upsert=True)
+            for preferences in preferences_batch
+        ], ordered=False)
+
+        # Households seeded before already have their plans
+        seeded = {
+            doc["householdId"] async for doc in plans_collection.find(
+                {"householdId": {"$in": [preferences["householdId"] for preferences in preferences_batch]}},
+                {"householdId": 1},
+            )
+        }
+        plans_batch = [plan for plan in plans_batch if plan["householdId"] not in seeded]
+        if not plans_batch:
+            continue
+
+        result = await plans_collection.insert_many(plans_batch)
+
+        # Write the digests the agents read instead of leaving the first lookup to rebuild them
+        digests = {}
+        for plan, plan_id in zip(plans_batch, result.inserted_ids):
+            digests.setdefault(plan["householdId"], []).insert(0, summarize_plan(plan_id, plan["meal_plan"], plan["startDate"]))
+
+        await digest_collection.bulk_write([
+            UpdateOne({"_id": household}, {"$set": {"weeks": household_weeks[:RECENT_MEALS_WEEKS]}}, upsert=True)
+            for household, household_weeks in digests.items()
+        ], ordered=False)
+
+    return max(count - start, 0)
+
+async def main(count, weeks, start, batch_size):
+    await database.connect()
+
+    try:
+        await ensure_preference_indexes()
+        await ensure_recent_meals_indexes()
+
+        start_time = time.perf_counter()
+        written = await seed_households(count, weeks, start, batch_size)
+        logger.info("seed_households: %d household(s) in %.1fs", written, time.perf_counter() - start_time)
+    finally:
+        database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--households", type=int, default=1000, help="households to have after seeding")
+    parser.add_argument("--weeks", type=int, default=2, help="saved weekly plans per household")
+    parser.add_argument("--start", type=int, default=0, help="first household number to write")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.households, args.weeks, args.start, args.batch_size))
@@ -0,0 +1,170 @@
+from langgraph.checkpoint.memory import MemorySaver
+from dotenv import load_dotenv
+from collections import OrderedDict
+from contextlib import AsyncExitStack, contextmanager
+from pathlib import Path
+import asyncio
+import os
+import time
+from .telemetry import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Get the path to the root directory
+root_dir = Path(__file__).resolve().parent.parent
+
+# "memory" keeps checkpoints in process, "sqlite" keeps them on disk so
+# interrupted runs can resume after a restart
+CHECKPOINTER = os.getenv("CHECKPOINTER", "memory")
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", str(root_dir / "checkpoints.sqlite3"))
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "100"))
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", "3600"))
+CHECKPOINT_PRUNE_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_PRUNE_INTERVAL_SECONDS", "300"))
+
+# Threads with a run in progress in this process, which are never evicted or pruned
+running_threads = set()
+
+@contextmanager
+def running_thread(thread_id):
+    running_threads.add(thread_id)
+    try:
+        yield
+    finally:
+        running_threads.discard(thread_id)
+
+def _size_of(value):
+    # Checkpoints are stored serialized, so counting bytes is a close estimate
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size_of(k) + _size_of(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_size_of(v) for v in value)
+    return 0
+
+class BoundedMemorySaver(MemorySaver):
+    """MemorySaver that evicts whole threads by TTL and least recent use.
+    Threads with a run in progress are kept even past max_threads."""
+
+    def __init__(self, max_threads, ttl_seconds):
+        super().__init__()
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self.evicted = 0
+        self._last_used = OrderedDict()
+
+    def _touch(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        self._last_used[thread_id] = time.time()
+        self._last_used.move_to_end(thread_id)
+        self.evict(keep=thread_id)
+
+    def evict(self, keep=None):
+        expired_before = time.time() - self.ttl_seconds
+
+        for thread_id, last_used in list(self._last_used.items()):
+            if thread_id == keep or thread_id in running_threads:
+                continue
+
+            over_limit = len(self._last_used) > self.max_threads
+            if over_limit or last_used < expired_before:
+                self.delete_thread(thread_id)
+                self.evicted += 1
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config)
+        return result
+
+    def put_writes(self, config, writes, task_id, *args, **kwargs):
+        super().put_writes(config, writes, task_id, *args, **kwargs)
+        self._touch(config)
+
+    def delete_thread(self, thread_id):
+        self.storage.pop(thread_id, None)
+        for key in [key for key in self.writes if key[0] == thread_id]:
+            self.writes.pop(key, None)
+        # Newer versions of MemorySaver keep channel values separately
+        blobs = getattr(self, "blobs", None)
+        if blobs is not None:
+            for key in [key for key in blobs if key[0] == thread_id]:
+                blobs.pop(key, None)
+        self._last_used.pop(thread_id, None)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "threads": len(self._last_used),
+            "evicted": self.evicted,
+            "bytes": _size_of(dict(self.storage)) + _size_of(dict(self.writes)) + _size_of(dict(getattr(self, "blobs", {}))),
+        }
+
+_checkpointer = None
+# Holds the sqlite saver's connection open until close_checkpointer
+_exit_stack = None
+
+async def get_checkpointer():
+    global _checkpointer, _exit_stack
+
+    if _checkpointer is None:
+        if CHECKPOINTER == "sqlite":
+            from .sqlite_checkpointer import PrunedSqliteSaver
+
+            _exit_stack = AsyncExitStack()
+            _checkpointer = await _exit_stack.enter_async_context(PrunedSqliteSaver.from_conn_string(CHECKPOINT_PATH))
+            await _checkpointer.setup()
+        else:
+            _checkpointer = BoundedMemorySaver(CHECKPOINT_MAX_THREADS, CHECKPOINT_TTL_SECONDS)
+
+    return _checkpointer
+
+async def delete_thread(thread_id):
+    checkpointer = await get_checkpointer()
+
+    if isinstance(checkpointer, BoundedMemorySaver):
+        checkpointer.delete_thread(thread_id)
+    else:
+        await checkpointer.adelete_thread(thread_id)
+
+async def prune_checkpoints():
+    # Drops threads left behind by runs that failed and were never retried
+    checkpointer = await get_checkpointer()
+
+    if isinstance(checkpointer, BoundedMemorySaver):
+        checkpointer.evict()
+    else:
+        pruned = await checkpointer.prune(CHECKPOINT_MAX_THREADS, CHECKPOINT_TTL_SECONDS, running_threads)
+        if pruned:
+            logger.info("checkpoints: pruned %d idle thread(s)", pruned)
+
+async def prune_checkpoints_periodically():
+    while True:
+        await asyncio.sleep(CHECKPOINT_PRUNE_INTERVAL_SECONDS)
+
+        try:
+            await prune_checkpoints()
+        except Exception:
+            logger.exception("checkpoints: pruning failed")
+
+async def checkpoint_stats():
+    checkpointer = await get_checkpointer()
+
+    if isinstance(checkpointer, BoundedMemorySaver):
+        return checkpointer.stats()
+
+    return {
+        **await checkpointer.stats(),
+        "bytes": os.path.getsize(CHECKPOINT_PATH) if os.path.exists(CHECKPOINT_PATH) else 0,
+    }
+
+async def close_checkpointer():
+    global _checkpointer, _exit_stack
+
+    if _exit_stack is not None:
+        await _exit_stack.aclose()
+
+    _checkpointer = None
+    _exit_stack = None
@@ -1,12 +1,24 @@
 from langchain_core.tools import tool
+from langchain_core.messages import AIMessage
 from datetime import datetime, timedelta
-from pymongo import MongoClient
 from dotenv import load_dotenv
+import asyncio
 import os
+from .households import remember_request_household
+from .preferences_cache import get_preference_snapshot
+from .recent_meals import get_recent_weeks, format_recent_weeks
+from .serialization import loads
 
 # Load environment variables from .env file
 load_dotenv()
 
+# When enabled, the ReAct agents receive their tool data in the prompt
+# instead of spending model turns deciding to call the tools
+PREFETCH_CONTEXT = os.getenv("PREFETCH_CONTEXT", "false").lower() == "true"
+
+# Dinners to plan for a household whose preferences don't set mealCount
+DEFAULT_MEAL_COUNT = int(os.getenv("DEFAULT_MEAL_COUNT", "5"))
+
 def get_current_date():
     # Get the current date
     current_date = datetime.now().date()
@@ -23,75 +35,73 @@ def print_stream(stream):
             message.pretty_print()
 
 @tool
-def get_kid_preferences():
+async def get_kid_preferences():
     """Use this to get the likes and dislikes for the kids preferences."""
-    # Connect to the MongoDB instance
-    client = MongoClient(os.getenv("MONGODB_URI"))  # Replace with your MongoDB URI
-
-    # Access the database and collection
-    db = client['meal_planner']  # Database name
-    collection = db['meal_preferences']  # Collection name
-
-    projection = {"likes": 1, "dislikes": 1, "_id": 0} 
-    result = collection.find_one({}, projection)
+    snapshot = await get_preference_snapshot()
 
-    return result
+    return {"likes": snapshot.get("likes"), "dislikes": snapshot.get("dislikes")}
 
 
 @tool
-def get_hard_requirements():
+async def get_hard_requirements():
     """Use this to get the hard requirements for recommending a meal. These must be enforced."""
-    # Connect to the MongoDB instance
-    client = MongoClient(os.getenv("MONGODB_URI"))  # Replace with your MongoDB URI
+    snapshot = await get_preference_snapshot()
 
-    # Access the database and collection
-    db = client['meal_planner']  # Database name
-    collection = db['meal_preferences']  # Collection name
-
-    projection = {"hardRequirements": 1, "_id": 0} 
-    result = collection.find_one({}, projection)
-
-    return result
+    return {"hardRequirements": snapshot.get("hardRequirements")}
 
 
 @tool
-def get_recent_meals():
+async def get_recent_meals():
     """Use this to get recent meals."""
-    # Connect to the MongoDB instance
-    client = MongoClient(os.getenv("MONGODB_URI"))  # Replace with your MongoDB URI\
-    
-    # Access the database and collection
-    db = client['meal_planner']
-    collection = db['weekly_meal_plans']
+    # Titles and core ingredients of the last few saved weeks, from the precomputed digest
+    return format_recent_weeks(await get_recent_weeks())
 
-    # Query to get the last two entries
-    recent_meals = list(collection.find().sort([("$natural", -1)]).limit(2))
 
-    return recent_meals
+def start_of_week(day=None):
+    # The Monday of the week containing day, today by default
+    day = day or datetime.now().date()
+
+    return day - timedelta(days=day.weekday())
 
 
 @tool
 def get_first_day_of_week():
     """Use this to get the first day of the current week."""
-    # Get the current date
-    current_date = datetime.now()
+    return start_of_week().strftime('%Y-%m-%d')
 
-    # Calculate the start of the week (Monday)
-    start_of_week = current_date - timedelta(days=current_date.weekday())
 
-    return start_of_week.strftime('%Y-%m-%d')
+async def get_meal_count():
+    """Use this to get how many meals to plan for."""
+    snapshot = await get_preference_snapshot()
 
+    return snapshot.get("mealCount") or DEFAULT_MEAL_COUNT
 
-def get_meal_count():
-    """Use this to get how many meals to plan for."""
-    # Connect to the MongoDB instance
-    client = MongoClient(os.getenv("MONGODB_URI"))  # Replace with your MongoDB URI\
-    
-    # Access the database and collection
-    db = client['meal_planner']
-    collection = db['meal_preferences']
+async def prefetch_tool_context(tools):
+    """Runs every tool concurrently and formats the results for a prompt."""
+    results = await asyncio.gather(*(t.ainvoke({}) for t in tools))
+
+    return "\n".join(f"{t.name}: {result}" for t, result in zip(tools, results))
+
+def count_model_turns(messages):
+    return sum(1 for message in messages if isinstance(message, AIMessage))
+
+def get_change_event_request_id(item):
+    # The source connector encodes the document _id as extended JSON, e.g. {"$oid": "..."}
+    oid_raw = (item.get('fullDocument') or {}).get('_id')
+    if not oid_raw:
+        return None
+
+    # Already decoded when the connector or a projection emits it as an object
+    oid = oid_raw if isinstance(oid_raw, dict) else loads(oid_raw)
+    return oid.get('$oid')
+
+def project_change_event(item):
+    # Everything the agents need from a change event, so the full document isn't carried around
+    request_id = get_change_event_request_id(item)
+    household_id = (item.get('fullDocument') or {}).get('householdId')
 
-    projection = {"mealCount": 1, "_id": 0} 
-    result = collection.find_one({}, projection)
+    # Saves each stage looking the household up again. Without it, it's read from the request document.
+    if household_id is not None:
+        remember_request_household(request_id, household_id)
 
-    return result.get("mealCount")
\ No newline at end of file
+    return {"request_id": request_id, "household_id": household_id}
@@ -1,4 +1,18 @@
 CHILD_PREFERENCES_OUTPUT_TOPIC = "meal-planner.output.child-preferences"
 ADULT_PREFERENCES_OUTPUT_TOPIC = "meal-planner.output.adult-preferences"
 COMPLETE_MEAL_PLAN_OUTPUT_TOPIC = "meal-planner.output.raw-complete-meal-plan"
-FORMATTED_MEAL_PLAN_OUTPUT_TOPIC = "meal-planner.output.formatted-complete-meal-plan"
\ No newline at end of file
+FORMATTED_MEAL_PLAN_OUTPUT_TOPIC = "meal-planner.output.formatted-complete-meal-plan"
+# Each meal of a formatted plan, published as soon as the format agent has streamed it
+FORMATTED_MEAL_OUTPUT_TOPIC = "meal-planner.output.formatted-meal"
+
+DATABASE_NAME = "meal_planner"
+MEAL_PREFERENCES_COLLECTION = "meal_preferences"
+WEEKLY_MEAL_PLANS_COLLECTION = "weekly_meal_plans"
+RECENT_MEALS_DIGEST_COLLECTION = "recent_meals_digest"
+MEAL_PLAN_CANDIDATES_COLLECTION = "meal_plan_candidates"
+
+# Inputs written by the MongoDB source connector and the Flink join
+MEAL_PLAN_REQUEST_TOPIC = "meal-planner.input.request.meal_planner.weekly_meal_plans"
+JOINED_PREFERENCES_TOPIC = "meal-planner.output.joined-preferences"
+# Child or adult plans dropped from the preference join before their other half arrived
+PREFERENCE_JOIN_DEAD_LETTER_TOPIC = "meal-planner.dead-letter.preference-join"
@@ -0,0 +1,74 @@
+from confluent_kafka import Consumer, TopicPartition
+from dotenv import load_dotenv
+import os
+from .memory_broker import InMemoryConsumer, memory_broker
+from .publish_to_topic import read_config
+from .serialization import loads, decode_fields
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Offsets are committed by the worker once a record's output has been produced.
+# The range assignor gives partition N of every subscribed topic to the same consumer, which the
+# preference join relies on: the child and adult output topics are keyed by request_id and must
+# have the same partition count, so both plans of a request reach the same worker.
+CONSUMER_DEFAULTS = {
+    "enable.auto.commit": "false",
+    "auto.offset.reset": "earliest",
+    "partition.assignment.strategy": "range",
+}
+
+class KafkaConsumer:
+    """Thin wrapper over the Confluent consumer that speaks (topic, partition)
+    tuples, so the worker drives it and InMemoryConsumer the same way."""
+
+    def __init__(self, config, group_id):
+        self._consumer = Consumer({**CONSUMER_DEFAULTS, **config, "group.id": group_id})
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        def assigned(consumer, partitions):
+            if on_assign is not None:
+                on_assign(self, [(tp.topic, tp.partition) for tp in partitions])
+
+        def revoked(consumer, partitions):
+            if on_revoke is not None:
+                on_revoke(self, [(tp.topic, tp.partition) for tp in partitions])
+
+        self._consumer.subscribe(topics, on_assign=assigned, on_revoke=revoked)
+
+    def consume(self, num_messages=1, timeout=-1):
+        return self._consumer.consume(num_messages, timeout)
+
+    def commit(self, offsets, asynchronous=False):
+        self._consumer.commit(
+            offsets=[TopicPartition(topic, partition, offset) for topic, partition, offset in offsets],
+            asynchronous=asynchronous,
+        )
+
+    def pause(self, partitions):
+        self._consumer.pause([TopicPartition(topic, partition) for topic, partition in partitions])
+
+    def resume(self, partitions):
+        self._consumer.resume([TopicPartition(topic, partition) for topic, partition in partitions])
+
+    def close(self):
+        self._consumer.close()
+
+def create_consumer(group_id):
+    if os.getenv("KAFKA_CONSUMER", "confluent") == "memory":
+        return InMemoryConsumer(memory_broker, group_id)
+
+    return KafkaConsumer(read_config(), group_id)
+
+def decode_value(raw):
+    # Values written with the JSON Schema serializer start with a magic byte and a 4 byte schema id
+    if raw[:1] == b"\x00":
+        raw = raw[5:]
+
+    value = loads(raw)
+
+    # The MongoDB source connector can emit the change event as a JSON encoded string
+    if isinstance(value, str):
+        value = loads(value)
+
+    return decode_fields(value)
@@ -0,0 +1,50 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+import os
+from .constants import DATABASE_NAME
+
+# Load environment variables from .env file
+load_dotenv()
+
+# A single client is shared by every tool and router in the process. Motor
+# manages the connection pool, so callers should never create their own client.
+_client = None
+
+def get_client():
+    global _client
+
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            os.getenv("MONGODB_URI"),
+            maxPoolSize=int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+            minPoolSize=int(os.getenv("MONGODB_MIN_POOL_SIZE", "5")),
+            maxIdleTimeMS=int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+        )
+
+    return _client
+
+def set_client(client):
+    # Lets benchmarks and scripts swap in another client, e.g. mongomock_motor
+    global _client
+
+    close()
+    _client = client
+
+def get_database():
+    # Benchmarks and seeding point this at a scratch database
+    return get_client()[os.getenv("MONGODB_DATABASE", DATABASE_NAME)]
+
+def get_collection(name):
+    return get_database()[name]
+
+async def connect():
+    # Creates the client and pays the TLS and handshake cost up front
+    # so the first agent run doesn't have to
+    await get_client().admin.command("ping")
+
+def close():
+    global _client
+
+    if _client is not None:
+        _client.close()
+        _client = None
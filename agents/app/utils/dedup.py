@@ -0,0 +1,199 @@
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import asyncio
+import os
+import time
+from .database import get_collection
+from .telemetry import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# "memory" dedups within this process, "mongo" shares results and claims across replicas
+DEDUP_STORE = os.getenv("DEDUP_STORE", "memory")
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", str(6 * 60 * 60)))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "10000"))
+# How long another replica waits before taking over a run whose owner went quiet
+DEDUP_LEASE_SECONDS = float(os.getenv("DEDUP_LEASE_SECONDS", "900"))
+# How often a duplicate checks for the result of a run claimed by another replica
+DEDUP_POLL_SECONDS = float(os.getenv("DEDUP_POLL_SECONDS", "2"))
+
+STAGE_RESULTS_COLLECTION = "stage_results"
+
+class MemoryResultStore:
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+
+    async def get(self, stage, key):
+        entry = self._results.get((stage, key))
+        if entry is None:
+            return None
+
+        result, expires_at = entry
+        if time.time() > expires_at:
+            del self._results[(stage, key)]
+            return None
+
+        return result
+
+    async def claim(self, stage, key):
+        # Runs in this process are coalesced by StageDeduplicator, nothing else to claim
+        return True
+
+    async def put(self, stage, key, result):
+        self._results[(stage, key)] = (result, time.time() + self.ttl_seconds)
+        self._results.move_to_end((stage, key))
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    async def release(self, stage, key):
+        pass
+
+class MongoResultStore:
+    """Stores completed results and in-flight claims in MongoDB so duplicates
+    reaching another replica are also recognized. Expired documents are
+    removed by a TTL index."""
+
+    def _collection(self):
+        return get_collection(STAGE_RESULTS_COLLECTION)
+
+    async def ensure_indexes(self):
+        await self._collection().create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, stage, key):
+        doc = await self._collection().find_one({"_id": f"{stage}:{key}", "status": "done"}, {"result": 1})
+        return doc["result"] if doc else None
+
+    async def claim(self, stage, key):
+        now = datetime.now(timezone.utc)
+        lease = {"status": "running", "lease_until": now + timedelta(seconds=DEDUP_LEASE_SECONDS), "expires_at": now + timedelta(seconds=DEDUP_TTL_SECONDS)}
+
+        try:
+            await self._collection().insert_one({"_id": f"{stage}:{key}", **lease})
+            return True
+        except DuplicateKeyError:
+            # Take over a claim whose lease ran out, e.g. the replica running it died
+            result = await self._collection().update_one(
+                {"_id": f"{stage}:{key}", "status": "running", "lease_until": {"$lt": now}},
+                {"$set": lease},
+            )
+            return result.modified_count == 1
+
+    async def put(self, stage, key, result):
+        await self._collection().update_one(
+            {"_id": f"{stage}:{key}"},
+            {"$set": {
+                "status": "done",
+                "result": result,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=DEDUP_TTL_SECONDS),
+            }},
+            upsert=True,
+        )
+
+    async def release(self, stage, key):
+        await self._collection().delete_one({"_id": f"{stage}:{key}", "status": "running"})
+
+def create_result_store():
+    if DEDUP_STORE == "mongo":
+        return MongoResultStore()
+
+    return MemoryResultStore(DEDUP_TTL_SECONDS, DEDUP_MAX_ENTRIES)
+
+result_store = create_result_store()
+
+class StageDeduplicator:
+    """Runs a stage at most once per key. A duplicate that arrives while the
+    first run is in flight waits for it, and one that arrives afterwards gets
+    the stored result back without running or publishing again. A run
+    claimed by another replica is waited on until its result is stored, or
+    taken over once its lease runs out."""
+
+    def __init__(self, stage, store=None):
+        self.stage = stage
+        self.store = store or result_store
+        self.executed = 0
+        self.joined = 0
+        self.replayed = 0
+        self.claimed_elsewhere = 0
+        self._in_flight = {}
+
+    async def run(self, key, fn, *args):
+        if key in self._in_flight:
+            self.joined += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+
+        try:
+            result = await self._run_once(key, fn, *args)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved for when nobody joined this run
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def _run_once(self, key, fn, *args):
+        waiting = False
+        while True:
+            stored = await self.store.get(self.stage, key)
+            if stored is not None:
+                self.replayed += 1
+                logger.info("%s: replaying stored result", self.stage)
+                return stored
+
+            # Succeeds once the other replica releases a failed run or its lease runs out
+            if await self.store.claim(self.stage, key):
+                break
+
+            if not waiting:
+                waiting = True
+                self.claimed_elsewhere += 1
+                logger.info("%s: already running on another replica, waiting for its result", self.stage)
+
+            await asyncio.sleep(DEDUP_POLL_SECONDS)
+
+        try:
+            result = await fn(*args)
+        except Exception:
+            await self.store.release(self.stage, key)
+            raise
+
+        self.executed += 1
+        await self.store.put(self.stage, key, result)
+
+        return result
+
+    def stats(self):
+        return {
+            "executed": self.executed,
+            "joined": self.joined,
+            "replayed": self.replayed,
+            "claimed_elsewhere": self.claimed_elsewhere,
+            "in_flight": len(self._in_flight),
+        }
+
+deduplicators = {}
+
+def get_deduplicator(stage):
+    if stage not in deduplicators:
+        deduplicators[stage] = StageDeduplicator(stage)
+
+    return deduplicators[stage]
+
+def dedup_stats():
+    return {stage: dedup.stats() for stage, dedup in deduplicators.items()}
+
+async def ensure_dedup_indexes():
+    if isinstance(result_store, MongoResultStore):
+        await result_store.ensure_indexes()
@@ -0,0 +1,252 @@
+from fractions import Fraction
+import html
+import re
+
+# Units that convert into each other share a base: teaspoons for volume, ounces for weight
+UNITS = {
+    "tsp": ("volume", 1), "teaspoon": ("volume", 1), "teaspoons": ("volume", 1),
+    "tbsp": ("volume", 3), "tablespoon": ("volume", 3), "tablespoons": ("volume", 3),
+    "cup": ("volume", 48), "cups": ("volume", 48), "c": ("volume", 48),
+    "ml": ("volume", 0.202884), "l": ("volume", 202.884), "liter": ("volume", 202.884), "liters": ("volume", 202.884),
+    "oz": ("weight", 1), "ounce": ("weight", 1), "ounces": ("weight", 1),
+    "lb": ("weight", 16), "lbs": ("weight", 16), "pound": ("weight", 16), "pounds": ("weight", 16),
+    "g": ("weight", 0.035274), "gram": ("weight", 0.035274), "grams": ("weight", 0.035274),
+    "kg": ("weight", 35.274),
+}
+
+# Units that don't convert are summed on their own, e.g. "2 cans"
+COUNT_UNITS = {
+    "can": "can", "cans": "can", "clove": "clove", "cloves": "clove", "bunch": "bunch", "bunches": "bunch",
+    "head": "head", "heads": "head", "package": "package", "packages": "package", "pkg": "package",
+    "slice": "slice", "slices": "slice", "jar": "jar", "jars": "jar", "bag": "bag", "bags": "bag",
+}
+
+UNICODE_FRACTIONS = {"½": "1/2", "¼": "1/4", "¾": "3/4", "⅓": "1/3", "⅔": "2/3", "⅛": "1/8"}
+
+AMOUNT = r"\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?"
+LEADING_QUANTITY = re.compile(rf"^(?P<amount>{AMOUNT})\s*(?P<unit>[a-z]+\.?)?\s+(?:of\s+)?(?P<name>.+)$")
+TRAILING_QUANTITY = re.compile(r"^(?P<name>.+?)\s*\((?P<quantity>[^)]*)\)$")
+QUANTITY = re.compile(rf"^(?P<amount>{AMOUNT})\s*(?P<unit>[a-z]+\.?)?")
+
+# Preparation words that don't change what goes in the cart
+DESCRIPTORS = {
+    "fresh", "chopped", "diced", "minced", "sliced", "shredded", "grated", "cubed", "cooked", "uncooked",
+    "large", "small", "medium", "boneless", "skinless", "organic", "frozen", "optional", "whole", "finely", "thinly",
+}
+
+SYNONYMS = {
+    "scallion": "green onion", "spring onion": "green onion", "garbanzo bean": "chickpea", "coriander": "cilantro",
+    "courgette": "zucchini", "capsicum": "bell pepper", "aubergine": "eggplant", "prawn": "shrimp", "mince": "ground beef",
+    "minced beef": "ground beef", "hamburger": "ground beef", "spaghetti noodle": "spaghetti",
+    "parmesan cheese": "parmesan", "parmigiano": "parmesan", "cheddar cheese": "cheddar", "mozzarella cheese": "mozzarella",
+}
+
+# Words whose trailing s isn't a plural. Merge keys, and so the keywords below, use singular nouns.
+NOT_PLURAL = {"asparagus", "couscous", "hummus", "molasses", "swiss", "citrus", "lettuce", "brussels", "peas", "oats", "grits", "greens"}
+
+# Categories in the order the web app shows them
+CATEGORIES = ["Proteins", "Produce", "Dairy", "Pasta, Grains and Bread", "Sauces and Seasonings", "Other Pantry Items", "Other"]
+
+CATEGORY_KEYWORDS = {
+    "Proteins": [
+        "chicken", "beef", "pork", "turkey", "salmon", "fish", "cod", "tilapia", "tuna", "shrimp", "tofu", "tempeh", "egg",
+        "sausage", "bacon", "ham", "lamb", "steak", "meatball", "chickpea", "lentil", "bean", "black bean", "edamame",
+    ],
+    "Produce": [
+        "broccoli", "carrot", "onion", "green onion", "garlic", "bell pepper", "pepper", "tomato", "potato", "sweet potato",
+        "spinach", "kale", "lettuce", "cucumber", "zucchini", "squash", "eggplant", "mushroom", "pea", "peas", "corn",
+        "celery", "cabbage", "cauliflower", "asparagus", "green bean", "avocado", "lemon", "lime", "apple", "banana",
+        "berry", "cilantro", "parsley", "basil", "ginger", "vegetable", "greens", "herb", "fruit", "brussels sprout",
+    ],
+    "Dairy": [
+        "cheese", "parmesan", "mozzarella", "cheddar", "feta", "ricotta", "milk", "butter", "yogurt", "cream",
+        "sour cream", "cream cheese",
+    ],
+    "Pasta, Grains and Bread": [
+        "pasta", "spaghetti", "penne", "macaroni", "noodle", "udon", "ramen", "rice", "quinoa",
+        "couscous", "oats", "bread", "bun", "tortilla", "pita", "naan", "flour", "breadcrumb", "panko", "tortellini", "gnocchi",
+    ],
+    "Sauces and Seasonings": [
+        "sauce", "soy sauce", "teriyaki", "salsa", "pesto", "ketchup", "mustard", "mayonnaise", "vinegar", "broth", "stock",
+        "salt", "black pepper", "pepper flake", "paprika", "cumin", "oregano", "thyme", "chili powder",
+        "cinnamon", "seasoning", "spice", "dried herb", "honey", "maple syrup", "curry", "curry paste",
+    ],
+    "Other Pantry Items": ["oil", "olive oil", "vegetable oil", "sesame oil", "sugar", "baking powder", "peanut butter", "nut", "seed", "hummus"],
+}
+
+# Keyed by the keyword's words, so a name is matched by looking up its word runs
+KEYWORDS = {tuple(keyword.split()): category for category, keywords in CATEGORY_KEYWORDS.items() for keyword in keywords}
+
+def parse_amount(text):
+    whole, _, fraction = text.partition(" ") if "/" in text and " " in text else ("0", "", text)
+    return float(Fraction(whole) + Fraction(fraction.strip()))
+
+def parse_quantity(amount, unit):
+    # (dimension, amount in the dimension's base unit), with the unit word returned if it wasn't one
+    unit = (unit or "").rstrip(".")
+    if unit in UNITS:
+        dimension, factor = UNITS[unit]
+        return (dimension, parse_amount(amount) * factor), None
+    if unit in COUNT_UNITS:
+        return (COUNT_UNITS[unit], parse_amount(amount)), None
+
+    return ("count", parse_amount(amount)), unit or None
+
+def singular(word):
+    if word in NOT_PLURAL or len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+
+    return word
+
+def normalize_name(name):
+    """Display name and merge key for an ingredient name."""
+    # "chicken, cut into strips" is still chicken
+    name = name.split(",")[0].replace("&", " and ")
+    words = [word for word in re.findall(r"[a-z][a-z'-]*", name) if word not in DESCRIPTORS]
+    if not words:
+        return None, None
+
+    display = " ".join(words)
+    key = " ".join(words[:-1] + [singular(words[-1])])
+    key = SYNONYMS.get(key, key)
+
+    return display, key
+
+def parse_ingredient(text):
+    """Splits an ingredient such as "2 cups broccoli", "chicken (1 lb)" or
+    "broccoli" into (display name, merge key, quantity or None)."""
+    text = text.strip().lower()
+    for fraction, replacement in UNICODE_FRACTIONS.items():
+        text = text.replace(fraction, f" {replacement}").strip()
+
+    quantity = None
+
+    trailing = TRAILING_QUANTITY.match(text)
+    if trailing:
+        text = trailing.group("name")
+        match = QUANTITY.match(trailing.group("quantity").strip())
+        if match:
+            quantity, _ = parse_quantity(match.group("amount"), match.group("unit"))
+    else:
+        leading = LEADING_QUANTITY.match(text)
+        if leading:
+            quantity, unit_word = parse_quantity(leading.group("amount"), leading.group("unit"))
+            # "3 carrots": the word after the number was the ingredient, not a unit
+            text = f"{unit_word} {leading.group('name')}" if unit_word else leading.group("name")
+
+    display, key = normalize_name(text)
+
+    return display, key, quantity
+
+def categorize_part(words):
+    # The keyword ending furthest right wins ("chicken broth" is a broth), then the longest ("black pepper" over "pepper")
+    for end in range(len(words), 0, -1):
+        for start in range(end):
+            category = KEYWORDS.get(tuple(words[start:end]))
+            if category is not None:
+                return category
+
+    return "Other"
+
+def categorize(key):
+    # "salt and pepper" is a seasoning, not a pepper: a seasoning part wins, then the first part with a category
+    categories = [categorize_part(part.split()) for part in key.split(" and ")]
+    if "Sauces and Seasonings" in categories:
+        return "Sauces and Seasonings"
+
+    return next((category for category in categories if category != "Other"), "Other")
+
+def format_amount(amount):
+    # Nearest quarter or third, written the way recipes do: 1 1/2, 3/4, 1/3
+    value = min((Fraction(max(round(amount * parts), 1), parts) for parts in (4, 3)), key=lambda value: abs(value - Fraction(amount)))
+    whole, fraction = divmod(value, 1)
+
+    if whole and fraction:
+        return f"{whole} {fraction}"
+
+    return str(fraction or whole)
+
+def format_quantity(dimension, amount):
+    if dimension == "volume":
+        # Cups from a quarter cup up, so "1/2 cup" isn't shown as "8 tbsp"
+        if amount >= 12:
+            amount, unit = amount / 48, "cup"
+        elif amount >= 3:
+            amount, unit = amount / 3, "tbsp"
+        else:
+            unit = "tsp"
+    elif dimension == "weight":
+        if amount >= 16:
+            amount, unit = amount / 16, "lb"
+        else:
+            unit = "oz"
+    elif dimension == "count":
+        return format_amount(amount)
+    else:
+        unit = dimension
+
+    text = format_amount(amount)
+    # Only whole-word units take a plural
+    if unit in ("cup", "can", "clove", "bunch", "head", "package", "slice", "jar", "bag") and text != "1" and amount > 1:
+        unit += "es" if unit.endswith(("ch", "sh")) else "s"
+
+    return f"{text} {unit}"
+
+def build_grocery_list(meals):
+    """Merges every meal's coreIngredients into {category: [item text]},
+    with categories in display order and items sorted by name."""
+    items = {}
+
+    for meal in meals or []:
+        if not isinstance(meal, dict):
+            continue
+
+        for ingredient in meal.get("coreIngredients") or []:
+            if not isinstance(ingredient, str):
+                continue
+
+            display, key, quantity = parse_ingredient(ingredient)
+            if key is None:
+                continue
+
+            item = items.setdefault(key, {"name": display, "quantities": {}, "meals": 0})
+            item["meals"] += 1
+            if quantity is not None:
+                dimension, amount = quantity
+                item["quantities"][dimension] = item["quantities"].get(dimension, 0) + amount
+
+    grouped = {}
+    for key, item in sorted(items.items()):
+        if item["quantities"]:
+            detail = " + ".join(format_quantity(dimension, amount) for dimension, amount in sorted(item["quantities"].items()))
+        elif item["meals"] > 1:
+            detail = f"for {item['meals']} meals"
+        else:
+            detail = None
+
+        name = item["name"][0].upper() + item["name"][1:]
+        grouped.setdefault(categorize(key), []).append(f"{name} ({detail})" if detail else name)
+
+    return {category: grouped[category] for category in CATEGORIES if category in grouped}
+
+def render_grocery_list(grouped):
+    # The HTML the web app shows: <p><strong>Category:</strong></p> then a <ul> of its items
+    return "".join(
+        f"<p><strong>{html.escape(category)}:</strong></p><ul>"
+        + "".join(f"<li>{html.escape(item)}</li>" for item in items)
+        + "</ul>"
+        for category, items in grouped.items()
+    )
+
+def with_grocery_list(meal_plan):
+    """The meal plan with its groceryList built from the meals. Anything else passes through."""
+    if not isinstance(meal_plan, dict) or not isinstance(meal_plan.get("meals"), list):
+        return meal_plan
+
+    return {**meal_plan, "groceryList": render_grocery_list(build_grocery_list(meal_plan["meals"]))}
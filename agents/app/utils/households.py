@@ -0,0 +1,74 @@
+from bson import ObjectId
+from collections import OrderedDict
+from contextvars import ContextVar
+from dotenv import load_dotenv
+import functools
+import os
+from .database import get_collection
+from .constants import WEEKLY_MEAL_PLANS_COLLECTION
+from .telemetry import span
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Preferences and plans written before households existed have no householdId and belong to this one
+DEFAULT_HOUSEHOLD_ID = os.getenv("DEFAULT_HOUSEHOLD_ID", "default")
+
+# Requests whose household is remembered, so each stage doesn't look it up again
+REQUEST_HOUSEHOLD_CACHE_SIZE = int(os.getenv("REQUEST_HOUSEHOLD_CACHE_SIZE", "10000"))
+
+# The household the agent tools read preferences and recent meals for
+current_household = ContextVar("household_id", default=DEFAULT_HOUSEHOLD_ID)
+
+_request_households = OrderedDict()
+
+def household_filter(household_id):
+    if household_id == DEFAULT_HOUSEHOLD_ID:
+        # null also matches documents without the field, and uses the same index
+        return {"householdId": {"$in": [household_id, None]}}
+
+    return {"householdId": household_id}
+
+def household_of(document):
+    return (document or {}).get("householdId") or DEFAULT_HOUSEHOLD_ID
+
+def remember_request_household(request_id, household_id):
+    if request_id is None:
+        return
+
+    _request_households[request_id] = household_id or DEFAULT_HOUSEHOLD_ID
+    _request_households.move_to_end(request_id)
+
+    while len(_request_households) > REQUEST_HOUSEHOLD_CACHE_SIZE:
+        _request_households.popitem(last=False)
+
+async def get_request_household(request_id):
+    if request_id in _request_households:
+        _request_households.move_to_end(request_id)
+        return _request_households[request_id]
+
+    if not ObjectId.is_valid(request_id):
+        return DEFAULT_HOUSEHOLD_ID
+
+    collection = get_collection(WEEKLY_MEAL_PLANS_COLLECTION)
+    with span("mongo.find_one", collection=WEEKLY_MEAL_PLANS_COLLECTION):
+        document = await collection.find_one({"_id": ObjectId(request_id)}, {"householdId": 1})
+
+    household_id = household_of(document)
+    remember_request_household(request_id, household_id)
+
+    return household_id
+
+def household_scoped(fn):
+    """Runs an agent with its request's household as the one the tools read from.
+    The wrapped coroutine takes the request_id as its first argument."""
+
+    @functools.wraps(fn)
+    async def wrapper(request_id, *args, **kwargs):
+        token = current_household.set(await get_request_household(request_id))
+        try:
+            return await fn(request_id, *args, **kwargs)
+        finally:
+            current_household.reset(token)
+
+    return wrapper
@@ -0,0 +1,154 @@
+from dotenv import load_dotenv
+import asyncio
+import os
+import time
+from .telemetry import get_logger, stage_span
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+class SchedulerUnavailable(Exception):
+    status_code = 503
+
+class SchedulerSaturated(SchedulerUnavailable):
+    status_code = 429
+
+class SchedulerStopped(SchedulerUnavailable):
+    status_code = 503
+
+def _stage_setting(stage, setting, default):
+    # e.g. CHILD_PREFERENCES_WORKERS, falling back to SCHEDULER_WORKERS
+    stage_key = f"{stage.upper().replace('-', '_')}_{setting}"
+    return int(os.getenv(stage_key, os.getenv(f"SCHEDULER_{setting}", default)))
+
+class StagePool:
+    """A fixed set of workers pulling agent runs for one stage off a bounded queue."""
+
+    def __init__(self, name, workers, queue_size):
+        self.name = name
+        self.worker_count = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.in_flight = {}
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._workers = []
+
+    def start(self):
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"{self.name}-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+
+    def free_slots(self):
+        return self.queue.maxsize - self.queue.qsize()
+
+    def put(self, request_id, fn, args):
+        self.in_flight[request_id] = "queued"
+        self.queue.put_nowait((request_id, fn, args, time.monotonic()))
+
+    async def _work(self):
+        while True:
+            request_id, fn, args, enqueued_at = await self.queue.get()
+
+            wait = time.monotonic() - enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.in_flight[request_id] = "running"
+
+            try:
+                with stage_span(self.name, request_id):
+                    await fn(*args)
+                self.completed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("%s job failed", self.name)
+            finally:
+                self.in_flight.pop(request_id, None)
+                self.queue.task_done()
+
+    async def drain(self, timeout):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%s: %d job(s) still in flight at shutdown", self.name, len(self.in_flight))
+
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def stats(self):
+        started = self.completed + self.failed + sum(1 for state in self.in_flight.values() if state == "running")
+
+        return {
+            "workers": self.worker_count,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "in_flight": dict(self.in_flight),
+            "completed": self.completed,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "avg_wait_seconds": self.total_wait / started if started else 0.0,
+            "max_wait_seconds": self.max_wait,
+        }
+
+class JobScheduler:
+    """Runs agent flows on per-stage worker pools instead of unbounded create_task calls."""
+
+    def __init__(self):
+        self.stages = {}
+        self.running = False
+
+    def register_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StagePool(
+                name,
+                workers=_stage_setting(name, "WORKERS", "4"),
+                queue_size=_stage_setting(name, "QUEUE_SIZE", "100"),
+            )
+
+    def start(self):
+        for pool in self.stages.values():
+            pool.start()
+
+        self.running = True
+
+    def submit_all(self, stage, jobs):
+        """Queues every (request_id, fn, args) job or none of them, so a rejected
+        sink batch can be retried as a whole without duplicating work."""
+        if not self.running:
+            raise SchedulerStopped(f"{stage} is not accepting work")
+
+        pool = self.stages[stage]
+
+        # A request that is already queued or running here is a redelivery, drop it
+        unique_jobs = {}
+        for request_id, fn, args in jobs:
+            if request_id in pool.in_flight or request_id in unique_jobs:
+                pool.coalesced += 1
+            else:
+                unique_jobs[request_id] = (fn, args)
+
+        if pool.free_slots() < len(unique_jobs):
+            raise SchedulerSaturated(f"{stage} queue is full")
+
+        for request_id, (fn, args) in unique_jobs.items():
+            pool.put(request_id, fn, args)
+
+    async def shutdown(self, timeout=None):
+        self.running = False
+
+        if timeout is None:
+            timeout = float(os.getenv("SCHEDULER_DRAIN_TIMEOUT_SECONDS", "60"))
+
+        await asyncio.gather(*(pool.drain(timeout) for pool in self.stages.values()))
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.stages.items()}
+
+scheduler = JobScheduler()
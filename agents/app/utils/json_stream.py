@@ -0,0 +1,151 @@
+import json
+
+def message_text(content):
+    # Anthropic message content is either a string or a list of content blocks
+    if isinstance(content, str):
+        return content
+
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict) and block.get("type") == "text")
+
+def _parse_object(text):
+    try:
+        return json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        return None
+
+def _close_open_json(candidate):
+    # Returns candidate with open strings, objects and arrays closed, plus the
+    # positions of commas outside strings where it could be cut back to
+    stack = []
+    commas = []
+    in_string = False
+    escape = False
+    for i, ch in enumerate(candidate):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append(ch)
+        elif ch in '}]' and stack:
+            stack.pop()
+        elif ch == ',':
+            commas.append(i)
+
+    closed = candidate[:-1] if escape else candidate
+    if in_string:
+        closed += '"'
+
+    closed = closed.rstrip().rstrip(',')
+    closed += "".join('}' if ch == '{' else ']' for ch in reversed(stack))
+
+    return closed, commas
+
+def repair_json(input_string, max_attempts=20):
+    """Best-effort parse of model output that isn't valid JSON as-is: skips
+    surrounding prose, allows raw control characters inside strings and closes
+    strings, objects and arrays left open by a truncated response, dropping a
+    trailing partial key or value if needed."""
+    start = input_string.find('{')
+    if start == -1:
+        return None
+
+    candidate = input_string[start:]
+
+    end = candidate.rfind('}')
+    if end != -1:
+        result = _parse_object(candidate[:end + 1])
+        if result is not None:
+            return result
+
+    closed, commas = _close_open_json(candidate)
+    result = _parse_object(closed)
+
+    # Cut back to earlier commas until what's left parses
+    for comma in reversed(commas[-max_attempts:]):
+        if result is not None:
+            break
+        closed, _ = _close_open_json(candidate[:comma])
+        result = _parse_object(closed)
+
+    return result
+
+class MealStreamParser:
+    """Incrementally scans a streamed meal plan JSON document and returns each
+    object in the top-level "meals" array as soon as its closing brace arrives.
+
+    Only the meal currently being read is buffered. Text before the first '{'
+    is ignored so leading prose from the model doesn't confuse the scanner.
+    """
+
+    def __init__(self):
+        self.meals = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_chars = None
+        self._last_key = None
+        self._in_meals = False
+        self._meal_chars = None
+
+    def feed(self, text):
+        completed = []
+
+        for ch in text:
+            if self._meal_chars is not None:
+                self._meal_chars.append(ch)
+
+            if self._depth == 0 and ch != '{':
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._last_key = "".join(self._key_chars)
+                        self._key_chars = None
+                    continue
+
+                if self._key_chars is not None:
+                    self._key_chars.append(ch)
+            elif ch == '"':
+                self._in_string = True
+                # Only top-level keys are collected, never their (possibly large) values
+                if self._depth == 1 and self._expect_key:
+                    self._key_chars = []
+            elif ch in '{[':
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+                elif ch == '[' and self._depth == 2 and self._last_key == "meals":
+                    self._in_meals = True
+                elif ch == '{' and self._depth == 3 and self._in_meals:
+                    self._meal_chars = ['{']
+            elif ch in '}]':
+                if ch == '}' and self._depth == 3 and self._meal_chars is not None:
+                    meal = _parse_object("".join(self._meal_chars))
+                    self._meal_chars = None
+                    if meal is not None:
+                        self.meals.append(meal)
+                        completed.append(meal)
+                elif ch == ']' and self._depth == 2:
+                    self._in_meals = False
+
+                self._depth -= 1
+            elif self._depth == 1:
+                if ch == ',':
+                    self._expect_key = True
+                elif ch == ':':
+                    self._expect_key = False
+
+        return completed
@@ -0,0 +1,171 @@
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from dotenv import load_dotenv
+from pathlib import Path
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Get the path to the root directory
+root_dir = Path(__file__).resolve().parent.parent
+
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(root_dir / "llm_cache.sqlite3"))
+CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+# Stages whose model calls go through the cache. Stages left out, like the
+# shared agent's reflection loop, always call the model.
+CACHE_STAGES = {stage.strip() for stage in os.getenv("LLM_CACHE_STAGES", "").split(",") if stage.strip()}
+
+def _strip_ids(value):
+    # Message and tool call ids change on every run even when the conversation
+    # doesn't, so they are left out of the key
+    if isinstance(value, dict):
+        return {k: _strip_ids(v) for k, v in value.items() if k not in ("id", "tool_call_id")}
+    if isinstance(value, list):
+        return [_strip_ids(v) for v in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+def cache_key(prompt, llm_string):
+    """Hashes the serialized messages (system prompt included) with the model
+    name, temperature and other call parameters carried in llm_string."""
+    try:
+        normalized = json.dumps(_strip_ids(json.loads(prompt)), sort_keys=True)
+    except ValueError:
+        normalized = prompt
+
+    return hashlib.sha256(f"{llm_string}\n{normalized}".encode()).hexdigest()
+
+class _SQLiteStore:
+    """The SQLite file shared by every stage's cache."""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+        self._connection.commit()
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+
+            self._connection.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+
+            return value
+
+    def put(self, key, stage, value):
+        now = time.time()
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, stage, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, value, now, now),
+            )
+            # Expired entries go first, then the least recently used ones over the size limit
+            self._connection.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._connection.execute(
+                """DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            self._connection.commit()
+
+    def clear(self, stage):
+        with self._lock:
+            self._connection.execute("DELETE FROM llm_cache WHERE stage = ?", (stage,))
+            self._connection.commit()
+
+    def count(self, stage):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM llm_cache WHERE stage = ?", (stage,)
+            ).fetchone()[0]
+
+class SQLiteLLMCache(BaseCache):
+    """On-disk model response cache for one agent stage."""
+
+    def __init__(self, store, stage):
+        self.store = store
+        self.stage = stage
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, prompt, llm_string):
+        value = self.store.get(cache_key(prompt, llm_string))
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return loads(value)
+
+    def update(self, prompt, llm_string, return_val):
+        self.store.put(cache_key(prompt, llm_string), self.stage, dumps(return_val))
+
+    def clear(self, **kwargs):
+        self.store.clear(self.stage)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self.store.count(self.stage),
+        }
+
+_store = None
+_caches = {}
+
+def get_llm_cache(stage):
+    """Returns the cache for a stage, or None when the stage hasn't opted in."""
+    global _store
+
+    if stage not in CACHE_STAGES:
+        return None
+
+    if _store is None:
+        _store = _SQLiteStore(CACHE_PATH, CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
+
+    if stage not in _caches:
+        _caches[stage] = SQLiteLLMCache(_store, stage)
+
+    return _caches[stage]
+
+def llm_cache_stats():
+    return {stage: cache.stats() for stage, cache in _caches.items()}
@@ -0,0 +1,16 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+class Meal(BaseModel):
+    title: str = Field(description="Name of the meal")
+    coreIngredients: List[str] = Field(description="Core ingredients, lowercase")
+    kidsVersion: Optional[str] = Field(default=None, description="Description of the kids' version of the meal")
+    adultVersion: Optional[str] = Field(default=None, description="Description of the adult version of the meal")
+    recipe: Optional[str] = Field(default=None, description="Basic recipe with prep time and instructions")
+
+class MealPlan(BaseModel):
+    """A weekly family meal plan. The same shape the format agent produces;
+    the groceryList the web application displays is built from the meals."""
+
+    summary: str = Field(description="Short summary of the week's meals including the meal names")
+    meals: List[Meal] = Field(min_length=1)
@@ -0,0 +1,119 @@
+from collections import defaultdict
+import os
+import threading
+import zlib
+
+class InMemoryMessage:
+    """Mirrors the parts of confluent_kafka.Message the worker reads."""
+
+    def __init__(self, topic, partition, offset, value):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._value = value
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def value(self):
+        return self._value
+
+    def error(self):
+        return None
+
+class InMemoryBroker:
+    """Partitioned topics kept in memory, so the worker can run end to end
+    in local runs and benchmarks without a Kafka cluster."""
+
+    def __init__(self, partitions=3):
+        self.partitions = partitions
+        self.topics = defaultdict(lambda: [[] for _ in range(self.partitions)])
+        # (group, topic, partition) -> next offset to read
+        self.committed = {}
+        self.appended = threading.Condition()
+
+    def append(self, topic, value, key=None):
+        if isinstance(value, str):
+            value = value.encode()
+
+        # Same key, same partition, like the default Kafka partitioner
+        partition = zlib.crc32(key.encode()) % self.partitions if key else 0
+
+        with self.appended:
+            log = self.topics[topic][partition]
+            log.append(value)
+            self.appended.notify_all()
+
+        return partition, len(log) - 1
+
+    def end_offsets(self, topic):
+        return [len(log) for log in self.topics[topic]]
+
+class InMemoryConsumer:
+    """Single-member consumer group over an InMemoryBroker. Implements the
+    subset of the confluent_kafka.Consumer API that the worker uses."""
+
+    def __init__(self, broker, group_id):
+        self.broker = broker
+        self.group_id = group_id
+        self.assignment = []
+        self.positions = {}
+        self.paused = set()
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        self.assignment = [(topic, p) for topic in topics for p in range(self.broker.partitions)]
+        for topic, p in self.assignment:
+            self.positions[(topic, p)] = self.broker.committed.get((self.group_id, topic, p), 0)
+
+        if on_assign is not None:
+            on_assign(self, self.assignment)
+
+    def consume(self, num_messages=1, timeout=-1):
+        with self.broker.appended:
+            messages = self._read(num_messages)
+            if not messages:
+                # Wait for a producer, like a real poll would
+                self.broker.appended.wait(None if timeout < 0 else timeout)
+                messages = self._read(num_messages)
+
+        return messages
+
+    def _read(self, num_messages):
+        messages = []
+        for topic, p in self.assignment:
+            if (topic, p) in self.paused:
+                continue
+
+            log = self.broker.topics[topic][p]
+            while self.positions[(topic, p)] < len(log) and len(messages) < num_messages:
+                offset = self.positions[(topic, p)]
+                messages.append(InMemoryMessage(topic, p, offset, log[offset]))
+                self.positions[(topic, p)] = offset + 1
+
+        return messages
+
+    def commit(self, offsets, asynchronous=False):
+        with self.broker.appended:
+            for topic, p, offset in offsets:
+                self.broker.committed[(self.group_id, topic, p)] = offset
+
+    def pause(self, partitions):
+        with self.broker.appended:
+            self.paused.update(partitions)
+
+    def resume(self, partitions):
+        with self.broker.appended:
+            self.paused.difference_update(partitions)
+            # Wake a consume() that is waiting on the resumed partitions
+            self.broker.appended.notify_all()
+
+    def close(self):
+        self.assignment = []
+
+memory_broker = InMemoryBroker(int(os.getenv("KAFKA_MEMORY_PARTITIONS", "3")))
@@ -0,0 +1,182 @@
+from functools import cached_property
+from langchain_anthropic import ChatAnthropic
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from dotenv import load_dotenv
+import anthropic
+import asyncio
+import httpx
+import json
+import os
+import time
+from .llm_cache import get_llm_cache
+from .rate_limiter import RateLimitedChatMixin, estimate_tokens
+from .token_usage import TokenUsageCallback
+from .telemetry import ModelTelemetryCallback
+
+# Load environment variables from .env file
+load_dotenv()
+
+MODEL_NAME = 'claude-3-5-haiku-20241022'
+
+# One connection pool shared by every agent's Anthropic client
+ANTHROPIC_MAX_CONNECTIONS = int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "20"))
+
+# Scripted responses for the fake model, keyed by stage. Each entry is a
+# string, an AIMessage (e.g. one with tool_calls) or a callable that takes
+# the prompt messages and returns either. Turn N of a conversation uses
+# entry N, and turns past the end of the script fall back to filler text.
+fake_scripts = {}
+
+class ScriptedChatModel(BaseChatModel):
+    """Deterministic local chat model used for benchmarks and offline runs."""
+
+    stage: str = "default"
+    model_name: str = "fake-chat-model"
+    temperature: float = 0.7
+    latency: float = 0.0
+    output_tokens: int = 200
+
+    @property
+    def _llm_type(self):
+        return "fake-chat-model"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name, "temperature": self.temperature, "stage": self.stage}
+
+    def bind_tools(self, tools, **kwargs):
+        # Tool calls come from the script, so there is nothing to bind
+        return self
+
+    def _next_message(self, messages):
+        script = fake_scripts.get(self.stage, [])
+        turn = sum(1 for message in messages if isinstance(message, AIMessage))
+
+        if turn < len(script):
+            entry = script[turn]
+            if callable(entry):
+                entry = entry(messages)
+        else:
+            entry = " ".join(f"{self.stage}-token-{i}" for i in range(self.output_tokens))
+
+        message = entry.model_copy() if isinstance(entry, AIMessage) else AIMessage(content=entry)
+        message.usage_metadata = {
+            "input_tokens": estimate_tokens(messages),
+            "output_tokens": len(str(message.content).split()),
+            "total_tokens": estimate_tokens(messages) + len(str(message.content).split()),
+        }
+
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._next_message(messages)
+        tokens = str(message.content).split(" ")
+        token_latency = self.latency / max(len(tokens), 1)
+
+        for i, token in enumerate(tokens):
+            if token_latency > 0:
+                await asyncio.sleep(token_latency)
+
+            text = token if i == 0 else " " + token
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+        if message.tool_calls or message.usage_metadata:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                    for i, call in enumerate(message.tool_calls)
+                ],
+                usage_metadata=message.usage_metadata,
+            ))
+
+class FakeChatModel(RateLimitedChatMixin, ScriptedChatModel):
+    """Scripted model whose calls go through the shared token budget, like the real one."""
+
+def cached_system_prompt(text):
+    """System message with an Anthropic cache breakpoint, so the static prompt
+    (and the tool definitions ahead of it) is cached across calls and turns."""
+    return SystemMessage(content=[{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}])
+
+_shared_clients = {}
+
+def _http_limits():
+    return httpx.Limits(max_connections=ANTHROPIC_MAX_CONNECTIONS, max_keepalive_connections=ANTHROPIC_MAX_CONNECTIONS)
+
+class SharedPoolChatAnthropic(RateLimitedChatMixin, ChatAnthropic):
+    """ChatAnthropic whose Anthropic clients, and so their HTTP connection
+    pools, are shared with every other stage instead of built per model.
+    Calls go through the shared token budget, which also does the retrying."""
+
+    stage: str = "default"
+
+    @cached_property
+    def _client(self):
+        if "sync" not in _shared_clients:
+            _shared_clients["sync"] = anthropic.Client(**self._client_params, http_client=anthropic.DefaultHttpxClient(limits=_http_limits()))
+
+        return _shared_clients["sync"]
+
+    @cached_property
+    def _async_client(self):
+        if "async" not in _shared_clients:
+            _shared_clients["async"] = anthropic.AsyncClient(**self._client_params, http_client=anthropic.DefaultAsyncHttpxClient(limits=_http_limits()))
+
+        return _shared_clients["async"]
+
+def create_model(stage, temperature=0.7):
+    """Builds the chat model for an agent stage. Set MODEL_PROVIDER=fake to run
+    every stage against the deterministic local model instead of Anthropic."""
+    cache = get_llm_cache(stage)
+    callbacks = [TokenUsageCallback(stage), ModelTelemetryCallback(stage)]
+
+    if os.getenv("MODEL_PROVIDER", "anthropic") == "fake":
+        return FakeChatModel(
+            stage=stage,
+            temperature=temperature,
+            latency=float(os.getenv("FAKE_MODEL_LATENCY_SECONDS", "0")),
+            output_tokens=int(os.getenv("FAKE_MODEL_OUTPUT_TOKENS", "200")),
+            cache=cache,
+            callbacks=callbacks,
+        )
+
+    return SharedPoolChatAnthropic(stage=stage, model=MODEL_NAME, temperature=temperature, max_retries=0, cache=cache, callbacks=callbacks)
+
+# Models, graphs and chains are built on first use rather than at import,
+# so the app starts serving before any agent has been touched
+_components = {}
+build_seconds = {}
+
+def get_component(name, build):
+    if name not in _components:
+        start_time = time.perf_counter()
+        _components[name] = build()
+        build_seconds[name] = time.perf_counter() - start_time
+
+    return _components[name]
+
+def get_model(stage, temperature=0.7):
+    return get_component(f"model:{stage}:{temperature}", lambda: create_model(stage, temperature))
+
+async def close_models():
+    if "async" in _shared_clients:
+        await _shared_clients.pop("async").close()
+    if "sync" in _shared_clients:
+        _shared_clients.pop("sync").close()
@@ -0,0 +1,174 @@
+from bson import ObjectId
+from datetime import date, datetime, timedelta, timezone
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import hashlib
+import json
+import os
+from .database import get_collection
+from .households import household_of
+from .preferences_cache import get_preference_snapshot
+from .recent_meals import get_recent_weeks
+from .constants import MEAL_PLAN_CANDIDATES_COLLECTION, WEEKLY_MEAL_PLANS_COLLECTION
+from .telemetry import get_logger, span
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# How long another replica waits before taking over a household whose generation went quiet
+CANDIDATE_LEASE_SECONDS = float(os.getenv("PREGENERATE_LEASE_SECONDS", "1800"))
+
+# A candidate is generating (leased by a pre-generation pass), ready, used (served to request_id),
+# stale (outdated when request_id arrived, so its plan was generated live) or failed (the next pass retries it)
+stats = {"served": 0, "stale": 0, "missing": 0}
+
+def preferences_fingerprint(snapshot):
+    # The candidate is only valid for the preferences it was generated from
+    return hashlib.sha256(json.dumps(snapshot or {}, sort_keys=True, default=str).encode()).hexdigest()
+
+def meal_titles(meals):
+    return {meal["title"].strip().lower() for meal in meals or [] if isinstance(meal, dict) and isinstance(meal.get("title"), str)}
+
+async def ensure_candidate_indexes():
+    collection = get_collection(MEAL_PLAN_CANDIDATES_COLLECTION)
+    # One candidate per household and week, which also makes the generation lease exclusive
+    await collection.create_index([("householdId", 1), ("startDate", 1)], unique=True)
+    # Gone once the week it was generated for is over
+    await collection.create_index("expires_at", expireAfterSeconds=0)
+
+async def lease_candidate(household_id, start_date, fingerprint, generation_id):
+    """Takes the household's candidate for the week for generation_id, unless
+    one is already ready for these preferences, the week was requested, or
+    it's being generated elsewhere. Returns whether this caller should
+    generate it."""
+    now = datetime.now(timezone.utc)
+    collection = get_collection(MEAL_PLAN_CANDIDATES_COLLECTION)
+
+    try:
+        with span("mongo.update_one", collection=MEAL_PLAN_CANDIDATES_COLLECTION):
+            # Inserts when there's no candidate yet; one that doesn't match raises on the unique index
+            await collection.update_one(
+                {"householdId": household_id, "startDate": start_date, "$or": [
+                    {"status": "failed"},
+                    {"status": "ready", "preferences_fingerprint": {"$ne": fingerprint}},
+                    {"status": "generating", "lease_until": {"$lt": now}},
+                ]},
+                {"$set": {
+                    "status": "generating",
+                    "generation_id": generation_id,
+                    "lease_until": now + timedelta(seconds=CANDIDATE_LEASE_SECONDS),
+                    "expires_at": week_end(start_date),
+                }},
+                upsert=True,
+            )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def store_candidate(household_id, start_date, generation_id, meal_plan, fingerprint):
+    collection = get_collection(MEAL_PLAN_CANDIDATES_COLLECTION)
+
+    with span("mongo.update_one", collection=MEAL_PLAN_CANDIDATES_COLLECTION):
+        # Lost if the lease ran out and another replica took over
+        result = await collection.update_one(
+            {"householdId": household_id, "startDate": start_date, "status": "generating", "generation_id": generation_id},
+            {"$set": {
+                "status": "ready",
+                "meal_plan": meal_plan,
+                "preferences_fingerprint": fingerprint,
+                "created_at": datetime.now(timezone.utc),
+            }, "$unset": {"lease_until": ""}},
+        )
+
+    return result.modified_count == 1
+
+async def release_candidate(household_id, start_date, generation_id):
+    # Lets the next pass try again
+    await get_collection(MEAL_PLAN_CANDIDATES_COLLECTION).update_one(
+        {"householdId": household_id, "startDate": start_date, "status": "generating", "generation_id": generation_id},
+        {"$set": {"status": "failed"}, "$unset": {"lease_until": ""}},
+    )
+
+def week_end(start_date):
+    return datetime.combine(date.fromisoformat(start_date) + timedelta(weeks=1), datetime.min.time(), tzinfo=timezone.utc)
+
+async def is_still_valid(candidate, household_id):
+    snapshot = await get_preference_snapshot(household_id)
+    if candidate.get("preferences_fingerprint") != preferences_fingerprint(snapshot):
+        return False
+
+    # Plans saved since it was generated may now share meals with it
+    recent = set()
+    for week in await get_recent_weeks(household_id):
+        recent |= meal_titles(week.get("meals"))
+
+    return not (meal_titles((candidate.get("meal_plan") or {}).get("meals")) & recent)
+
+async def claim_candidate(request_id):
+    """The pre-generated meal plan for a request's household and week, if it
+    is still valid, or None. Every stage handling the same request gets the
+    same answer, so the first one to ask claims it for the rest."""
+    if not ObjectId.is_valid(request_id):
+        return None
+
+    with span("mongo.find_one", collection=WEEKLY_MEAL_PLANS_COLLECTION):
+        request = await get_collection(WEEKLY_MEAL_PLANS_COLLECTION).find_one({"_id": ObjectId(request_id)}, {"householdId": 1, "startDate": 1})
+    if not request or not request.get("startDate"):
+        return None
+
+    household_id = household_of(request)
+    collection = get_collection(MEAL_PLAN_CANDIDATES_COLLECTION)
+    query = {
+        "householdId": household_id,
+        "startDate": request["startDate"],
+        # Only candidates that existed when the request was made, so every stage sees the same one.
+        # ObjectIds keep whole seconds, so allow for the rest of that second.
+        "created_at": {"$lt": ObjectId(request_id).generation_time + timedelta(seconds=1)},
+        "$or": [{"status": "ready"}, {"status": "used", "request_id": request_id}],
+    }
+
+    with span("mongo.find_one", collection=MEAL_PLAN_CANDIDATES_COLLECTION):
+        candidate = await collection.find_one(query)
+    if candidate is None:
+        stats["missing"] += 1
+        return None
+
+    if candidate["status"] == "ready" and not await is_still_valid(candidate, household_id):
+        with span("mongo.update_one", collection=MEAL_PLAN_CANDIDATES_COLLECTION):
+            result = await collection.update_one({"_id": candidate["_id"], "status": "ready"}, {"$set": {"status": "stale", "request_id": request_id}})
+
+        if result.modified_count == 0:
+            # Another stage of this request may have claimed and saved it while this one was
+            # validating, which puts its own meals in the recent meals digest
+            with span("mongo.find_one", collection=MEAL_PLAN_CANDIDATES_COLLECTION):
+                claimed = await collection.find_one({"_id": candidate["_id"], "status": "used", "request_id": request_id})
+            if claimed is not None:
+                stats["served"] += 1
+                return claimed["meal_plan"]
+
+        stats["stale"] += 1
+        logger.info("claim_candidate: candidate for %s week of %s is stale", household_id, request["startDate"])
+        return None
+
+    with span("mongo.find_one_and_update", collection=MEAL_PLAN_CANDIDATES_COLLECTION):
+        # Not one another stage of this request already found stale
+        claimed = await collection.find_one_and_update(
+            {"_id": candidate["_id"], "$or": [{"status": "ready"}, {"status": "used", "request_id": request_id}]},
+            {"$set": {"status": "used", "request_id": request_id}},
+            return_document=ReturnDocument.AFTER,
+        )
+    # Another request for the same week got it first
+    if claimed is None:
+        stats["missing"] += 1
+        return None
+
+    stats["served"] += 1
+    return claimed["meal_plan"]
+
+async def candidate_counts(start_date):
+    # How many households' candidates for the week are in each status
+    pipeline = [{"$match": {"startDate": start_date}}, {"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+    return {doc["_id"]: doc["count"] async for doc in get_collection(MEAL_PLAN_CANDIDATES_COLLECTION).aggregate(pipeline)}
@@ -0,0 +1,49 @@
+import re
+
+# Numbered meal headings such as "1.", "**2. Tacos**", "### Meal 3:" or "Day 4)"
+MEAL_HEADING = re.compile(r"^\s*(?:#{1,6}\s*)?(?:\*\*)?\s*(?:meal|dinner|day)?\s*(\d{1,2})\s*[.:)]", re.IGNORECASE | re.MULTILINE)
+CORE_INGREDIENTS = re.compile(r"core ingredients?\**\s*:?\**\s*(.+)", re.IGNORECASE)
+WORD = re.compile(r"[a-z]{3,}")
+
+STOP_WORDS = {
+    "and", "with", "the", "for", "optional", "fresh", "kids", "adults", "adult", "version", "extra", "mild", "spicy", "sauce",
+}
+
+def count_meals(text):
+    return len(set(MEAL_HEADING.findall(text)))
+
+def ingredient_terms(text):
+    # Prefer the "Core Ingredients" lines, and fall back to the whole text when a plan doesn't have them
+    lines = CORE_INGREDIENTS.findall(text)
+    source = " ".join(lines) if lines else text
+
+    return {word for word in WORD.findall(source.lower()) if word not in STOP_WORDS}
+
+def score_meal_plan(draft, expected_meal_count, source_text, meal_plan=None):
+    """Cheap local check of a shared plan draft against the child and adult plans.
+
+    Returns a score from 0 to 1 that combines whether the draft has the requested
+    number of meals with how many of its core ingredients come from the input plans.
+    """
+    if meal_plan is not None:
+        meal_count = len(meal_plan.get("meals", []))
+        draft_terms = {
+            word
+            for meal in meal_plan.get("meals", [])
+            for ingredient in meal.get("coreIngredients", [])
+            for word in WORD.findall(ingredient.lower())
+            if word not in STOP_WORDS
+        }
+    else:
+        meal_count = count_meals(draft)
+        draft_terms = ingredient_terms(draft)
+
+    if expected_meal_count:
+        count_score = max(0.0, 1 - abs(meal_count - expected_meal_count) / expected_meal_count)
+    else:
+        count_score = 1.0 if meal_count else 0.0
+
+    source_terms = ingredient_terms(source_text)
+    overlap = len(draft_terms & source_terms) / len(draft_terms) if draft_terms else 0.0
+
+    return round((count_score + overlap) / 2, 3)
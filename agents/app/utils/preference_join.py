@@ -0,0 +1,154 @@
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+import asyncio
+import os
+import time
+from .publish_to_topic import produce
+from .constants import PREFERENCE_JOIN_DEAD_LETTER_TOPIC
+from .telemetry import get_logger, JOIN_PENDING, JOIN_DROPPED, JOIN_WAIT
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+SIDES = ("child", "adult")
+
+class JoinEntry:
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.sides = {}
+        self.created_at = time.monotonic()
+        self._released = None
+
+    def ready(self):
+        return all(side in self.sides for side in SIDES)
+
+    def released(self):
+        # Resolves once this entry was joined and handled, or dropped
+        if self._released is None:
+            self._released = asyncio.get_running_loop().create_future()
+
+        return self._released
+
+    def release(self):
+        if self._released is not None and not self._released.done():
+            self._released.set_result(None)
+
+class PreferenceJoin:
+    """Pairs the child and adult plans for a request as they arrive, in place
+    of the Flink SQL join. State is bounded by a TTL and a maximum number of
+    half-joined requests, oldest dropped first. Dropped plans are published
+    to the dead-letter topic before their entries are released."""
+
+    def __init__(self, ttl_seconds, max_pending):
+        self.ttl_seconds = ttl_seconds
+        self.max_pending = max_pending
+        self.joined = 0
+        self.expired = 0
+        self.evicted = 0
+        self.dead_lettered = 0
+        self._pending = OrderedDict()
+        # Dropped entries and why, waiting to be dead-lettered
+        self._dropped = deque()
+
+    def add(self, side, request_id, content):
+        """Records one side and returns its entry. Once entry.ready() the
+        entry has left the join state and the caller owns it."""
+        self.expire()
+
+        entry = self._pending.get(request_id)
+        if entry is None:
+            entry = self._pending[request_id] = JoinEntry(request_id)
+
+        entry.sides[side] = content
+
+        if entry.ready():
+            del self._pending[request_id]
+            self.joined += 1
+            JOIN_WAIT.observe(time.monotonic() - entry.created_at)
+        else:
+            while len(self._pending) > self.max_pending:
+                self._drop(self._pending.popitem(last=False)[1], "evicted")
+
+        JOIN_PENDING.set(len(self._pending))
+
+        return entry
+
+    def restore(self, entry):
+        # Puts a joined entry back when the shared stage couldn't be started, so a retry finds both sides
+        self._pending[entry.request_id] = entry
+        self.joined -= 1
+        JOIN_PENDING.set(len(self._pending))
+
+    def expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+
+        # Entries are kept in arrival order, so only the front can be stale
+        while self._pending:
+            entry = next(iter(self._pending.values()))
+            if entry.created_at > cutoff:
+                break
+
+            del self._pending[entry.request_id]
+            self._drop(entry, "expired")
+
+        JOIN_PENDING.set(len(self._pending))
+
+    def _drop(self, entry, reason):
+        if reason == "expired":
+            self.expired += 1
+        elif reason == "evicted":
+            self.evicted += 1
+
+        JOIN_DROPPED.labels(reason).inc()
+        logger.warning("join: dropped %s with only the %s plan (%s)", entry.request_id, ", ".join(entry.sides), reason)
+        self._dropped.append((entry, reason))
+
+    def drop_all(self, reason):
+        # For shutdown when nothing will redeliver the pending plans, e.g. ones posted by the HTTP connectors
+        while self._pending:
+            self._drop(self._pending.popitem(last=False)[1], reason)
+
+        JOIN_PENDING.set(0)
+
+    async def dead_letter_dropped(self):
+        """Publishes each dropped plan to the dead-letter topic, then releases
+        its entry. An entry whose publish fails stays queued for the next call,
+        so the worker keeps holding back its offset meanwhile."""
+        while self._dropped:
+            entry, reason = self._dropped[0]
+
+            # Same fields as the child and adult output topics, so a record can be replayed into its side's topic
+            for side, content in entry.sides.items():
+                await produce(PREFERENCE_JOIN_DEAD_LETTER_TOPIC, { "content": content, "request_id": entry.request_id, "side": side, "reason": reason })
+
+            self._dropped.popleft()
+            self.dead_lettered += 1
+            entry.release()
+
+    async def expire_periodically(self, interval=5):
+        while True:
+            await asyncio.sleep(interval)
+            self.expire()
+
+            try:
+                await self.dead_letter_dropped()
+            except Exception:
+                logger.exception("join: dead-lettering dropped plans failed, retrying in %ds", interval)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "joined": self.joined,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "dead_lettered": self.dead_lettered,
+            "ttl_seconds": self.ttl_seconds,
+            "max_pending": self.max_pending,
+        }
+
+preference_join = PreferenceJoin(
+    float(os.getenv("JOIN_TTL_SECONDS", "3600")),
+    int(os.getenv("JOIN_MAX_PENDING", "10000")),
+)
@@ -0,0 +1,189 @@
+from dotenv import load_dotenv
+from pymongo.errors import OperationFailure, PyMongoError
+from collections import OrderedDict
+import asyncio
+import os
+import time
+from .database import get_collection
+from .households import current_household, household_filter, household_of
+from .constants import MEAL_PREFERENCES_COLLECTION
+from .rate_limiter import background_work
+from .telemetry import get_logger, span
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Everything the agent tools need from the preferences document, loaded in one read
+SNAPSHOT_PROJECTION = {"likes": 1, "dislikes": 1, "hardRequirements": 1, "mealCount": 1, "_id": 0}
+
+# Backoff between attempts to (re)open the preferences change stream
+WATCH_RETRY_SECONDS = 1
+WATCH_MAX_RETRY_SECONDS = 60
+# The server no longer has the oplog entries a resume token points at
+CHANGE_STREAM_HISTORY_LOST = 286
+
+async def load_preference_snapshot(household_id):
+    # Reads a household's preferences from MongoDB, past the cache
+    collection = get_collection(MEAL_PREFERENCES_COLLECTION)
+    with span("mongo.find_one", collection=MEAL_PREFERENCES_COLLECTION):
+        snapshot = await collection.find_one(household_filter(household_id), SNAPSHOT_PROJECTION)
+
+    if snapshot is None:
+        logger.warning("No meal preferences for household %s", household_id)
+        return {}
+
+    return snapshot
+
+class PreferenceCache:
+    """In-process TTL cache of each household's meal preferences. Only the
+    most recently used max_households are kept."""
+
+    def __init__(self, ttl_seconds, max_households):
+        self.ttl_seconds = ttl_seconds
+        self.max_households = max_households
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.coalesced = 0
+        # household_id -> (snapshot, loaded_at), least recently used first
+        self._snapshots = OrderedDict()
+        self._loading = {}
+        # Bumped when a household is invalidated while its load is in flight
+        self._generations = {}
+
+    def _fresh(self, household_id):
+        entry = self._snapshots.get(household_id)
+        if entry is None or time.monotonic() - entry[1] >= self.ttl_seconds:
+            return None
+
+        self._snapshots.move_to_end(household_id)
+        return entry[0]
+
+    def _store(self, household_id, snapshot):
+        self._snapshots[household_id] = (snapshot, time.monotonic())
+        self._snapshots.move_to_end(household_id)
+
+        while len(self._snapshots) > self.max_households:
+            self._snapshots.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, household_id):
+        snapshot = self._fresh(household_id)
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+
+        # Only one coroutine reloads a household, the rest wait for its result
+        loading = self._loading.get(household_id)
+        if loading is not None:
+            self.coalesced += 1
+            return await asyncio.shield(loading)
+
+        self.misses += 1
+        loading = self._loading[household_id] = asyncio.get_running_loop().create_future()
+        generation = self._generations.get(household_id, 0)
+        try:
+            snapshot = await load_preference_snapshot(household_id)
+
+            # What was read may predate an invalidation that arrived meanwhile, so don't keep it
+            if self._generations.get(household_id, 0) == generation:
+                self._store(household_id, snapshot)
+            loading.set_result(snapshot)
+
+            return snapshot
+        except Exception as e:
+            loading.set_exception(e)
+            # Waiters re-raise it; don't warn about it when there are none
+            loading.exception()
+            raise
+        finally:
+            if not loading.done():
+                loading.cancel()
+            del self._loading[household_id]
+            self._generations.pop(household_id, None)
+
+    def invalidate(self, household_id=None):
+        # Without a household every cached snapshot is dropped
+        if household_id is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(household_id, None)
+
+        # A load in flight may have read the old preferences, so it mustn't store them
+        for loading_household in self._loading:
+            if household_id in (None, loading_household):
+                self._generations[loading_household] = self._generations.get(loading_household, 0) + 1
+
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "households": len(self._snapshots),
+            "max_households": self.max_households,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+preference_cache = PreferenceCache(
+    float(os.getenv("PREFERENCES_CACHE_TTL_SECONDS", "300")),
+    int(os.getenv("PREFERENCES_CACHE_MAX_HOUSEHOLDS", "1000")),
+)
+
+async def get_preference_snapshot(household_id=None):
+    household_id = household_id or current_household.get()
+
+    # Off-peak pre-generation visits every household once, which would only push out the ones live requests use
+    if background_work.get():
+        return await load_preference_snapshot(household_id)
+
+    return await preference_cache.get(household_id)
+
+async def ensure_preference_indexes():
+    # One preferences document per household, found without a collection scan
+    await get_collection(MEAL_PREFERENCES_COLLECTION).create_index([("householdId", 1)])
+
+async def watch_preference_changes():
+    # Drops a household's cached snapshot whenever its preferences change.
+    # Change streams need a replica set; until one is reachable the cache relies on TTL + the invalidate endpoint.
+    collection = get_collection(MEAL_PREFERENCES_COLLECTION)
+    resume_token = None
+    delay = WATCH_RETRY_SECONDS
+
+    while True:
+        try:
+            async with collection.watch(full_document="updateLookup", resume_after=resume_token) as stream:
+                delay = WATCH_RETRY_SECONDS
+                async for change in stream:
+                    # Deletes carry no document, so the household is unknown
+                    document = change.get("fullDocument")
+                    preference_cache.invalidate(household_of(document) if document else None)
+                    resume_token = stream.resume_token
+        except OperationFailure as e:
+            if resume_token is not None and e.code == CHANGE_STREAM_HISTORY_LOST:
+                # Changes since the token are gone, so any cached snapshot may be outdated
+                logger.warning("Preference change stream history lost, clearing the cache")
+                preference_cache.invalidate()
+                resume_token = None
+                continue
+            logger.warning("Preference change stream unavailable, relying on TTL and retrying in %.0fs: %s", delay, e)
+        except PyMongoError as e:
+            logger.warning("Preference change stream unavailable, relying on TTL and retrying in %.0fs: %s", delay, e)
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WATCH_MAX_RETRY_SECONDS)
+
+def start_preference_watcher():
+    if os.getenv("PREFERENCES_CHANGE_STREAM", "true").lower() != "true":
+        return None
+
+    return asyncio.create_task(watch_preference_changes())
@@ -1,12 +1,34 @@
 from confluent_kafka import Producer
-import json
+from dotenv import load_dotenv
+import asyncio
+import os
+import threading
+from collections import defaultdict
 from pathlib import Path
+from .memory_broker import memory_broker
+from .serialization import encode_payload
+from .telemetry import get_logger, span
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
 
 # Get the path to the root directory
 root_dir = Path(__file__).resolve().parent.parent
 
 properties_file = root_dir / "client.properties"
 
+# Batching settings applied on top of client.properties. Values from
+# client.properties win so deployments can still tune them there.
+PRODUCER_DEFAULTS = {
+  "linger.ms": os.getenv("KAFKA_LINGER_MS", "20"),
+  "batch.size": os.getenv("KAFKA_BATCH_SIZE", "262144"),
+  "compression.type": os.getenv("KAFKA_COMPRESSION_TYPE", "lz4"),
+  "acks": "all",
+  "enable.idempotence": "true",
+}
+
 def read_config():
   # reads the client configuration from client.properties
   # and returns it as a key-value map
@@ -19,12 +41,116 @@ def read_config():
         config[parameter] = value.strip()
   return config
 
-def produce(topic, data):
-  # creates a new producer instance
-  producer = Producer(read_config())
+class KafkaProducer:
+  """Long-lived Confluent producer. A background thread serves delivery
+  callbacks so produce() can await delivery without blocking the event loop."""
+
+  def __init__(self, config):
+    self._producer = Producer({**PRODUCER_DEFAULTS, **config})
+    self._running = False
+    self._poll_thread = None
+
+  def start(self):
+    self._running = True
+    self._poll_thread = threading.Thread(target=self._poll_loop, name="kafka-producer-poll", daemon=True)
+    self._poll_thread.start()
+
+  def _poll_loop(self):
+    while self._running:
+      self._producer.poll(0.1)
+
+  async def produce(self, topic, data):
+    loop = asyncio.get_running_loop()
+    delivered = loop.create_future()
+
+    def resolve(err, msg):
+      if delivered.done():
+        return
+      if err is not None:
+        delivered.set_exception(RuntimeError(f"Delivery to {topic} failed: {err}"))
+      else:
+        delivered.set_result(msg)
+
+    def on_delivery(err, msg):
+      # Called from the poll thread
+      loop.call_soon_threadsafe(resolve, err, msg)
+
+    value = encode_payload(data)
+    # Keyed by request so every event for a request lands on the same partition
+    while True:
+      try:
+        self._producer.produce(topic, key=data.get("request_id"), value=value, on_delivery=on_delivery)
+        break
+      except BufferError:
+        # Local queue is full, give the poll thread a moment to drain it
+        await asyncio.sleep(0.05)
+
+    return await delivered
+
+  def close(self, timeout=10):
+    self._running = False
+    if self._poll_thread is not None:
+      self._poll_thread.join()
+
+    # send any outstanding or buffered messages to the Kafka broker
+    remaining = self._producer.flush(timeout)
+    if remaining > 0:
+      logger.warning("%d message(s) were not delivered before shutdown", remaining)
+
+class InMemoryProducer:
+  """Stand-in producer that keeps messages in memory. Used for local runs
+  and benchmarks where no broker is available. Messages also land on the
+  in-memory broker so a worker in the same process can consume them."""
+
+  def __init__(self, delivery_latency=0.0, broker=None):
+    self.delivery_latency = delivery_latency
+    self.broker = broker
+    self.messages = defaultdict(list)
+
+  def start(self):
+    pass
+
+  async def produce(self, topic, data):
+    if self.delivery_latency > 0:
+      await asyncio.sleep(self.delivery_latency)
+
+    value = encode_payload(data)
+    self.messages[topic].append(value)
+    if self.broker is not None:
+      self.broker.append(topic, value, key=data.get("request_id"))
+    return value
+
+  def close(self, timeout=10):
+    pass
+
+_producer = None
+
+def create_producer():
+  if os.getenv("KAFKA_PRODUCER", "confluent") == "memory":
+    return InMemoryProducer(float(os.getenv("KAFKA_MEMORY_DELIVERY_LATENCY", "0")), memory_broker)
+
+  return KafkaProducer(read_config())
+
+def start_producer():
+  global _producer
+
+  if _producer is None:
+    _producer = create_producer()
+    _producer.start()
+
+  return _producer
+
+def get_producer():
+  # Started in the app lifespan, but created on demand for scripts
+  return start_producer()
+
+def stop_producer(timeout=10):
+  global _producer
 
-  # produces a sample message
-  producer.produce(topic, value=json.dumps(data))
+  if _producer is not None:
+    _producer.close(timeout)
+    _producer = None
 
-  # send any outstanding or buffered messages to the Kafka broker
-  producer.flush()
\ No newline at end of file
+async def produce(topic, data):
+  with span("kafka.produce", topic=topic):
+    return await get_producer().produce(topic, data)
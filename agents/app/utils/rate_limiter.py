@@ -0,0 +1,279 @@
+from contextvars import ContextVar
+from dotenv import load_dotenv
+import anthropic
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from .telemetry import get_logger, RATE_LIMIT_WAIT, RATE_LIMIT_RETRIES
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Anthropic limits input and output tokens per minute separately. Off (0) until set to the API tier's limits.
+INPUT_TOKENS_PER_MINUTE = int(os.getenv("ANTHROPIC_INPUT_TOKENS_PER_MINUTE", "0"))
+OUTPUT_TOKENS_PER_MINUTE = int(os.getenv("ANTHROPIC_OUTPUT_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "60"))
+
+# Lower runs first. Stages closest to a finished plan go ahead of new requests.
+STAGE_PRIORITIES = {
+    "format-output": 0,
+    "shared-preferences": 1,
+    "child-preferences": 2,
+    "adult-preferences": 2,
+}
+
+# Calls made while this is set, such as off-peak pre-generation, queue behind every user-facing stage
+background_work = ContextVar("background_work", default=False)
+BACKGROUND_PRIORITY = 10
+
+# 429 is rate limited and 529 overloaded; both slow every stage down, not just the caller
+THROTTLE_STATUS_CODES = (429, 529)
+RETRYABLE_STATUS_CODES = (408, 409, 500, 502, 503, 504) + THROTTLE_STATUS_CODES
+
+def estimate_tokens(messages):
+    # Roughly four characters per token, good enough to reserve budget up front
+    return sum(len(str(message.content)) for message in messages) // 4
+
+class TokenBucket:
+    def __init__(self, tokens_per_minute):
+        self.rate = tokens_per_minute / 60
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def seconds_until(self, cost):
+        # Reservations are capped at capacity so one huge prompt can't wait forever
+        missing = min(cost, self.capacity) - self.tokens
+        return max(missing, 0) / self.rate
+
+class TokenRateLimiter:
+    """Process-wide token budget shared by every agent. Calls reserve an
+    estimate before they start, queue by stage priority when the budget is
+    short, and settle up with the actual usage once the response is in."""
+
+    def __init__(self, input_tokens_per_minute, output_tokens_per_minute):
+        self.buckets = {}
+        if input_tokens_per_minute > 0:
+            self.buckets["input"] = TokenBucket(input_tokens_per_minute)
+        if output_tokens_per_minute > 0:
+            self.buckets["output"] = TokenBucket(output_tokens_per_minute)
+
+        self.paused_until = 0.0
+        self.waits = {}
+        self.retries = {}
+        self._waiters = []
+        self._order = itertools.count()
+        self._timer = None
+
+    def _refill(self):
+        now = time.monotonic()
+        for bucket in self.buckets.values():
+            bucket.refill(now)
+
+        return now
+
+    def _seconds_until(self, cost, now):
+        wait = max(self.paused_until - now, 0)
+        for name, bucket in self.buckets.items():
+            wait = max(wait, bucket.seconds_until(cost.get(name, 0)))
+
+        return wait
+
+    def _take(self, cost):
+        for name, bucket in self.buckets.items():
+            bucket.tokens -= min(cost.get(name, 0), bucket.capacity)
+
+    def _wake(self):
+        # Strictly by priority: a waiting high priority call is never overtaken
+        self._timer = None
+        now = self._refill()
+
+        while self._waiters:
+            _, _, cost, future = self._waiters[0]
+            if future.cancelled():
+                heapq.heappop(self._waiters)
+                continue
+
+            wait = self._seconds_until(cost, now)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._wake)
+                return
+
+            heapq.heappop(self._waiters)
+            self._take(cost)
+            future.set_result(None)
+
+    async def acquire(self, stage, cost):
+        start_time = time.monotonic()
+        now = self._refill()
+
+        if not self._waiters and self._seconds_until(cost, now) == 0:
+            self._take(cost)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            priority = STAGE_PRIORITIES.get(stage, 2) + (BACKGROUND_PRIORITY if background_work.get() else 0)
+            heapq.heappush(self._waiters, (priority, next(self._order), cost, future))
+            self._reschedule()
+
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Let the next caller in if we were at the front
+                self._reschedule()
+                raise
+
+        waited = time.monotonic() - start_time
+        RATE_LIMIT_WAIT.labels(stage).observe(waited)
+
+        stats = self.waits.setdefault(stage, {"calls": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0})
+        stats["calls"] += 1
+        stats["total_wait_seconds"] += waited
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def _reschedule(self):
+        # The front of the queue may have changed, so work out the wait again
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wake()
+
+    def settle(self, reserved, actual):
+        # Give back what the estimate overshot, or run a debt if it undershot
+        for name, bucket in self.buckets.items():
+            bucket.tokens += min(reserved.get(name, 0), bucket.capacity) - actual.get(name, 0)
+
+    def back_off(self, seconds):
+        # The API said slow down, so every stage waits, not just the one that got the 429
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def record_retry(self, stage, status_code):
+        RATE_LIMIT_RETRIES.labels(stage, str(status_code)).inc()
+        self.retries[stage] = self.retries.get(stage, 0) + 1
+
+    def stats(self):
+        self._refill()
+
+        return {
+            "budgets": {
+                name: {"tokens_per_minute": bucket.capacity, "available": round(bucket.tokens)}
+                for name, bucket in self.buckets.items()
+            },
+            "waiting": len(self._waiters),
+            "paused_for_seconds": max(self.paused_until - time.monotonic(), 0),
+            "stages": {
+                stage: {
+                    **stats,
+                    "avg_wait_seconds": stats["total_wait_seconds"] / stats["calls"] if stats["calls"] else 0.0,
+                    "retries": self.retries.get(stage, 0),
+                }
+                for stage, stats in self.waits.items()
+            },
+        }
+
+rate_limiter = TokenRateLimiter(INPUT_TOKENS_PER_MINUTE, OUTPUT_TOKENS_PER_MINUTE)
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retrying a failed model call, or None if it shouldn't be retried."""
+    status_code = getattr(error, "status_code", None)
+    retryable = status_code in RETRYABLE_STATUS_CODES or isinstance(error, anthropic.APIConnectionError)
+    if not retryable or attempt >= LLM_MAX_RETRIES:
+        return None
+
+    backoff = min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt)
+
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        retry_after = float(retry_after) if retry_after is not None else None
+    except ValueError:
+        retry_after = None
+
+    # Jitter keeps the stages that were all throttled at once from retrying in lockstep
+    if retry_after is not None:
+        return retry_after + random.uniform(0, backoff / 2)
+
+    return random.uniform(0, backoff)
+
+def usage_of(message):
+    usage = getattr(message, "usage_metadata", None) or {}
+    return {"input": usage.get("input_tokens", 0), "output": usage.get("output_tokens", 0)}
+
+class RateLimitedChatMixin:
+    """Routes a chat model's calls through the shared rate limiter, with
+    jittered retries on 429 and 529 responses. Mixed in ahead of the model
+    class, which needs a `stage` field."""
+
+    async def _before_retry(self, error, delay):
+        status_code = getattr(error, "status_code", None)
+        rate_limiter.record_retry(self.stage, status_code or type(error).__name__)
+        logger.warning("%s: model call failed (%s), retrying in %.1fs", self.stage, status_code or type(error).__name__, delay)
+
+        if status_code in THROTTLE_STATUS_CODES:
+            # Throttling holds back every stage, and the wait happens in acquire()
+            rate_limiter.back_off(delay)
+        else:
+            await asyncio.sleep(delay)
+
+    def _reservation(self, messages, kwargs):
+        output_tokens = kwargs.get("max_tokens") or getattr(self, "max_tokens", None) or getattr(self, "output_tokens", 1024)
+        return {"input": estimate_tokens(messages), "output": output_tokens}
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        cost = self._reservation(messages, kwargs)
+
+        for attempt in itertools.count():
+            await rate_limiter.acquire(self.stage, cost)
+
+            try:
+                result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                # Nothing was generated, so nothing was spent
+                rate_limiter.settle(cost, {})
+                delay = retry_delay(e, attempt)
+                if delay is None:
+                    raise
+
+                await self._before_retry(e, delay)
+                continue
+
+            rate_limiter.settle(cost, usage_of(result.generations[0].message))
+
+            return result
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        cost = self._reservation(messages, kwargs)
+
+        for attempt in itertools.count():
+            await rate_limiter.acquire(self.stage, cost)
+
+            actual = {}
+            started = False
+            try:
+                async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    started = True
+                    for name, tokens in usage_of(chunk.message).items():
+                        actual[name] = actual.get(name, 0) + tokens
+                    yield chunk
+            except Exception as e:
+                rate_limiter.settle(cost, actual)
+                # Chunks already went to the caller, so only a stream that never started can be retried
+                delay = None if started else retry_delay(e, attempt)
+                if delay is None:
+                    raise
+
+                await self._before_retry(e, delay)
+                continue
+
+            rate_limiter.settle(cost, actual)
+
+            return
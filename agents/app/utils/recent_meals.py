@@ -0,0 +1,116 @@
+from bson import ObjectId
+from dotenv import load_dotenv
+import os
+from .database import get_collection
+from .households import current_household, household_filter, household_of
+from .serialization import loads
+from .constants import WEEKLY_MEAL_PLANS_COLLECTION, RECENT_MEALS_DIGEST_COLLECTION
+from .telemetry import get_logger, span
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# How many of the latest saved weeks the agents see
+RECENT_MEALS_WEEKS = int(os.getenv("RECENT_MEALS_WEEKS", "2"))
+
+# Only what the agents need to avoid repeating themselves, not recipes or grocery lists
+RECENT_MEALS_PROJECTION = {"startDate": 1, "meal_plan.meals.title": 1, "meal_plan.meals.coreIngredients": 1}
+
+def summarize_plan(request_id, meal_plan, start_date=None):
+    if isinstance(meal_plan, str):
+        try:
+            meal_plan = loads(meal_plan)
+        except ValueError:
+            meal_plan = {}
+
+    meals = meal_plan.get("meals", []) if isinstance(meal_plan, dict) else []
+
+    return {
+        "request_id": ObjectId(request_id),
+        "startDate": start_date,
+        "meals": [
+            {"title": meal.get("title"), "coreIngredients": meal.get("coreIngredients", [])}
+            for meal in meals if isinstance(meal, dict)
+        ],
+    }
+
+async def ensure_recent_meals_indexes():
+    # A household's newest saved plans first; _id carries the creation time
+    await get_collection(WEEKLY_MEAL_PLANS_COLLECTION).create_index([("householdId", 1), ("status", 1), ("_id", -1)])
+
+async def load_recent_weeks(household_id):
+    collection = get_collection(WEEKLY_MEAL_PLANS_COLLECTION)
+
+    with span("mongo.find", collection=WEEKLY_MEAL_PLANS_COLLECTION):
+        plans = await collection.find({**household_filter(household_id), "status": "Available"}, RECENT_MEALS_PROJECTION) \
+            .sort("_id", -1).limit(RECENT_MEALS_WEEKS).to_list(length=RECENT_MEALS_WEEKS)
+
+    return [summarize_plan(plan["_id"], plan.get("meal_plan"), plan.get("startDate")) for plan in plans]
+
+async def get_recent_weeks(household_id=None):
+    """Reads the household's precomputed digest, rebuilding it from weekly_meal_plans if it is missing."""
+    household_id = household_id or current_household.get()
+    digest_collection = get_collection(RECENT_MEALS_DIGEST_COLLECTION)
+
+    # One digest per household, keyed by the household id
+    with span("mongo.find_one", collection=RECENT_MEALS_DIGEST_COLLECTION):
+        digest = await digest_collection.find_one({"_id": household_id})
+
+    if digest is not None:
+        return digest.get("weeks", [])
+
+    weeks = await load_recent_weeks(household_id)
+    with span("mongo.update_one", collection=RECENT_MEALS_DIGEST_COLLECTION):
+        await digest_collection.update_one({"_id": household_id}, {"$setOnInsert": {"weeks": weeks}}, upsert=True)
+
+    return weeks
+
+async def update_recent_meals_digest(plans, documents=None):
+    """Adds freshly saved plans ({request_id: meal_plan}) to their households'
+    digests, keeping the newest weeks. documents maps a request_id to its
+    weekly_meal_plans document, for the start date and household."""
+    documents = documents or {}
+    households = {}
+    for request_id, meal_plan in plans.items():
+        document = documents.get(request_id) or {}
+        households.setdefault(household_of(document), []).append(summarize_plan(request_id, meal_plan, document.get("startDate")))
+
+    digest_collection = get_collection(RECENT_MEALS_DIGEST_COLLECTION)
+
+    for household_id, weeks in households.items():
+        with span("mongo.find_one", collection=RECENT_MEALS_DIGEST_COLLECTION):
+            has_digest = await digest_collection.find_one({"_id": household_id}, {"_id": 1}) is not None
+
+        if not has_digest:
+            # Start from the saved plans, or the digest would only hold this week and never be rebuilt
+            recent_weeks = await load_recent_weeks(household_id)
+            with span("mongo.update_one", collection=RECENT_MEALS_DIGEST_COLLECTION):
+                await digest_collection.update_one({"_id": household_id}, {"$setOnInsert": {"weeks": recent_weeks}}, upsert=True)
+
+        with span("mongo.update_one", collection=RECENT_MEALS_DIGEST_COLLECTION):
+            # Drop earlier copies first so a re-saved plan isn't listed twice
+            await digest_collection.update_one(
+                {"_id": household_id},
+                {"$pull": {"weeks": {"request_id": {"$in": [week["request_id"] for week in weeks]}}}},
+            )
+            await digest_collection.update_one(
+                {"_id": household_id},
+                {"$push": {"weeks": {"$each": weeks, "$sort": {"request_id": -1}, "$slice": RECENT_MEALS_WEEKS}}},
+                upsert=True,
+            )
+
+def format_recent_weeks(weeks):
+    if not weeks:
+        return "No recent meals."
+
+    lines = []
+    for week in weeks:
+        label = f"Week of {week['startDate']}" if week.get("startDate") else "Previous week"
+        meals = "; ".join(
+            f"{meal['title']} ({', '.join(meal.get('coreIngredients') or [])})" for meal in week.get("meals", [])
+        )
+        lines.append(f"{label}: {meals}")
+
+    return "\n".join(lines)
@@ -0,0 +1,87 @@
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+import time
+
+class PrunedSqliteSaver(AsyncSqliteSaver):
+    """AsyncSqliteSaver that records when each thread was last checkpointed,
+    so idle threads can be pruned by TTL and least recent use."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pruned = 0
+        self._threads_setup = False
+
+    async def setup(self):
+        await super().setup()
+        if self._threads_setup:
+            return
+
+        async with self.lock:
+            if self._threads_setup:
+                return
+
+            await self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoint_threads (
+                    thread_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS checkpoint_threads_updated_at ON checkpoint_threads (updated_at);
+                """
+            )
+            # Threads checkpointed before this table existed start their TTL now
+            await self.conn.execute(
+                "INSERT OR IGNORE INTO checkpoint_threads (thread_id, updated_at) SELECT DISTINCT thread_id, ? FROM checkpoints",
+                (time.time(),),
+            )
+            await self.conn.commit()
+
+            self._threads_setup = True
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        result = await super().aput(config, checkpoint, metadata, new_versions)
+
+        async with self.lock:
+            await self.conn.execute(
+                "INSERT INTO checkpoint_threads (thread_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (str(config["configurable"]["thread_id"]), time.time()),
+            )
+            await self.conn.commit()
+
+        return result
+
+    async def adelete_thread(self, thread_id):
+        await super().adelete_thread(thread_id)
+
+        async with self.lock:
+            await self.conn.execute("DELETE FROM checkpoint_threads WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+    async def prune(self, max_threads, ttl_seconds, running=()):
+        """Deletes threads last checkpointed more than ttl_seconds ago and the
+        least recently checkpointed ones beyond max_threads, except those in
+        running. Returns how many were deleted."""
+        await self.setup()
+
+        async with self.lock:
+            async with self.conn.execute(
+                "SELECT thread_id FROM checkpoint_threads WHERE updated_at < ? "
+                "OR thread_id NOT IN (SELECT thread_id FROM checkpoint_threads ORDER BY updated_at DESC LIMIT ?)",
+                (time.time() - ttl_seconds, max_threads),
+            ) as cursor:
+                stale = [(row[0],) for row in await cursor.fetchall() if row[0] not in running]
+
+            for table in ("checkpoints", "writes", "checkpoint_threads"):
+                await self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", stale)
+            await self.conn.commit()
+
+        self.pruned += len(stale)
+        return len(stale)
+
+    async def stats(self):
+        await self.setup()
+
+        async with self.lock, self.conn.execute("SELECT COUNT(*) FROM checkpoint_threads") as cursor:
+            threads = (await cursor.fetchone())[0]
+
+        return {"backend": "sqlite", "threads": threads, "pruned": self.pruned}
@@ -0,0 +1,16 @@
+from contextlib import contextmanager
+import time
+
+# Seconds spent in each import and startup phase, in the order they ran
+phase_seconds = {}
+
+@contextmanager
+def timed_phase(name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_seconds[name] = time.perf_counter() - start_time
+
+def format_phases(prefix):
+    return ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in phase_seconds.items() if name.startswith(prefix))
@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from opentelemetry import trace
+from prometheus_client import Counter, Gauge, Histogram
+import logging
+import os
+import random
+import sys
+import time
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Full sink payloads and model outputs are only logged for this fraction of calls
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0"))
+
+# Set by stage_span and picked up by every log line and span nested inside it
+current_request_id = ContextVar("request_id", default="-")
+
+tracer = trace.get_tracer("meal_planner")
+
+STAGE_LATENCY = Histogram(
+    "meal_planner_stage_latency_seconds", "Time to run one request through a stage", ["stage"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+OPERATION_LATENCY = Histogram(
+    "meal_planner_operation_latency_seconds", "Latency of MongoDB, Kafka and model calls", ["operation"],
+)
+IN_FLIGHT = Gauge("meal_planner_in_flight_requests", "Requests currently running in a stage", ["stage"])
+LLM_TURNS = Counter("meal_planner_llm_turns_total", "Model calls made by a stage", ["stage"])
+FAILURES = Counter("meal_planner_failures_total", "Failed stage runs and dependency calls", ["name"])
+WORKER_RECORDS = Counter("meal_planner_worker_records_total", "Records handled by the Kafka worker", ["topic", "outcome"])
+RATE_LIMIT_WAIT = Histogram(
+    "meal_planner_rate_limit_wait_seconds", "Time a model call waited for the shared token budget", ["stage"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+RATE_LIMIT_RETRIES = Counter("meal_planner_model_retries_total", "Model calls retried after a throttled or failed response", ["stage", "reason"])
+JOIN_PENDING = Gauge("meal_planner_join_pending", "Requests waiting for their child or adult plan")
+JOIN_DROPPED = Counter("meal_planner_join_dropped_total", "Half-joined requests dropped from the join state", ["reason"])
+JOIN_WAIT = Histogram(
+    "meal_planner_join_wait_seconds", "Time between the first and second plan of a request arriving",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+FIRST_MEAL_LATENCY = Histogram(
+    "meal_planner_format_first_meal_seconds", "Time from starting the format agent to its first streamed meal",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+WORKER_PENDING = Gauge("meal_planner_worker_pending_records", "Records consumed but not yet committed", ["topic"])
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = current_request_id.get()
+        return True
+
+def _configure_logging():
+    logger = logging.getLogger("meal_planner")
+    if logger.handlers:
+        return logger
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(_RequestIdFilter())
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s level=%(levelname)s logger=%(name)s request_id=%(request_id)s %(message)s"
+    ))
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+    logger.propagate = False
+
+    return logger
+
+_configure_logging()
+
+def get_logger(name):
+    return logging.getLogger(f"meal_planner.{name.rsplit('.', 1)[-1]}")
+
+def log_payload(logger, label, payload):
+    # Meal plans are large, so they're only logged for a sample of calls
+    if LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        logger.info("%s: %s", label, payload)
+
+@contextmanager
+def span(operation, **attributes):
+    """Span and latency histogram for a MongoDB, Kafka or model call."""
+    with tracer.start_as_current_span(operation, attributes={"request_id": current_request_id.get(), **attributes}) as otel_span:
+        start_time = time.perf_counter()
+        try:
+            yield otel_span
+        except Exception as e:
+            otel_span.record_exception(e)
+            FAILURES.labels(operation).inc()
+            raise
+        finally:
+            OPERATION_LATENCY.labels(operation).observe(time.perf_counter() - start_time)
+
+@contextmanager
+def stage_span(stage, request_id):
+    """Span, latency histogram and in-flight gauge for one request in one stage."""
+    token = current_request_id.set(request_id or "-")
+    IN_FLIGHT.labels(stage).inc()
+    start_time = time.perf_counter()
+
+    try:
+        with tracer.start_as_current_span(stage, attributes={"request_id": request_id or "-"}) as otel_span:
+            try:
+                yield otel_span
+            except Exception as e:
+                otel_span.record_exception(e)
+                FAILURES.labels(stage).inc()
+                raise
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start_time)
+        IN_FLIGHT.labels(stage).dec()
+        current_request_id.reset(token)
+
+class ModelTelemetryCallback(BaseCallbackHandler):
+    """Counts model turns and times each model call for a stage."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        LLM_TURNS.labels(self.stage).inc()
+
+        start_time = self._started.pop(run_id, None)
+        if start_time is not None:
+            OPERATION_LATENCY.labels(f"llm.{self.stage}").observe(time.perf_counter() - start_time)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        FAILURES.labels(f"llm.{self.stage}").inc()
@@ -0,0 +1,71 @@
+from langchain_core.callbacks import BaseCallbackHandler
+import time
+from .telemetry import get_logger
+
+logger = get_logger(__name__)
+
+# Anthropic keeps cached prompt prefixes for five minutes
+CACHE_LIFETIME_SECONDS = 300
+
+usage_by_stage = {}
+
+def _stage_usage(stage):
+    if stage not in usage_by_stage:
+        usage_by_stage[stage] = {
+            "calls": 0,
+            "input_tokens": 0,
+            "cache_read_tokens": 0,
+            "cache_creation_tokens": 0,
+            "output_tokens": 0,
+            "cache_breaks": 0,
+            "last_call_at": None,
+        }
+
+    return usage_by_stage[stage]
+
+def record_usage(stage, usage_metadata):
+    details = usage_metadata.get("input_token_details") or {}
+    cache_read = details.get("cache_read") or 0
+    cache_creation = details.get("cache_creation") or 0
+
+    usage = _stage_usage(stage)
+    now = time.time()
+
+    # Writing the cache again while the previous entry should still be live
+    # means the static prefix changed, e.g. a prompt edit that breaks reuse
+    recently_called = usage["last_call_at"] is not None and now - usage["last_call_at"] < CACHE_LIFETIME_SECONDS
+    if recently_called and cache_creation > 0 and cache_read == 0:
+        usage["cache_breaks"] += 1
+        logger.warning("%s: prompt cache was rewritten instead of read, the static prompt prefix may have changed", stage)
+
+    usage["calls"] += 1
+    usage["input_tokens"] += usage_metadata.get("input_tokens", 0)
+    usage["cache_read_tokens"] += cache_read
+    usage["cache_creation_tokens"] += cache_creation
+    usage["output_tokens"] += usage_metadata.get("output_tokens", 0)
+    usage["last_call_at"] = now
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Records input, cached and output tokens for every model call of a stage."""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage_metadata:
+                    record_usage(self.stage, usage_metadata)
+
+def token_usage_stats():
+    stats = {}
+
+    for stage, usage in usage_by_stage.items():
+        input_tokens = usage["input_tokens"]
+        stats[stage] = {
+            **{k: v for k, v in usage.items() if k != "last_call_at"},
+            "cache_hit_rate": usage["cache_read_tokens"] / input_tokens if input_tokens else 0.0,
+        }
+
+    return stats
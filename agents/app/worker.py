@@ -0,0 +1,340 @@
+"""Consumes the pipeline topics with a Kafka consumer group and runs the
+agents directly, instead of waiting for HTTP sink connectors to push batches
+to the routers.
+
+    python -m app.worker
+
+Records are handed to the same start_agent_flow functions the routers use.
+Each partition runs a bounded number of records at once, and its offset is
+only committed once every record before it has produced its output.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable
+from dotenv import load_dotenv
+import asyncio
+import os
+import signal
+from prometheus_client import start_http_server
+from app.routers import child_preferences_agent, adult_preferences_agent, preference_join, shared_preferences_agent, format_output_agent, save_meal_plan
+from app.utils import database
+from app.utils.consume_from_topic import create_consumer, decode_value
+from app.utils.publish_to_topic import start_producer, stop_producer
+from app.utils.preferences_cache import start_preference_watcher, ensure_preference_indexes
+from app.utils.checkpointer import close_checkpointer, prune_checkpoints_periodically
+from app.utils.dedup import ensure_dedup_indexes
+from app.utils.recent_meals import ensure_recent_meals_indexes
+from app.utils.plan_candidates import ensure_candidate_indexes
+from app.utils.model_provider import close_models
+from app.utils.preference_join import preference_join as join_state
+from app.utils.telemetry import get_logger, stage_span, WORKER_RECORDS, WORKER_PENDING
+from app.utils.constants import MEAL_PLAN_REQUEST_TOPIC, CHILD_PREFERENCES_OUTPUT_TOPIC, ADULT_PREFERENCES_OUTPUT_TOPIC, JOINED_PREFERENCES_TOPIC, COMPLETE_MEAL_PLAN_OUTPUT_TOPIC, FORMATTED_MEAL_PLAN_OUTPUT_TOPIC
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+WORKER_GROUP_ID = os.getenv("WORKER_GROUP_ID", "meal-planner-agents")
+# Comma separated, so stages can be split across deployments. preference-join pairs the
+# child and adult outputs itself; use shared-preferences instead to read the Flink joined topic.
+WORKER_STAGES = os.getenv("WORKER_STAGES", "child-preferences,adult-preferences,preference-join,format-output,save-meal-plan")
+WORKER_PARTITION_CONCURRENCY = int(os.getenv("WORKER_PARTITION_CONCURRENCY", "4"))
+WORKER_POLL_BATCH = int(os.getenv("WORKER_POLL_BATCH", "100"))
+WORKER_MAX_RETRIES = int(os.getenv("WORKER_MAX_RETRIES", "3"))
+WORKER_COMMIT_INTERVAL_SECONDS = float(os.getenv("WORKER_COMMIT_INTERVAL_SECONDS", "1"))
+WORKER_DRAIN_TIMEOUT_SECONDS = float(os.getenv("WORKER_DRAIN_TIMEOUT_SECONDS", "60"))
+WORKER_METRICS_PORT = os.getenv("WORKER_METRICS_PORT")
+
+@dataclass
+class Route:
+    stage: str
+    # Turns a record into handler arguments, or None to skip it
+    parse: Callable
+    handler: Callable
+
+async def save_record(item):
+    summary = await save_meal_plan.save_meal_plans([item])
+    if summary["failed"]:
+        raise RuntimeError(f"Saving {summary['retry']} failed")
+
+def build_routes(stages):
+    routes = {
+        MEAL_PLAN_REQUEST_TOPIC: [
+            Route(child_preferences_agent.STAGE, child_preferences_agent.parse_request, child_preferences_agent.start_agent_flow),
+            Route(adult_preferences_agent.STAGE, adult_preferences_agent.parse_request, adult_preferences_agent.start_agent_flow),
+        ],
+        # Both output topics are keyed by request_id, so the consumer group hands the
+        # same partition of each to one worker and every pair meets in one process
+        CHILD_PREFERENCES_OUTPUT_TOPIC: [
+            Route(preference_join.STAGE, preference_join.parse_request, partial(preference_join.join_output, "child")),
+        ],
+        ADULT_PREFERENCES_OUTPUT_TOPIC: [
+            Route(preference_join.STAGE, preference_join.parse_request, partial(preference_join.join_output, "adult")),
+        ],
+        JOINED_PREFERENCES_TOPIC: [
+            Route(shared_preferences_agent.STAGE, shared_preferences_agent.parse_request, shared_preferences_agent.start_agent_flow),
+        ],
+        COMPLETE_MEAL_PLAN_OUTPUT_TOPIC: [
+            Route(format_output_agent.STAGE, format_output_agent.parse_request, format_output_agent.start_agent_flow),
+        ],
+        FORMATTED_MEAL_PLAN_OUTPUT_TOPIC: [
+            Route(save_meal_plan.STAGE, lambda item: (item,) if item.get('request_id') else None, save_record),
+        ],
+    }
+
+    selected = {}
+    for topic, topic_routes in routes.items():
+        topic_routes = [route for route in topic_routes if route.stage in stages]
+        if topic_routes:
+            selected[topic] = topic_routes
+
+    return selected
+
+class PartitionTracker:
+    """Offsets of one partition that are still running. The committable
+    position never moves past a record whose output hasn't been produced."""
+
+    def __init__(self, topic, partition, concurrency):
+        self.topic = topic
+        self.partition = partition
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending = set()
+        # Handled, but waiting on something else before they may be committed
+        self.deferred = set()
+        self.next_offset = None
+        self.committed = None
+        self.paused = False
+        self.revoked = False
+
+    def start(self, offset):
+        self.pending.add(offset)
+        self.next_offset = max(self.next_offset or 0, offset + 1)
+
+    def finish(self, offset):
+        self.pending.discard(offset)
+        self.deferred.discard(offset)
+
+    def backlog(self):
+        return len(self.pending) - len(self.deferred)
+
+    def position(self):
+        if self.pending:
+            return min(self.pending)
+
+        return self.next_offset
+
+class TopicWorker:
+    def __init__(self, consumer, routes, concurrency=WORKER_PARTITION_CONCURRENCY, max_retries=WORKER_MAX_RETRIES, retry_delay=1.0):
+        self.consumer = consumer
+        self.routes = routes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.partitions = {}
+        self.tasks = set()
+        self.waiting = set()
+        # confluent_kafka's consume() blocks, so it gets a thread of its own
+        self._poll_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kafka-consumer-poll")
+
+    def _on_revoke(self, consumer, partitions):
+        # Runs on the poll thread. Work still running for these partitions is
+        # not committed; the new owner redelivers it and dedup replays the result.
+        for key in partitions:
+            tracker = self.partitions.get(key)
+            if tracker is not None:
+                tracker.revoked = True
+
+    def _tracker(self, topic, partition):
+        tracker = self.partitions.get((topic, partition))
+        if tracker is None or tracker.revoked:
+            tracker = PartitionTracker(topic, partition, self.concurrency)
+            self.partitions[(topic, partition)] = tracker
+
+        return tracker
+
+    async def run(self, stop):
+        loop = asyncio.get_running_loop()
+        self.consumer.subscribe(list(self.routes), on_revoke=self._on_revoke)
+        committer = asyncio.create_task(self._commit_periodically(stop))
+
+        logger.info("worker: consuming %s as %s", ", ".join(self.routes), WORKER_GROUP_ID)
+
+        try:
+            while not stop.is_set():
+                messages = await loop.run_in_executor(self._poll_executor, self.consumer.consume, WORKER_POLL_BATCH, 0.5)
+
+                for message in messages:
+                    if message.error() is not None:
+                        logger.warning("worker: consume error %s", message.error())
+                        continue
+
+                    self._dispatch(message)
+
+                await self._apply_backpressure()
+        finally:
+            await self._drain()
+            committer.cancel()
+            await asyncio.gather(committer, return_exceptions=True)
+            await self.commit()
+            await loop.run_in_executor(self._poll_executor, self.consumer.close)
+            self._poll_executor.shutdown()
+
+    def _dispatch(self, message):
+        tracker = self._tracker(message.topic(), message.partition())
+        tracker.start(message.offset())
+        WORKER_PENDING.labels(message.topic()).inc()
+
+        task = asyncio.create_task(self._process(tracker, message.offset(), message.value()))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _process(self, tracker, offset, raw):
+        try:
+            async with tracker.semaphore:
+                outcome, deferred = await self._handle(tracker, offset, raw)
+        except asyncio.CancelledError:
+            # Cut off at shutdown: leave the offset uncommitted so it is redelivered
+            WORKER_PENDING.labels(tracker.topic).dec()
+            raise
+
+        WORKER_RECORDS.labels(tracker.topic, outcome).inc()
+
+        if deferred:
+            # The first plan of a join pair: keep its offset until the pair has been handled
+            tracker.deferred.add(offset)
+            waiter = asyncio.create_task(self._finish_when_done(tracker, offset, deferred))
+            self.waiting.add(waiter)
+            waiter.add_done_callback(self.waiting.discard)
+        else:
+            WORKER_PENDING.labels(tracker.topic).dec()
+            tracker.finish(offset)
+
+    async def _finish_when_done(self, tracker, offset, deferred):
+        await asyncio.gather(*deferred)
+        WORKER_PENDING.labels(tracker.topic).dec()
+        tracker.finish(offset)
+
+    async def _handle(self, tracker, offset, raw):
+        try:
+            item = decode_value(raw)
+        except ValueError:
+            logger.warning("worker: skipping undecodable record %s[%d]@%d", tracker.topic, tracker.partition, offset)
+            return "invalid", []
+
+        # The request topic feeds both the child and adult agents
+        results = await asyncio.gather(*(self._run_route(route, item) for route in self.routes[tracker.topic]))
+        outcome = "processed" if all(ok for ok, _ in results) else "failed"
+
+        return outcome, [waiter for _, waiter in results if waiter is not None]
+
+    async def _run_route(self, route, item):
+        # Returns whether the route succeeded, and a future if the handler asked to hold the offset
+        args = route.parse(item)
+        if args is None:
+            return True, None
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with stage_span(route.stage, args[0]):
+                    result = await route.handler(*args)
+                return True, result if isinstance(result, asyncio.Future) else None
+            except Exception:
+                if attempt == self.max_retries:
+                    # Give up so one bad record can't stall the partition forever
+                    logger.exception("%s failed after %d attempt(s), skipping", route.stage, attempt + 1)
+                    return False, None
+
+                logger.warning("%s failed, retrying", route.stage, exc_info=True)
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    async def _apply_backpressure(self):
+        # Stop fetching partitions that have a deep backlog until they catch up
+        to_pause = []
+        to_resume = []
+        for key, tracker in self.partitions.items():
+            if tracker.revoked:
+                continue
+
+            # Records waiting on a join partner don't count, or two partitions could wait on each other
+            if not tracker.paused and tracker.backlog() >= self.concurrency * 2:
+                tracker.paused = True
+                to_pause.append(key)
+            elif tracker.paused and tracker.backlog() < self.concurrency:
+                tracker.paused = False
+                to_resume.append(key)
+
+        if to_pause:
+            await asyncio.to_thread(self.consumer.pause, to_pause)
+        if to_resume:
+            await asyncio.to_thread(self.consumer.resume, to_resume)
+
+    async def _commit_periodically(self, stop):
+        while not stop.is_set():
+            await asyncio.sleep(WORKER_COMMIT_INTERVAL_SECONDS)
+            await self._apply_backpressure()
+            await self.commit()
+
+    async def commit(self):
+        offsets = []
+        for tracker in self.partitions.values():
+            position = tracker.position()
+            if not tracker.revoked and position is not None and position != tracker.committed:
+                offsets.append((tracker.topic, tracker.partition, position))
+                tracker.committed = position
+
+        if offsets:
+            try:
+                await asyncio.to_thread(self.consumer.commit, offsets)
+            except Exception:
+                logger.exception("worker: offset commit failed")
+                for tracker in self.partitions.values():
+                    tracker.committed = None
+
+    async def _drain(self):
+        if not self.tasks:
+            return
+
+        logger.info("worker: waiting for %d record(s) to finish", len(self.tasks))
+        _, pending = await asyncio.wait(self.tasks, timeout=WORKER_DRAIN_TIMEOUT_SECONDS)
+        if pending:
+            logger.warning("worker: %d record(s) still running at shutdown, they will be redelivered", len(pending))
+            for task in pending:
+                task.cancel()
+
+async def main():
+    if WORKER_METRICS_PORT:
+        start_http_server(int(WORKER_METRICS_PORT))
+
+    routes = build_routes({stage.strip() for stage in WORKER_STAGES.split(",")})
+
+    await database.connect()
+    await ensure_dedup_indexes()
+    await ensure_recent_meals_indexes()
+    await ensure_preference_indexes()
+    await ensure_candidate_indexes()
+    start_producer()
+    preference_watcher = start_preference_watcher()
+    join_expiry = asyncio.create_task(join_state.expire_periodically())
+    checkpoint_pruning = asyncio.create_task(prune_checkpoints_periodically())
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await TopicWorker(create_consumer(WORKER_GROUP_ID), routes).run(stop)
+    finally:
+        join_expiry.cancel()
+        checkpoint_pruning.cancel()
+        if preference_watcher is not None:
+            preference_watcher.cancel()
+        await asyncio.to_thread(stop_producer)
+        await close_checkpointer()
+        await close_models()
+        database.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
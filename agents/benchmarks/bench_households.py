@@ -0,0 +1,119 @@
+"""Lookup latency for a household's preferences and recent meals as the
+number of households grows.
+
+Households are seeded with app.seed_households, then the tools' lookups
+run for randomly chosen households: preferences straight from MongoDB
+(cache dropped first), preferences from the per-household cache, the
+recent meals digest, and resolving a request to its household.
+
+Latency only stays flat on a real MongoDB, where the lookups use the
+householdId indexes. mongomock scans every document, so without
+--mongodb-uri the uncached numbers grow with the household count. The run
+uses a scratch database, dropped afterwards with --drop.
+
+From the agents directory:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_households --mongodb-uri mongodb://localhost:27017 --households 1 100 10000 100000 --drop
+    python -m benchmarks.bench_households --households 1 100 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+async def timed(fn, lookups):
+    samples = []
+    for _ in range(lookups):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+async def docs_examined(collection, query):
+    plan = await collection.find(query).explain()
+    return plan.get("executionStats", {}).get("totalDocsExamined", "-")
+
+async def main(sizes, lookups, weeks, mongodb_uri, drop):
+    os.environ.setdefault("MONGODB_DATABASE", "meal_planner_bench")
+    if mongodb_uri:
+        os.environ["MONGODB_URI"] = mongodb_uri
+    else:
+        # Patches mongomock so the seeding bulk writes work
+        from benchmarks.bench_stages import AsyncMongoMockClient
+
+    from app.seed_households import seed_households, household_id
+    from app.utils import database
+    from app.utils.database import get_collection, get_database
+    from app.utils.households import get_request_household, household_filter, _request_households
+    from app.utils.preferences_cache import preference_cache, get_preference_snapshot, ensure_preference_indexes
+    from app.utils.recent_meals import get_recent_weeks, ensure_recent_meals_indexes
+    from app.utils.constants import MEAL_PREFERENCES_COLLECTION, WEEKLY_MEAL_PLANS_COLLECTION
+
+    if not mongodb_uri:
+        database.set_client(AsyncMongoMockClient())
+
+    await ensure_preference_indexes()
+    await ensure_recent_meals_indexes()
+
+    preferences = get_collection(MEAL_PREFERENCES_COLLECTION)
+    plans = get_collection(WEEKLY_MEAL_PLANS_COLLECTION)
+    rng = random.Random(0)
+
+    print(f"\n{'households':>10}{'prefs p50/p99 ms':>20}{'cached p50/p99 ms':>20}{'recent p50/p99 ms':>20}{'request p50/p99 ms':>20}{'docs examined':>15}")
+
+    seeded = 0
+    try:
+        for size in sorted(sizes):
+            await seed_households(size, weeks, start=seeded)
+            seeded = size
+
+            def pick():
+                return household_id(rng.randrange(size))
+
+            async def cold_preferences():
+                household = pick()
+                preference_cache.invalidate(household)
+                await get_preference_snapshot(household)
+
+            async def cached_preferences():
+                await get_preference_snapshot(household_id(0))
+
+            async def recent_meals():
+                await get_recent_weeks(pick())
+
+            request_ids = [str(doc["_id"]) async for doc in plans.find({}, {"_id": 1}).limit(lookups)]
+
+            async def request_household():
+                _request_households.clear()
+                await get_request_household(rng.choice(request_ids))
+
+            results = [
+                await timed(cold_preferences, lookups),
+                await timed(cached_preferences, lookups),
+                await timed(recent_meals, lookups),
+                await timed(request_household, lookups),
+            ]
+            # mongomock can't explain queries
+            examined = await docs_examined(preferences, household_filter(pick())) if mongodb_uri else "-"
+
+            print(f"{size:>10}" + "".join(f"{f'{p50:.3f} / {p99:.3f}':>20}" for p50, p99 in results) + f"{examined:>15}")
+    finally:
+        if drop:
+            await get_database().client.drop_database(get_database().name)
+        database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--households", type=int, nargs="+", default=[1, 100, 1000], help="household counts to measure at")
+    parser.add_argument("--lookups", type=int, default=200, help="lookups timed per measurement")
+    parser.add_argument("--weeks", type=int, default=2, help="saved weekly plans per household")
+    parser.add_argument("--mongodb-uri", help="measure against this MongoDB instead of mongomock")
+    parser.add_argument("--drop", action="store_true", help="drop the scratch database afterwards")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.households, args.lookups, args.weeks, args.mongodb_uri, args.drop))
@@ -0,0 +1,106 @@
+"""Bytes and CPU per message for the topic payload and sink request formats.
+
+Compares the stdlib json the stages used before with orjson, with and
+without zstd compression of the meal plan fields, and the change event
+parsing done by the child and adult agents.
+
+From the agents directory:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_serialization --iterations 2000
+"""
+import argparse
+import json
+import time
+
+from app.utils.common_utils import project_change_event
+from app.utils.serialization import encode_payload, decode_payload, loads
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+def sample_meal_plan():
+    # Shaped like the prose a preferences agent publishes, around 4 KB
+    lines = ["================================== Ai Message ==================================", "", "Here's a weekly dinner plan for the family:", ""]
+    for i, day in enumerate(DAYS):
+        lines += [
+            f"**{day}: Sheet Pan Chicken with Vegetables {i}**",
+            "- Ingredients: chicken thighs, sweet potatoes, broccoli, olive oil, garlic, paprika, salt and pepper",
+            "- Preparation: Toss everything on a sheet pan and roast at 425F for 25 minutes, turning once.",
+            "- Why kids like it: Crispy edges, mild seasoning and soft sweet potatoes that are easy to eat.",
+            "",
+        ]
+    lines += ["**Grocery List:**", ""] + [f"- Item {i}: 2 cups of something fresh" for i in range(30)]
+
+    return "\n".join(lines)
+
+def sample_change_event(i):
+    oid = f"{i:024x}"
+    return {
+        "_id": {"_data": "8266" + oid * 4},
+        "operationType": "insert",
+        "clusterTime": {"$timestamp": {"t": 1700000000, "i": i}},
+        "ns": {"db": "meal_planner", "coll": "weekly_meal_plans"},
+        "documentKey": {"_id": json.dumps({"$oid": oid})},
+        "fullDocument": {
+            "_id": json.dumps({"$oid": oid}),
+            "startDate": "2024-11-18",
+            "status": "Processing",
+            "created": {"$date": 1700000000000},
+        },
+    }
+
+def per_message(fn, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+
+    return (time.process_time() - start) / iterations * 1e6
+
+def bench_payloads(iterations):
+    payload = {"content": sample_meal_plan(), "request_id": "6740f1f3c2a4b5d6e7f80912"}
+    baseline = json.dumps(payload).encode()
+
+    rows = [("json", len(baseline), per_message(lambda: json.dumps(payload).encode(), iterations), per_message(lambda: json.loads(baseline), iterations))]
+    for compression in ("none", "zstd"):
+        encoded = encode_payload(payload, compression)
+        assert decode_payload(encoded) == payload
+
+        rows.append((
+            f"orjson ({compression})",
+            len(encoded),
+            per_message(lambda: encode_payload(payload, compression), iterations),
+            per_message(lambda: decode_payload(encoded), iterations),
+        ))
+
+    print(f"\n{'topic payload':<22}{'bytes':>10}{'saved':>9}{'encode us':>12}{'decode us':>12}")
+    for name, size, encode_us, decode_us in rows:
+        print(f"{name:<22}{size:>10}{1 - size / len(baseline):>9.0%}{encode_us:>12.1f}{decode_us:>12.1f}")
+
+def bench_sink_batch(iterations, batch_size):
+    body = json.dumps([sample_change_event(i) for i in range(batch_size)]).encode()
+
+    def stdlib():
+        # What the routers did before: request.json() and a json.loads per _id
+        return [json.loads(item["fullDocument"]["_id"]).get("$oid") for item in json.loads(body)]
+
+    def projected():
+        return [project_change_event(item)["request_id"] for item in loads(body)]
+
+    assert stdlib() == projected()
+
+    iterations = max(iterations // batch_size, 1)
+    stdlib_us = per_message(stdlib, iterations) / batch_size
+    projected_us = per_message(projected, iterations) / batch_size
+
+    print(f"\n{'change event (' + str(batch_size) + '/batch)':<30}{'us/record':>12}")
+    print(f"{'json + json.loads(_id)':<30}{stdlib_us:>12.2f}")
+    print(f"{'orjson + projection':<30}{projected_us:>12.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="messages encoded and decoded per format")
+    parser.add_argument("--batch-size", type=int, default=100, help="change events per sink request")
+    args = parser.parse_args()
+
+    bench_payloads(args.iterations)
+    bench_sink_batch(args.iterations * 10, args.batch_size)
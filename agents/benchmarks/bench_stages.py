@@ -0,0 +1,200 @@
+"""Per-stage benchmarks for the agents app.
+
+Every stage runs against the deterministic fake chat model, an in-memory
+MongoDB (mongomock_motor) and the in-memory Kafka producer, so the numbers
+reflect the Python-side overhead of the agents rather than the network.
+
+From the agents directory:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_stages --iterations 20 --model-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+
+# Must be set before the app modules are imported: their load_dotenv() calls would otherwise fill these in from a local .env
+os.environ.setdefault("MODEL_PROVIDER", "fake")
+os.environ.setdefault("KAFKA_PRODUCER", "memory")
+os.environ.setdefault("PREFERENCES_CHANGE_STREAM", "false")
+
+from langchain_core.messages import AIMessage, HumanMessage
+from mongomock_motor import AsyncMongoMockClient
+from mongomock.collection import Collection as MockCollection
+from pymongo.results import BulkWriteResult
+
+def mock_bulk_write(self, requests, ordered=True, **kwargs):
+    # mongomock's bulk_write predates the options newer pymongo passes to UpdateOne,
+    # so apply the updates one at a time against the in-memory collection
+    matched = modified = 0
+    upserted = []
+    for i, request in enumerate(requests):
+        result = self.update_one(request._filter, request._doc, upsert=request._upsert)
+        matched += result.matched_count
+        modified += result.modified_count
+        if result.upserted_id is not None:
+            upserted.append({"index": i, "_id": result.upserted_id})
+
+    return BulkWriteResult({"nMatched": matched, "nModified": modified, "nInserted": 0, "nUpserted": len(upserted), "nRemoved": 0, "upserted": upserted}, True)
+
+MockCollection.bulk_write = mock_bulk_write
+
+def tool_call(*names):
+    return AIMessage(content="", tool_calls=[
+        {"name": name, "args": {}, "id": f"call_{i}"} for i, name in enumerate(names)
+    ])
+
+SAMPLE_MEALS = [
+    {
+        "title": f"Meal {i}",
+        "coreIngredients": ["chicken", "rice", "broccoli", "cheese"],
+        "kidsVersion": "Mild and cheesy",
+        "adultVersion": "Extra spice and herbs",
+        "recipe": "Cook everything together. " * 20,
+    }
+    for i in range(7)
+]
+
+# What the format agent's model returns; the grocery list is built locally
+SAMPLE_FORMATTED = json.dumps({
+    "summary": "A week of simple family dinners.",
+    "meals": SAMPLE_MEALS,
+})
+
+class LoopBlockMonitor:
+    """Measures how long the event loop is blocked by sleeping in short
+    intervals and recording how late each wake-up is."""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - start - self.interval
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += max(lag, 0.0)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+async def measure(name, fn, iterations):
+    monitor = LoopBlockMonitor()
+    monitor.start()
+    # Let the monitor settle before timing
+    await asyncio.sleep(0.01)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    for i in range(iterations):
+        await fn(i)
+        # Give the monitor a chance to observe blocking after every iteration
+        await asyncio.sleep(0)
+
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    await monitor.stop()
+
+    return {
+        "stage": name,
+        "iterations": iterations,
+        "wall_ms_per_run": wall / iterations * 1000,
+        "peak_alloc_kib": peak / 1024,
+        "max_loop_block_ms": monitor.max_lag * 1000,
+        "total_loop_block_ms": monitor.total_lag * 1000,
+    }
+
+async def seed_database(client, plan_count):
+    db = client["meal_planner"]
+    await db["meal_preferences"].insert_one({
+        "likes": "pasta, chicken, broccoli",
+        "dislikes": "mushrooms",
+        "hardRequirements": "no nuts",
+        "mealCount": 5,
+    })
+
+    request_ids = []
+    for i in range(plan_count):
+        result = await db["weekly_meal_plans"].insert_one({"week": i, "status": "Processing"})
+        request_ids.append(str(result.inserted_id))
+
+    return request_ids
+
+async def main(iterations, model_latency):
+    os.environ["FAKE_MODEL_LATENCY_SECONDS"] = str(model_latency)
+
+    from app.utils import database
+    from app.utils.model_provider import fake_scripts
+    from app.routers import child_preferences_agent, adult_preferences_agent, shared_preferences_agent, format_output_agent, save_meal_plan
+    from app.utils.grocery_list import with_grocery_list
+
+    fake_scripts["child-preferences"] = [
+        tool_call("get_kid_preferences", "get_hard_requirements", "get_recent_meals"),
+        "Child meal plan. " * 50,
+    ]
+    fake_scripts["adult-preferences"] = [tool_call("get_recent_meals"), "Adult meal plan. " * 50]
+    fake_scripts["format-output"] = [SAMPLE_FORMATTED]
+
+    client = AsyncMongoMockClient()
+    database.set_client(client)
+    request_ids = await seed_database(client, iterations)
+
+    child_plan = "Child meal plan. " * 50
+    adult_plan = "Adult meal plan. " * 50
+    model_output = f"Here is the plan:\n{SAMPLE_FORMATTED}\nEnjoy!"
+
+    async def reflection_graph(i):
+        graph = await shared_preferences_agent.get_graph()
+        await graph.ainvoke(
+            {"messages": [HumanMessage(content=f"Kids meals: {child_plan}\nAdult meals: {adult_plan}")]},
+            {"configurable": {"thread_id": f"bench-{i}"}},
+        )
+
+    async def extract_json(i):
+        format_output_agent.extract_json_from_string(model_output)
+
+    async def grocery_list(i):
+        with_grocery_list({"meals": SAMPLE_MEALS})
+
+    benchmarks = [
+        ("child start_agent_flow", lambda i: child_preferences_agent.start_agent_flow(request_ids[i])),
+        ("adult start_agent_flow", lambda i: adult_preferences_agent.start_agent_flow(request_ids[i])),
+        ("shared reflection graph", reflection_graph),
+        ("shared start_agent_flow", lambda i: shared_preferences_agent.start_agent_flow(request_ids[i], child_plan, adult_plan)),
+        ("format start_agent_flow", lambda i: format_output_agent.start_agent_flow(request_ids[i], model_output)),
+        ("extract_json_from_string", extract_json),
+        ("with_grocery_list", grocery_list),
+        ("save_meal_plans", lambda i: save_meal_plan.save_meal_plans([{"request_id": request_ids[i], "meal_plan": SAMPLE_FORMATTED}])),
+        ("save_meal_plans batch", lambda i: save_meal_plan.save_meal_plans([{"request_id": request_id, "meal_plan": SAMPLE_FORMATTED} for request_id in request_ids])),
+    ]
+
+    results = [await measure(name, fn, iterations) for name, fn in benchmarks]
+
+    print(f"\n{'stage':<28}{'ms/run':>10}{'peak KiB':>12}{'max block ms':>15}{'total block ms':>17}")
+    for result in results:
+        print(
+            f"{result['stage']:<28}{result['wall_ms_per_run']:>10.2f}{result['peak_alloc_kib']:>12.1f}"
+            f"{result['max_loop_block_ms']:>15.2f}{result['total_loop_block_ms']:>17.2f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--model-latency", type=float, default=0.0, help="Seconds the fake model waits per call")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.iterations, args.model_latency))
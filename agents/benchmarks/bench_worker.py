@@ -0,0 +1,85 @@
+"""End-to-end throughput of the Kafka worker against the in-memory broker.
+
+Meal plan requests are written to the request topic and the worker runs
+every stage until each plan is saved, pairing the child and adult plans
+with the built-in join.
+
+From the agents directory:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_worker --requests 50 --model-latency 0.05 --concurrency 1 4 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("KAFKA_CONSUMER", "memory")
+
+# Sets up the fake model, in-memory producer and mongomock before the app is imported
+from benchmarks.bench_stages import AsyncMongoMockClient, SAMPLE_FORMATTED, seed_database, tool_call
+
+async def run(request_count, concurrency):
+    from app.utils import database
+    from app.utils.memory_broker import memory_broker
+    from app.utils.consume_from_topic import create_consumer
+    from app.utils.constants import MEAL_PLAN_REQUEST_TOPIC
+    from app.utils.preference_join import preference_join
+    from app.worker import TopicWorker, build_routes
+
+    client = AsyncMongoMockClient()
+    database.set_client(client)
+    request_ids = await seed_database(client, request_count)
+    plans = client["meal_planner"]["weekly_meal_plans"]
+
+    # Fresh topics and offsets for every run
+    memory_broker.topics.clear()
+    memory_broker.committed.clear()
+
+    stop = asyncio.Event()
+    worker = TopicWorker(create_consumer(f"bench-{concurrency}"), build_routes({
+        "child-preferences", "adult-preferences", "preference-join", "format-output", "save-meal-plan",
+    }), concurrency=concurrency)
+    worker_task = asyncio.create_task(worker.run(stop))
+
+    start = time.perf_counter()
+    for request_id in request_ids:
+        memory_broker.append(MEAL_PLAN_REQUEST_TOPIC, json.dumps({"fullDocument": {"_id": json.dumps({"$oid": request_id})}}), key=request_id)
+
+    while await plans.count_documents({"status": "Available"}) < request_count:
+        await asyncio.sleep(0.01)
+
+    wall = time.perf_counter() - start
+    join_stats = preference_join.stats()
+
+    stop.set()
+    await worker_task
+
+    return wall, join_stats
+
+async def main(request_count, model_latency, concurrencies):
+    os.environ["FAKE_MODEL_LATENCY_SECONDS"] = str(model_latency)
+
+    from app.utils.model_provider import fake_scripts
+
+    fake_scripts["child-preferences"] = [
+        tool_call("get_kid_preferences", "get_hard_requirements", "get_recent_meals"),
+        "Child meal plan. " * 50,
+    ]
+    fake_scripts["adult-preferences"] = [tool_call("get_recent_meals"), "Adult meal plan. " * 50]
+    fake_scripts["format-output"] = [SAMPLE_FORMATTED]
+
+    print(f"\n{'concurrency':<14}{'seconds':>10}{'plans/s':>10}{'joined':>10}{'pending':>10}")
+    for concurrency in concurrencies:
+        wall, join_stats = await run(request_count, concurrency)
+        print(f"{concurrency:<14}{wall:>10.2f}{request_count / wall:>10.1f}{join_stats['joined']:>10}{join_stats['pending']:>10}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--model-latency", type=float, default=0.0, help="Seconds the fake model waits per call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="Records in flight per partition")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.requests, args.model_latency, args.concurrency))
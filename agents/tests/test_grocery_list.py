@@ -0,0 +1,55 @@
+import pytest
+from app.utils.grocery_list import build_grocery_list, categorize, format_quantity, parse_ingredient
+
+def category_of(name):
+    return categorize(parse_ingredient(name)[1])
+
+@pytest.mark.parametrize("teaspoons, expected", [
+    (12, "1/4 cup"),
+    (16, "1/3 cup"),
+    (24, "1/2 cup"),
+    (32, "2/3 cup"),
+    (36, "3/4 cup"),
+    (48, "1 cup"),
+    (72, "1 1/2 cups"),
+])
+def test_volumes_from_a_quarter_cup_are_cups(teaspoons, expected):
+    assert format_quantity("volume", teaspoons) == expected
+
+@pytest.mark.parametrize("teaspoons, expected", [
+    (0.5, "1/2 tsp"),
+    (1, "1 tsp"),
+    (3, "1 tbsp"),
+    (6, "2 tbsp"),
+    (9, "3 tbsp"),
+])
+def test_small_volumes_stay_in_spoons(teaspoons, expected):
+    assert format_quantity("volume", teaspoons) == expected
+
+def test_half_cup_of_milk_is_listed_in_cups():
+    assert parse_ingredient("½ cup milk")[2] == ("volume", 24)
+    assert build_grocery_list([{"coreIngredients": ["½ cup milk"]}]) == {"Dairy": ["Milk (1/2 cup)"]}
+
+def test_cup_amounts_merge_across_meals():
+    meals = [{"coreIngredients": ["1/4 cup milk"]}, {"coreIngredients": ["milk (1/2 cup)"]}]
+    assert build_grocery_list(meals) == {"Dairy": ["Milk (3/4 cup)"]}
+
+@pytest.mark.parametrize("name", ["salt and pepper", "Salt & pepper", "salt and black pepper", "pepper and salt"])
+def test_salt_and_pepper_is_a_seasoning(name):
+    assert category_of(name) == "Sauces and Seasonings"
+
+@pytest.mark.parametrize("name, expected", [
+    ("bell pepper", "Produce"),
+    ("black pepper", "Sauces and Seasonings"),
+    ("chicken broth", "Sauces and Seasonings"),
+    ("macaroni and cheese", "Pasta, Grains and Bread"),
+    ("broccoli and carrots", "Produce"),
+])
+def test_other_names_keep_their_category(name, expected):
+    assert category_of(name) == expected
+
+def test_salt_and_pepper_is_grouped_with_seasonings():
+    assert build_grocery_list([{"coreIngredients": ["salt and pepper", "red bell pepper"]}]) == {
+        "Produce": ["Red bell pepper"],
+        "Sauces and Seasonings": ["Salt and pepper"],
+    }
@@ -14,13 +14,19 @@ async function deleteMealPlan(requestId) {
     const database = client.db("meal_planner");
     const collection = database.collection("weekly_meal_plans");
 
-    const result = await collection.deleteOne({ _id: new ObjectId(requestId) });
+    const deleted = await collection.findOneAndDelete({ _id: new ObjectId(requestId) }, { projection: { householdId: 1 } });
 
-    if (result.deletedCount === 0) {
+    if (!deleted) {
       throw new Error(`Meal plan with ID ${requestId} not found.`);
     }
 
     console.log(`Meal plan with ID ${requestId} deleted successfully.`);
+
+    // Keep the household's recent meals digest from suggesting variety against a deleted plan
+    await database.collection("recent_meals_digest").updateOne(
+      { _id: deleted.householdId || "default" },
+      { $pull: { weeks: { request_id: new ObjectId(requestId) } } }
+    );
   } catch (error) {
     console.error("Error saving data:", error);
   } finally {
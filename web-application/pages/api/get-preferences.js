@@ -3,8 +3,14 @@ const { MongoClient } = require("mongodb");
 require('dotenv').config();
 
 const uri = process.env.MONGODB_URI;
+const defaultHouseholdId = process.env.HOUSEHOLD_ID || "default";
 
-async function getSettings() {
+function householdFilter(householdId) {
+  // Preferences saved before households existed belong to the default household
+  return householdId === "default" ? { householdId: { $in: [householdId, null] } } : { householdId: householdId };
+}
+
+async function getSettings(householdId) {
   const client = new MongoClient(uri);
   let settings = [];
 
@@ -15,7 +21,7 @@ async function getSettings() {
     const collection = database.collection("meal_preferences");
 
     settings = await collection
-      .findOne({}, { projection: { _id: 1, likes: 1, dislikes: 1, hardRequirements: 1, mealCount: 1 } });
+      .findOne(householdFilter(householdId), { projection: { _id: 1, householdId: 1, likes: 1, dislikes: 1, hardRequirements: 1, mealCount: 1 } });
 
     console.log(settings);
   } catch (error) {
@@ -28,7 +34,7 @@ async function getSettings() {
 }
 
 export default async function handler(req, res) {
-  let settings = await getSettings();
+  let settings = await getSettings(req.query.householdId || defaultHouseholdId);
 
   console.dir(settings);
 
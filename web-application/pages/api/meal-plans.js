@@ -3,8 +3,14 @@ const { MongoClient } = require("mongodb");
 require('dotenv').config();
 
 const uri = process.env.MONGODB_URI;
+const defaultHouseholdId = process.env.HOUSEHOLD_ID || "default";
 
-async function getAllMealPlans() {
+function householdFilter(householdId) {
+  // Plans requested before households existed belong to the default household
+  return householdId === "default" ? { householdId: { $in: [householdId, null] } } : { householdId: householdId };
+}
+
+async function getAllMealPlans(householdId) {
   const client = new MongoClient(uri);
   let meal_plans = [];
 
@@ -15,7 +21,7 @@ async function getAllMealPlans() {
     const collection = database.collection("weekly_meal_plans");
 
     meal_plans = await collection
-      .find({}, { projection: { _id: 1, week: 1, startDate: 1, status: 1, meals: 1, meal_plan: 1 } })
+      .find(householdFilter(householdId), { projection: { _id: 1, week: 1, startDate: 1, status: 1, meals: 1, meal_plan: 1 } })
       .sort({ _id: -1 })
       .toArray();
 
@@ -30,7 +36,7 @@ async function getAllMealPlans() {
 }
 
 export default async function handler(req, res) {
-  let meal_plans = await getAllMealPlans();
+  let meal_plans = await getAllMealPlans(req.query.householdId || defaultHouseholdId);
 
   console.dir(meal_plans);
 
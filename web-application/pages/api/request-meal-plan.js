@@ -3,6 +3,7 @@ const { MongoClient, ObjectId } = require("mongodb");
 require('dotenv').config();
 
 const uri = process.env.MONGODB_URI;
+const defaultHouseholdId = process.env.HOUSEHOLD_ID || "default";
 const client = new MongoClient(uri);
 
 function getCurrentWeekOfYear(date = new Date()) {
@@ -28,7 +29,7 @@ function getFirstDayOfWeekMonday(date = new Date()) {
     return firstDay.toISOString().split('T')[0];
 }
 
-async function requestMealPlan() {
+async function requestMealPlan(householdId) {
   try {
     await client.connect();
     
@@ -36,6 +37,7 @@ async function requestMealPlan() {
     const collection = database.collection("weekly_meal_plans");
 
     const data = {
+        householdId: householdId,
         week: getCurrentWeekOfYear(),
         startDate: getFirstDayOfWeekMonday(),
         status: "Processing"
@@ -61,7 +63,7 @@ async function requestMealPlan() {
 export default async function handler(req, res) {
   // Check for the HTTP method if needed, e.g., if it's a POST or GET request
   if (req.method === 'POST') {
-    let data = await requestMealPlan();
+    let data = await requestMealPlan(req.body?.householdId || defaultHouseholdId);
 
     // Return a JSON response with ok: true
     res.status(200).json({ data });
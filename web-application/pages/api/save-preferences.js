@@ -3,8 +3,22 @@ const { MongoClient, ObjectId } = require("mongodb");
 require('dotenv').config();
 
 const uri = process.env.MONGODB_URI;
+const agentsApiUrl = process.env.AGENTS_API_URL;
+const defaultHouseholdId = process.env.HOUSEHOLD_ID || "default";
 const client = new MongoClient(uri);
 
+async function invalidateAgentPreferences(householdId) {
+  if (!agentsApiUrl) {
+    return;
+  }
+
+  try {
+    await fetch(`${agentsApiUrl}/api/invalidate-preferences?household_id=${encodeURIComponent(householdId)}`, { method: "POST" });
+  } catch (error) {
+    console.error("Error invalidating agent preferences:", error);
+  }
+}
+
 async function saveSettings(settingsId, settings) {
   try {
     await client.connect();
@@ -15,6 +29,7 @@ async function saveSettings(settingsId, settings) {
     const filter = { _id: new ObjectId(settingsId) };
         const update = {
             $set: {
+                householdId: settings.householdId,
                 likes: settings.likes,
                 dislikes: settings.dislikes,
                 hardRequirements: settings.hardRequirements,
@@ -24,6 +39,8 @@ async function saveSettings(settingsId, settings) {
 
     const options = { upsert: true };
     const result = await collection.updateOne(filter, update, options);
+
+    await invalidateAgentPreferences(settings.householdId);
   } catch (error) {
     console.error("Error saving data:", error);
   } finally {
@@ -34,9 +51,10 @@ async function saveSettings(settingsId, settings) {
 export default async function handler(req, res) {
   // Check for the HTTP method if needed, e.g., if it's a POST or GET request
   if (req.method === 'POST') {
-    const { _id, likes, dislikes, hardRequirements, mealCount } = req.body;
+    const { _id, householdId, likes, dislikes, hardRequirements, mealCount } = req.body;
 
     const settings = {
+        householdId: householdId || defaultHouseholdId,
         likes,
         dislikes,
         hardRequirements,